@@ -0,0 +1,202 @@
+# coding: utf-8
+"""
+micro-benchmarks for the parsers. run from the repository root:
+
+    python src/bench.py [world_dir]
+
+entry texts are split up front, so the numbers are for the per-entry
+parsers alone and not for reading or splitting files. a synthetic zone
+with a long run of nested P (put in container) commands is timed as well,
+and so are the room graph algorithms on a synthetic grid of rooms, the
+zone reset simulator on the whole world, the mob statistics on a synthetic
+set of mobs and keyword lookups on the whole world.
+"""
+import array
+import random
+import time
+
+import click
+
+from columns import COLUMNS
+from columns import Columns
+from columns import get_numpy
+from graph import RoomGraph
+from keywords import WorldKeywords
+from lookup import PARSER_LOOKUP
+from lookup import find_world_files
+from resets import ResetSimulator
+from stats import difficulty_curves
+from stats import mob_stats
+from utils import parse_entries
+from utils import read_world_file
+from world import World
+from zone import parse_zone
+
+
+def best_time(function, repeat):
+    """
+    smallest wall time of `repeat` calls, which is the least noisy figure
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def load_entry_texts(world_dir):
+    texts = {file_type: [] for file_type in PARSER_LOOKUP}
+    for file_type, filepath in find_world_files(world_dir):
+        _, splitter, validate = PARSER_LOOKUP[file_type]
+        texts[file_type].extend(splitter(read_world_file(filepath, validate)))
+    return texts
+
+
+def bench_parsers(world_dir, repeat=5):
+    """
+    returns a list of (file type, number of entries, entries per second)
+    """
+    results = []
+    for file_type, texts in load_entry_texts(world_dir).items():
+        parser, _, _ = PARSER_LOOKUP[file_type]
+        elapsed = best_time(lambda: parse_entries(texts, parser), repeat)
+        results.append((file_type, len(texts), len(texts) / elapsed if elapsed else float('inf')))
+    return results
+
+
+def make_loot_zone(n_puts):
+    """
+    entry text of a zone that loads one chest and then puts `n_puts` objects
+    into it, each object going into the one loaded half as many commands
+    earlier, so the containers nest about log2(n_puts) deep
+    """
+    lines = ['1', 'Loot~', '100 199 30 2', 'O 0 1 1 100']
+    lines.extend('P 1 {} 1 {}'.format(vnum, vnum // 2) for vnum in range(2, n_puts + 2))
+    lines.append('S')
+    return '\n'.join(lines)
+
+
+def bench_nesting(n_puts=10000, repeat=5):
+    """
+    returns P commands per second for parsing the zone from make_loot_zone
+    """
+    text = make_loot_zone(n_puts)
+    elapsed = best_time(lambda: parse_zone(text), repeat)
+    return n_puts / elapsed if elapsed else float('inf')
+
+
+def make_grid_edges(side):
+    """
+    vnums and two-way (vnum, direction, target) exits of a `side` by `side`
+    grid of rooms, with east/west and north/south exits between neighbours
+    """
+    edges = []
+    for vnum in range(side * side):
+        row, column = divmod(vnum, side)
+        if column + 1 < side:
+            edges.extend([(vnum, 1, vnum + 1), (vnum + 1, 3, vnum)])
+        if row + 1 < side:
+            edges.extend([(vnum, 2, vnum + side), (vnum + side, 0, vnum)])
+    return range(side * side), edges
+
+
+def bench_graph(side=317, repeat=5):
+    """
+    returns a list of (step, seconds) for building the graph of the grid
+    from make_grid_edges and running each algorithm over it once
+    """
+    vnums, edges = make_grid_edges(side)
+    graph = RoomGraph.from_edges(vnums, edges)
+    steps = [
+        ('build', lambda: RoomGraph.from_edges(vnums, edges)),
+        ('path', lambda: graph.shortest_path(0, side * side - 1)),
+        ('components', graph.components),
+        ('one-way', graph.one_way_exits),
+    ]
+    return [(name, best_time(function, repeat)) for name, function in steps]
+
+
+def bench_resets(world_dir, resets=1000, repeat=1):
+    """
+    returns (number of zones, seconds) for resetting every zone of the world
+    `resets` times, with half the mobs and objects lost between resets
+    """
+    world = World.load(world_dir)
+    elapsed = best_time(lambda: ResetSimulator(world, mob_loss=0.5, object_loss=0.5).run(resets), repeat)
+    return len(world.zones), elapsed
+
+
+def make_mob_columns(n_mobs):
+    """
+    mob Columns of `n_mobs` mobs with random levels, dice, xp and gold,
+    spread over 100 zones
+    """
+    r = random.Random(0)
+    arrays = {}
+    for name, typecode in COLUMNS['mob']:
+        arrays[name] = array.array(typecode, (r.randint(0, 50) for _ in range(n_mobs)))
+    arrays['vnum'] = array.array('q', range(n_mobs))
+    arrays['zone'] = array.array('q', (vnum // (n_mobs // 100 or 1) for vnum in range(n_mobs)))
+
+    numpy = get_numpy()
+    if numpy is not None:
+        arrays = {name: numpy.frombuffer(values, dtype=values.typecode) for name, values in arrays.items()}
+    return Columns(arrays, numpy)
+
+
+def bench_stats(n_mobs=100000, repeat=5):
+    """
+    returns seconds for the dice statistics and difficulty curves of the
+    mobs from make_mob_columns
+    """
+    mobs = make_mob_columns(n_mobs)
+    return best_time(lambda: difficulty_curves(mob_stats(mobs)), repeat)
+
+
+def bench_keywords(world_dir, n_lookups=100000, repeat=5):
+    """
+    returns (number of keyword prefixes, seconds per lookup) for looking up
+    every object keyword abbreviation of the world in turn
+    """
+    index = WorldKeywords.from_world(World.load(world_dir)).objects
+    names = list(index.prefixes)
+    names = (names * (n_lookups // len(names) + 1))[:n_lookups]
+    lookup = index.lookup
+    elapsed = best_time(lambda: [lookup(name) for name in names], repeat)
+    return len(index.prefixes), elapsed / n_lookups
+
+
+@click.command()
+@click.option('--repeat', default=5, help='runs per benchmark, the best is reported')
+@click.option('--puts', default=10000, help='P commands in the synthetic zone')
+@click.option('--grid', default=317, help='side of the synthetic room grid')
+@click.option('--resets', default=1000, help='resets of every zone in the reset simulation')
+@click.option('--mobs', default=100000, help='synthetic mobs for the dice statistics')
+@click.argument('world_dir', default='world')
+def bench(world_dir, repeat, puts, grid, resets, mobs):
+    total_entries, total_time = 0, 0.0
+    for file_type, n_entries, rate in bench_parsers(world_dir, repeat):
+        click.echo('{:<4} {:>7} entries {:>12,.0f} entries/sec'.format(file_type, n_entries, rate))
+        total_entries += n_entries
+        total_time += n_entries / rate
+
+    click.echo('all  {:>7} entries {:>12,.0f} entries/sec'.format(total_entries, total_entries / total_time))
+    click.echo('nest {:>7} puts    {:>12,.0f} puts/sec'.format(puts, bench_nesting(puts, repeat)))
+
+    for step, elapsed in bench_graph(grid, repeat):
+        click.echo('graph {:<10} {:>7} rooms {:>9.3f} sec'.format(step, grid * grid, elapsed))
+
+    n_zones, elapsed = bench_resets(world_dir, resets)
+    click.echo('resets {:>5} x {:>4} zones {:>9.3f} sec'.format(resets, n_zones, elapsed))
+
+    backend = 'numpy' if get_numpy() else 'python'
+    click.echo('stats {:>7} mobs ({}) {:>9.3f} sec'.format(mobs, backend, bench_stats(mobs, repeat)))
+
+    n_prefixes, elapsed = bench_keywords(world_dir, repeat=repeat)
+    click.echo('keywords {:>7} prefixes {:>9.0f} ns/lookup'.format(n_prefixes, elapsed * 1e9))
+
+
+if __name__ == '__main__':
+    bench()
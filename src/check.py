@@ -0,0 +1,170 @@
+# coding: utf-8
+"""
+integrity checks for a loaded world: every vnum one entry refers to must
+exist. each check is a set lookup against the records of a World, so the
+whole world is checked in one pass over its entries. the report is a
+plain dict, ready to be written out as JSON:
+
+    {
+        "counts": {"missing_room": 2, ...},
+        "issues": [
+            {"kind": "missing_room", "file_type": "wld", "vnum": 3001,
+             "ref": 9999, "path": null, "detail": "exit 2 leads to a missing room"},
+            ...
+        ]
+    }
+
+`path` is only set for issues about a source file itself: entries that
+don't parse and vnums defined again in another file.
+"""
+import collections
+
+from lookup import get_file_type
+
+
+def make_issue(kind, file_type, vnum, ref, detail, path=None):
+    return dict(kind=kind, file_type=file_type, vnum=vnum, ref=ref, path=path, detail=detail)
+
+
+def get_error_vnum(error):
+    """
+    the vnum on the first line of an entry that failed to parse, or None
+    """
+    first_line = error['text'].lstrip().split('\n', 1)[0].strip().lstrip('#')
+    return int(first_line) if first_line.isdigit() else None
+
+
+def check_parse_errors(world):
+    for path, error in world.errors:
+        detail = error['trace'].strip().splitlines()[-1] if error.get('trace') else 'parse error'
+        yield make_issue('parse_error', get_file_type(path), get_error_vnum(error), None, detail, path)
+
+
+def check_duplicates(world):
+    for file_type, vnum, path, first_path in world.duplicates:
+        detail = 'vnum is already defined in {}, which wins'.format(first_path)
+        yield make_issue('duplicate_vnum', file_type, vnum, None, detail, path)
+
+
+def check_zone_ranges(world):
+    for zone, other in world.zone_map.overlaps:
+        first, second = world.zones[zone], world.zones[other]
+        detail = 'zone range {}-{} overlaps zone {} range {}-{}'.format(
+            first.bottom_room, first.top_room, other, second.bottom_room, second.top_room
+        )
+        yield make_issue('overlapping_zones', 'zon', zone, other, detail)
+
+
+def check_rooms(world):
+    """
+    exits must lead to rooms that exist (-1 is "nowhere" and allowed),
+    door keys must be objects, and the room must be inside its zone
+    """
+    for room in world.rooms.values():
+        for exit in room.exits:
+            if exit.room_linked != -1 and exit.room_linked not in world.rooms:
+                detail = 'exit {} leads to a missing room'.format(exit.dir)
+                yield make_issue('missing_room', 'wld', room.id, exit.room_linked, detail)
+            if exit.key_number > 0 and exit.key_number not in world.objects:
+                detail = 'exit {} is locked with a missing key'.format(exit.dir)
+                yield make_issue('missing_object', 'wld', room.id, exit.key_number, detail)
+
+        zone = world.zones.get(room.zone_number)
+        if zone is None:
+            yield make_issue('missing_zone', 'wld', room.id, room.zone_number, 'room belongs to a missing zone')
+        elif not zone.bottom_room <= room.id <= zone.top_room:
+            detail = 'room is outside its zone range {}-{}'.format(zone.bottom_room, zone.top_room)
+            yield make_issue('outside_zone', 'wld', room.id, zone.id, detail)
+
+
+def check_contents(world, zone, command, contents):
+    """
+    P commands nested under `command`, walked without recursion
+    """
+    pending = [(command, contents)]
+    while pending:
+        container, contents = pending.pop()
+        for put in contents:
+            if put.id not in world.objects:
+                detail = 'P command puts a missing object into {}'.format(container.id)
+                yield make_issue('missing_object', 'zon', zone.id, put.id, detail)
+            pending.append((put, put.contents))
+
+
+def get_zone_references(world, zone):
+    """
+    a (kind, table, vnum, command letter, what) row for every vnum the
+    zone's commands refer to, and the (command, contents) pairs of every
+    object that others are put into
+    """
+    references = []
+    nested = []
+
+    for mob in zone.mobs:
+        references.append(('missing_mob', world.mobs, mob.mob, 'M', 'loads a missing mob'))
+        references.append(('missing_room', world.rooms, mob.room, 'M', 'loads a mob into a missing room'))
+        for given in mob.inventory:
+            references.append(('missing_object', world.objects, given.id, 'G', 'gives a missing object'))
+            nested.append((given, given.contents))
+        for equipped in mob.equipped:
+            references.append(('missing_object', world.objects, equipped.id, 'E', 'equips a missing object'))
+            nested.append((equipped, equipped.contents))
+
+    for loaded in zone.objects:
+        references.append(('missing_object', world.objects, loaded.id, 'O', 'loads a missing object'))
+        references.append(('missing_room', world.rooms, loaded.room, 'O', 'loads an object into a missing room'))
+        nested.append((loaded, loaded.contents))
+
+    for door in zone.doors:
+        references.append(('missing_room', world.rooms, door.room, 'D', 'sets a door in a missing room'))
+
+    for remove in zone.remove_objects:
+        references.append(('missing_room', world.rooms, remove.room, 'R', 'removes an object from a missing room'))
+        references.append(('missing_object', world.objects, remove.id, 'R', 'removes a missing object'))
+
+    return references, nested
+
+
+def check_zone(world, zone):
+    references, nested = get_zone_references(world, zone)
+    for kind, table, vnum, letter, what in references:
+        if vnum not in table:
+            yield make_issue(kind, 'zon', zone.id, vnum, '{} command {}'.format(letter, what))
+
+    for command, contents in nested:
+        yield from check_contents(world, zone, command, contents)
+
+    for door in zone.doors:
+        room = world.rooms.get(door.room)
+        if room is not None and all(exit.dir != door.exit for exit in room.exits):
+            detail = 'D command sets a door on missing exit {} of room {}'.format(door.exit, door.room)
+            yield make_issue('missing_exit', 'zon', zone.id, door.room, detail)
+
+
+def check_shops(world):
+    for shop in world.shops.values():
+        if shop.shopkeeper not in world.mobs:
+            yield make_issue('missing_mob', 'shp', shop.id, shop.shopkeeper, 'shopkeeper is a missing mob')
+        for obj in shop.objects:
+            if obj not in world.objects:
+                yield make_issue('missing_object', 'shp', shop.id, obj, 'shop sells a missing object')
+        for room in shop.rooms:
+            if room not in world.rooms:
+                yield make_issue('missing_room', 'shp', shop.id, room, 'shop is in a missing room')
+
+
+def check_world(world):
+    """
+    every broken reference in `world`, plus the entries that couldn't be
+    parsed at all and the vnums defined more than once, as a report dict
+    """
+    issues = list(check_parse_errors(world))
+    issues.extend(check_duplicates(world))
+    issues.extend(check_zone_ranges(world))
+    issues.extend(check_rooms(world))
+    for zone in world.zones.values():
+        issues.extend(check_zone(world, zone))
+    issues.extend(check_shops(world))
+
+    counts = collections.Counter(issue['kind'] for issue in issues)
+    return dict(counts=dict(sorted(counts.items())), issues=issues)
@@ -0,0 +1,361 @@
+# coding: utf-8
+"""
+the numeric fields of a world as columns: for each kind of entry, flat
+arrays aligned on the entries (vnum, zone, level, dice, gold, weight, flag
+bitmasks as unsigned 64-bit ints and so on). `export_columns` writes each
+kind to a `.npz` file that `numpy.load` reads, and `Columns` filters and
+aggregates them:
+
+    mobs = Columns.load('_columns/mob.npz')
+    strong = mobs.where(mobs.mask(level=(20, 30)))
+    strong.aggregate('xp', 'mean', by='zone')
+
+with NumPy installed the arrays are NumPy arrays and every step is
+vectorized. without it they are `array.array`s and the same calls loop in
+Python, which is slower but gives the same answers. the `.npz` files are
+written by hand, so exporting never needs NumPy.
+"""
+import array
+import ast
+import collections
+import itertools
+import os
+import sys
+import zipfile
+
+# the columns of each kind of entry, with their array.array typecodes.
+# 'affect' has a row per object affect, keyed on the object's vnum.
+COLUMNS = {
+    'mob': (
+        ('vnum', 'q'),
+        ('zone', 'q'),
+        ('level', 'q'),
+        ('thac0', 'q'),
+        ('armor_class', 'q'),
+        ('alignment', 'q'),
+        ('hp_dice', 'q'),
+        ('hp_sides', 'q'),
+        ('hp_bonus', 'q'),
+        ('damage_dice', 'q'),
+        ('damage_sides', 'q'),
+        ('damage_bonus', 'q'),
+        ('gold', 'q'),
+        ('xp', 'q'),
+        ('flags', 'Q'),
+        ('affects', 'Q'),
+    ),
+    'obj': (
+        ('vnum', 'q'),
+        ('zone', 'q'),
+        ('type', 'q'),
+        ('weight', 'q'),
+        ('cost', 'q'),
+        ('rent', 'q'),
+        ('value0', 'q'),
+        ('value1', 'q'),
+        ('value2', 'q'),
+        ('value3', 'q'),
+        ('effects', 'Q'),
+        ('wear', 'Q'),
+    ),
+    'affect': (
+        ('vnum', 'q'),
+        ('zone', 'q'),
+        ('location', 'q'),
+        ('value', 'q'),
+    ),
+    'wld': (
+        ('vnum', 'q'),
+        ('zone', 'q'),
+        ('sector_type', 'q'),
+        ('exits', 'q'),
+        ('flags', 'Q'),
+    ),
+    'shp': (
+        ('vnum', 'q'),
+        ('zone', 'q'),
+        ('shopkeeper', 'q'),
+        ('sell_rate', 'd'),
+        ('buy_rate', 'd'),
+        ('flags', 'Q'),
+        ('trades_with', 'Q'),
+    ),
+}
+
+# .npy dtypes of the typecodes, all little-endian
+DTYPES = {
+    'q': '<i8',
+    'Q': '<u8',
+    'd': '<f8',
+}
+
+AGGREGATES = ('count', 'sum', 'mean', 'min', 'max')
+
+
+def get_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def iter_mob_rows(world, zone_of):
+    for mob in world.mobs.values():
+        hp, damage = mob.max_hit_points, mob.bare_hand_damage
+        yield (
+            mob.id,
+            zone_of(mob.id),
+            mob.level,
+            mob.thac0,
+            mob.armor_class,
+            mob.alignment,
+            hp.dice,
+            hp.sides,
+            hp.bonus,
+            damage.dice,
+            damage.sides,
+            damage.bonus,
+            mob.gold,
+            mob.xp,
+            mob.flag_bits,
+            mob.affect_bits,
+        )
+
+
+def iter_object_rows(world, zone_of):
+    for obj in world.objects.values():
+        values = (list(obj.values) + [0] * 4)[:4]
+        yield (
+            obj.id,
+            zone_of(obj.id),
+            obj.type['value'],
+            obj.weight,
+            obj.cost,
+            obj.rent,
+            *values,
+            obj.effect_bits,
+            obj.wear_bits,
+        )
+
+
+def iter_affect_rows(world, zone_of):
+    for obj in world.objects.values():
+        for affect in obj.affects:
+            yield obj.id, zone_of(obj.id), affect.location, affect.value
+
+
+def iter_room_rows(world, zone_of):
+    for room in world.rooms.values():
+        yield room.id, zone_of(room.id), room.sector_type['value'], len(room.exits), room.flag_bits
+
+
+def iter_shop_rows(world, zone_of):
+    for shop in world.shops.values():
+        yield shop.id, zone_of(shop.id), shop.shopkeeper, shop.sell_rate, shop.buy_rate, shop.flag_bits, shop.trade_bits
+
+
+ROW_ITERATORS = {
+    'mob': iter_mob_rows,
+    'obj': iter_object_rows,
+    'affect': iter_affect_rows,
+    'wld': iter_room_rows,
+    'shp': iter_shop_rows,
+}
+
+
+def build_columns(world, kind):
+    """
+    {column name: array.array} for one kind of entry of a World, in vnum
+    order. entries outside every zone have zone -1.
+    """
+    zone_by_vnum = world.zone_by_vnum
+    rows = sorted(ROW_ITERATORS[kind](world, lambda vnum: zone_by_vnum.get(vnum, -1)))
+    columns = {}
+    for i, (name, typecode) in enumerate(COLUMNS[kind]):
+        columns[name] = array.array(typecode, (row[i] for row in rows))
+    return columns
+
+
+def get_npy_header(typecode, length):
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({},), }}".format(DTYPES[typecode], length)
+    # magic, version and header size take 10 bytes, and the data is aligned to 64
+    padding = 63 - (10 + len(header)) % 64
+    header = header + ' ' * padding + '\n'
+    return b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header.encode('latin1')
+
+
+def write_npz(path, columns):
+    """
+    write {name: array.array} as an uncompressed .npz, the same as
+    numpy.savez does
+    """
+    tmp_path = path + '.tmp'
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED) as f:
+        for name, values in columns.items():
+            if sys.byteorder == 'big':
+                values = array.array(values.typecode, values)
+                values.byteswap()
+            f.writestr(name + '.npy', get_npy_header(values.typecode, len(values)) + values.tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_npz(path):
+    """
+    {name: array.array} from a .npz of one-dimensional arrays in the dtypes
+    of DTYPES
+    """
+    typecodes = {dtype: typecode for typecode, dtype in DTYPES.items()}
+    columns = {}
+    with zipfile.ZipFile(path) as f:
+        for filename in f.namelist():
+            data = f.read(filename)
+            if data[:6] != b'\x93NUMPY':
+                raise RuntimeError('Not a .npy file: "{}" in "{}"'.format(filename, path))
+            start = 10 + int.from_bytes(data[8:10], 'little')
+            header = ast.literal_eval(data[10:start].decode('latin1'))
+            if header['descr'] not in typecodes or len(header['shape']) != 1:
+                raise RuntimeError('Unsupported array "{}" in "{}"'.format(filename, path))
+
+            values = array.array(typecodes[header['descr']], data[start:])
+            if sys.byteorder == 'big':
+                values.byteswap()
+            columns[filename[: -len('.npy')]] = values
+    return columns
+
+
+def export_columns(world, out_dir):
+    """
+    write `<kind>.npz` in `out_dir` for every kind in COLUMNS
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    for kind in COLUMNS:
+        write_npz(os.path.join(out_dir, kind + '.npz'), build_columns(world, kind))
+
+
+class Columns(object):
+    """
+    aligned columns by name. masks are NumPy boolean arrays, or lists of
+    bools without NumPy, and are only meant for the Columns they came from.
+    """
+
+    def __init__(self, arrays, numpy=None):
+        self.arrays = arrays
+        self.numpy = numpy
+
+    @classmethod
+    def load(cls, path, use_numpy=True):
+        numpy = get_numpy() if use_numpy else None
+        if numpy is None:
+            return cls(read_npz(path))
+        with numpy.load(path) as f:
+            return cls({name: f[name] for name in f.files}, numpy)
+
+    @classmethod
+    def from_world(cls, world, kind, use_numpy=True):
+        columns = build_columns(world, kind)
+        numpy = get_numpy() if use_numpy else None
+        if numpy is not None:
+            columns = {name: numpy.frombuffer(values, dtype=values.typecode) for name, values in columns.items()}
+        return cls(columns, numpy)
+
+    def __len__(self):
+        return len(next(iter(self.arrays.values()), ()))
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def mask(self, **conditions):
+        """
+        rows where every named column equals a value, or lies within a
+        (low, high) range, both ends included
+        """
+        if self.numpy is not None:
+            mask = self.numpy.ones(len(self), dtype=bool)
+            for name, condition in conditions.items():
+                values = self.arrays[name]
+                if isinstance(condition, tuple):
+                    mask &= (values >= condition[0]) & (values <= condition[1])
+                else:
+                    mask &= values == condition
+            return mask
+
+        mask = [True] * len(self)
+        for name, condition in conditions.items():
+            if isinstance(condition, tuple):
+                low, high = condition
+                mask = [m and low <= v <= high for m, v in zip(mask, self.arrays[name])]
+            else:
+                mask = [m and v == condition for m, v in zip(mask, self.arrays[name])]
+        return mask
+
+    def flag_mask(self, name, all=0, any=0, none=0):
+        """
+        rows whose bitmask column `name` has every bit of `all`, at least
+        one bit of `any` (when given) and no bit of `none`
+        """
+        values = self.arrays[name]
+        if self.numpy is not None:
+            uint64 = self.numpy.uint64
+            mask = (values & uint64(all)) == uint64(all)
+            if any:
+                mask &= (values & uint64(any)) != 0
+            if none:
+                mask &= (values & uint64(none)) == 0
+            return mask
+
+        return [v & all == all and (not any or v & any) and not v & none for v in values]
+
+    def where(self, mask):
+        """
+        the rows of every column where `mask` is set
+        """
+        if self.numpy is not None:
+            return Columns({name: values[mask] for name, values in self.arrays.items()}, self.numpy)
+        arrays = {name: array.array(v.typecode, itertools.compress(v, mask)) for name, v in self.arrays.items()}
+        return Columns(arrays)
+
+    def aggregate(self, name, how='mean', by=None):
+        """
+        one of AGGREGATES over column `name`, or with `by` a dict of it
+        for each value of that column. the aggregate of no rows is None.
+        """
+        if how not in AGGREGATES:
+            raise RuntimeError('Unknown aggregate: "{}"'.format(how))
+        if by is not None:
+            return self.aggregate_by(name, how, by)
+        if not len(self):
+            return None if how != 'count' else 0
+
+        values = self.arrays[name]
+        if how == 'count':
+            return len(values)
+        if self.numpy is not None:
+            return getattr(self.numpy, how)(values).item()
+        if how == 'mean':
+            return sum(values) / len(values)
+        return dict(sum=sum, min=min, max=max)[how](values)
+
+    def aggregate_by(self, name, how, by):
+        keys, values = self.arrays[by], self.arrays[name]
+        if not len(keys):
+            return {}
+        if self.numpy is not None:
+            numpy = self.numpy
+            order = numpy.argsort(keys, kind='stable')
+            keys, values = keys[order], values[order]
+            starts = numpy.flatnonzero(numpy.r_[True, keys[1:] != keys[:-1]])
+            counts = numpy.diff(numpy.r_[starts, len(keys)])
+            if how == 'count':
+                results = counts
+            elif how == 'mean':
+                results = numpy.add.reduceat(values, starts) / counts
+            else:
+                results = getattr(numpy, dict(sum='add', min='minimum', max='maximum')[how]).reduceat(values, starts)
+            return dict(zip(keys[starts].tolist(), results.tolist()))
+
+        groups = collections.defaultdict(list)
+        for key, value in zip(keys, values):
+            groups[key].append(value)
+        how = dict(count=len, sum=sum, min=min, max=max, mean=lambda v: sum(v) / len(v))[how]
+        return {key: how(group) for key, group in sorted(groups.items())}
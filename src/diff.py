@@ -0,0 +1,40 @@
+# coding: utf-8
+"""
+describe the difference between two versions of a converted file as a JSON
+Patch (RFC 6902). paths address entries by type and vnum rather than by
+position in the file, i.e. they apply to a document shaped like
+
+    {"wld": {"3001": {...}, "3002": {...}}, "mob": {...}, ...}
+
+so a single edited room turns into a single `replace` operation that a
+running server can apply without reloading the rest of the zone.
+"""
+
+
+def get_entry_path(file_type, vnum):
+    return '/{}/{}'.format(file_type, vnum)
+
+
+def diff_entries(file_type, old_entries, new_entries):
+    """
+    compare two lists of parsed entries of the same type by their `id`,
+    returning a list of JSON Patch operations: `remove` for vnums that are
+    gone, then `add` or `replace` for new or changed entries in file order.
+    """
+    old_by_vnum = {entry['id']: entry for entry in old_entries}
+    new_vnums = set(entry['id'] for entry in new_entries)
+
+    operations = []
+
+    for vnum in sorted(set(old_by_vnum) - new_vnums):
+        operations.append(dict(op='remove', path=get_entry_path(file_type, vnum)))
+
+    for entry in new_entries:
+        vnum = entry['id']
+        path = get_entry_path(file_type, vnum)
+        if vnum not in old_by_vnum:
+            operations.append(dict(op='add', path=path, value=entry))
+        elif old_by_vnum[vnum] != entry:
+            operations.append(dict(op='replace', path=path, value=entry))
+
+    return operations
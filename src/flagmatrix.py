@@ -0,0 +1,103 @@
+# coding: utf-8
+"""
+every flag of a world as a bitset matrix: for each file type, the vnums in
+order and, for each kind of flag, one packed 64-bit mask per entry. any
+combination of flags is then a single pass of bitwise ANDs over the masks
+(vectorized with NumPy when it is installed) instead of a scan of every
+entry's list of flag dicts:
+
+    flags = FlagMatrix.from_world(World.load('world'))
+    flags.query('obj', effects=dict(all=['NODROP', 'ANTI_GOOD']))
+    flags.query('wld', flags=dict(any=['DARK', 'INDOORS'], none=['DEATH']))
+
+the masks are the bitmask columns of `columns.Columns`, holding the raw
+bitvectors kept on the records (`flag_bits` and so on), so flags without
+a name in constants can be asked for by value.
+"""
+import functools
+import itertools
+import operator
+
+from columns import Columns
+from constants import MOB_ACTION_FLAGS
+from constants import MOB_AFFECT_FLAGS
+from constants import OBJECT_EXTRA_EFFECTS_FLAGS
+from constants import OBJECT_WEAR_FLAGS
+from constants import ROOM_FLAGS
+from constants import SHOP_FLAGS
+from constants import SHOP_TRADES_WITH
+from utils import get_flag_table
+
+# file type -> flag field (its bitmask column in Columns) -> flag dict
+FLAG_FIELDS = {
+    'mob': {
+        'flags': MOB_ACTION_FLAGS,
+        'affects': MOB_AFFECT_FLAGS,
+    },
+    'obj': {
+        'effects': OBJECT_EXTRA_EFFECTS_FLAGS,
+        'wear': OBJECT_WEAR_FLAGS,
+    },
+    'wld': {
+        'flags': ROOM_FLAGS,
+    },
+    'shp': {
+        'flags': SHOP_FLAGS,
+        'trades_with': SHOP_TRADES_WITH,
+    },
+}
+
+
+def get_bits(flags, flag_dict):
+    """
+    the mask of a list of flag names (e.g. 'NODROP') and/or values
+    """
+    reverse = get_flag_table(flag_dict).reverse
+    mask = 0
+    for flag in flags:
+        if isinstance(flag, int):
+            mask |= flag
+        elif flag in reverse:
+            mask |= reverse[flag]
+        else:
+            raise RuntimeError('Unknown flag: "{}"'.format(flag))
+    return mask
+
+
+class FlagMatrix(object):
+    """
+    the Columns of each file type with flags, queried through the bitmask
+    columns of its flag fields
+    """
+
+    def __init__(self, tables):
+        self.tables = tables
+
+    @classmethod
+    def from_world(cls, world, use_numpy=True):
+        return cls({file_type: Columns.from_world(world, file_type, use_numpy) for file_type in FLAG_FIELDS})
+
+    def query(self, file_type, **conditions):
+        """
+        the vnums of the `file_type` entries matching every condition, each
+        a flag field name with a dict of `all`, `any` and `none` flag lists
+        """
+        table = self.tables[file_type]
+        masks = []
+        for field, condition in conditions.items():
+            if field not in FLAG_FIELDS[file_type]:
+                raise RuntimeError('No flag field "{}" for "{}"'.format(field, file_type))
+            unknown = set(condition) - {'all', 'any', 'none'}
+            if unknown:
+                raise RuntimeError('Unknown condition: "{}"'.format(sorted(unknown)[0]))
+
+            flag_dict = FLAG_FIELDS[file_type][field]
+            bits = {how: get_bits(flags, flag_dict) for how, flags in condition.items()}
+            masks.append(table.flag_mask(field, **bits))
+
+        vnums = table['vnum']
+        if not masks:
+            return [int(vnum) for vnum in vnums]
+        if table.numpy is not None:
+            return vnums[functools.reduce(operator.and_, masks)].tolist()
+        return list(itertools.compress(vnums, map(all, zip(*masks))))
@@ -0,0 +1,54 @@
+# coding: utf-8
+"""
+output formats for parsed entries. `json` is a single indented array, which
+is what the parser has always written. `ndjson` is one compact object per
+line, so entries can be written as soon as they are parsed and read back
+one at a time without holding the whole document in memory.
+"""
+import json
+
+EXTENSIONS = {
+    'json': '.json',
+    'ndjson': '.ndjson',
+}
+
+
+def payload_to_json(payload):
+    return json.dumps(payload, indent=2, sort_keys=True)
+
+
+def entry_to_ndjson(entry):
+    return json.dumps(entry, sort_keys=True, separators=(',', ':')) + '\n'
+
+
+def write_payload(payload, f, fmt='json'):
+    if fmt == 'ndjson':
+        for entry in payload:
+            f.write(entry_to_ndjson(entry))
+    else:
+        f.write(payload_to_json(payload))
+
+
+def iter_ndjson(f):
+    """
+    lazily yield each entry from an open NDJSON file, skipping blank lines
+    """
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_ndjson(path):
+    with open(path) as f:
+        yield from iter_ndjson(f)
+
+
+def load_payload(path):
+    """
+    load a converted file as a list of entries, whichever format it's in
+    """
+    if path.endswith(EXTENSIONS['ndjson']):
+        return list(read_ndjson(path))
+
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,191 @@
+# coding: utf-8
+"""
+the rooms of a world as a directed graph of their exits, stored in
+compressed sparse row form: rooms are numbered 0..n-1 in vnum order, and
+the exits of room i are `targets[offsets[i]:offsets[i + 1]]`, with the
+matching `directions`. the three arrays are flat `array.array`s of C ints,
+so a 100k-room world costs a few bytes per exit and traversals don't touch
+a dict per step. `to_numpy()` views them as NumPy arrays, if it's
+installed, without copying.
+
+    graph = RoomGraph.from_rooms(World.load('world').rooms.values())
+    graph.shortest_path(3001, 3054)
+"""
+import array
+import collections
+
+
+class RoomGraph(object):
+    """
+    exits that lead to rooms which don't exist are kept out of the arrays
+    and listed in `dangling` as (vnum, direction, target) tuples instead
+    """
+
+    def __init__(self, vnums, offsets, targets, directions, dangling):
+        self.vnums = vnums
+        self.node_of = {vnum: node for node, vnum in enumerate(vnums)}
+        self.offsets = offsets
+        self.targets = targets
+        self.directions = directions
+        self.dangling = dangling
+
+    @classmethod
+    def from_edges(cls, vnums, edges):
+        """
+        build the graph of the rooms `vnums` from (vnum, direction, target)
+        exits. exits keep the order they are given in within each room.
+        """
+        vnums = array.array('i', sorted(set(vnums)))
+        node_of = {vnum: node for node, vnum in enumerate(vnums)}
+
+        by_node = collections.defaultdict(list)
+        dangling = []
+        for vnum, direction, target in edges:
+            if target in node_of:
+                by_node[node_of[vnum]].append((node_of[target], direction))
+            else:
+                dangling.append((vnum, direction, target))
+
+        offsets = array.array('i', [0])
+        targets = array.array('i')
+        directions = array.array('b')
+        for node in range(len(vnums)):
+            for target, direction in by_node.get(node, ()):
+                targets.append(target)
+                directions.append(direction)
+            offsets.append(len(targets))
+
+        return cls(vnums, offsets, targets, directions, dangling)
+
+    @classmethod
+    def from_rooms(cls, rooms):
+        """
+        build the graph from room records, e.g. `world.rooms.values()`
+        """
+        rooms = list(rooms)
+        edges = ((room.id, exit.dir, exit.room_linked) for room in rooms for exit in room.exits)
+        return cls.from_edges([room.id for room in rooms], edges)
+
+    def __len__(self):
+        return len(self.vnums)
+
+    def to_numpy(self):
+        """
+        (vnums, offsets, targets, directions) as NumPy arrays sharing the
+        graph's memory
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise RuntimeError('NumPy is not installed')
+        arrays = (self.vnums, self.offsets, self.targets, self.directions)
+        return tuple(numpy.frombuffer(a, dtype=a.typecode) for a in arrays)
+
+    def get_exits(self, vnum):
+        """
+        (direction, target vnum) for every exit of room `vnum`
+        """
+        node = self.node_of[vnum]
+        start, end = self.offsets[node], self.offsets[node + 1]
+        return [(self.directions[i], self.vnums[self.targets[i]]) for i in range(start, end)]
+
+    def bfs(self, start, goal=None):
+        """
+        breadth-first search from room `start`. returns the array of parent
+        nodes (-1 for rooms not reached, the start room is its own parent),
+        stopping early once `goal` is reached.
+        """
+        offsets, targets = self.offsets, self.targets
+        parents = array.array('i', [-1]) * len(self.vnums)
+        first = self.node_of[start]
+        last = None if goal is None else self.node_of.get(goal)
+        parents[first] = first
+
+        queue = [first]
+        for node in queue:
+            if node == last:
+                break
+            for i in range(offsets[node], offsets[node + 1]):
+                target = targets[i]
+                if parents[target] == -1:
+                    parents[target] = node
+                    queue.append(target)
+
+        return parents
+
+    def shortest_path(self, start, goal):
+        """
+        the vnums of the rooms on a shortest walk from `start` to `goal`,
+        both included, or None if `goal` can't be reached
+        """
+        if goal not in self.node_of:
+            return None
+
+        parents = self.bfs(start, goal)
+        node = self.node_of[goal]
+        if parents[node] == -1:
+            return None
+
+        path = [node]
+        while parents[node] != node:
+            node = parents[node]
+            path.append(node)
+        return [self.vnums[node] for node in reversed(path)]
+
+    def get_path_directions(self, path):
+        """
+        the exit directions to follow along a path of room vnums
+        """
+        directions = []
+        for vnum, next_vnum in zip(path, path[1:]):
+            directions.append(next(d for d, target in self.get_exits(vnum) if target == next_vnum))
+        return directions
+
+    def reachable(self, start):
+        """
+        the vnums of every room that can be walked to from `start`,
+        including itself, in vnum order
+        """
+        parents = self.bfs(start)
+        return [vnum for vnum, parent in zip(self.vnums, parents) if parent != -1]
+
+    def components(self):
+        """
+        groups of rooms connected by exits in either direction, as lists
+        of vnums. the largest group comes first.
+        """
+        roots = array.array('i', range(len(self.vnums)))
+
+        def find(node):
+            while roots[node] != node:
+                roots[node] = roots[roots[node]]
+                node = roots[node]
+            return node
+
+        for node in range(len(self.vnums)):
+            for i in range(self.offsets[node], self.offsets[node + 1]):
+                a, b = find(node), find(self.targets[i])
+                if a != b:
+                    roots[max(a, b)] = min(a, b)
+
+        groups = collections.defaultdict(list)
+        for node, vnum in enumerate(self.vnums):
+            groups[find(node)].append(vnum)
+        return sorted(groups.values(), key=lambda group: (-len(group), group[0]))
+
+    def one_way_exits(self):
+        """
+        (vnum, direction, target) for every exit whose target room has no
+        exit at all leading back
+        """
+        edges = set()
+        for node in range(len(self.vnums)):
+            for i in range(self.offsets[node], self.offsets[node + 1]):
+                edges.add((node, self.targets[i]))
+
+        one_way = []
+        for node in range(len(self.vnums)):
+            for i in range(self.offsets[node], self.offsets[node + 1]):
+                if (self.targets[i], node) not in edges:
+                    one_way.append((self.vnums[node], self.directions[i], self.vnums[self.targets[i]]))
+        return one_way
@@ -0,0 +1,138 @@
+# coding: utf-8
+"""
+byte-offset index of every entry in a world directory. building it is one
+pass of the same `^#<vnum>` boundary search that `split_on_vnums` does, but
+over the raw bytes, recording where each entry starts and ends. looking an
+entry up afterwards is a seek and a read of just that entry instead of
+reading and parsing the whole file it lives in.
+"""
+import json
+import os
+
+from lookup import PARSER_LOOKUP
+from lookup import find_world_files
+from utils import decode_entry
+from utils import split_buffer_on_vnums
+
+INDEX_VERSION = 1
+
+
+def scan_file(filepath):
+    """
+    return a (vnum, offset, length, line) tuple for every entry in a file,
+    where offset and length delimit the same text `split_on_vnums` yields
+    (starting just after the '#') and line is the 1-based line of the vnum
+    """
+    with open(filepath, 'rb') as f:
+        data = f.read()
+
+    entries = []
+    line, position = 1, 0
+
+    for vnum, offset, length in split_buffer_on_vnums(data):
+        line += data.count(b'\n', position, offset)
+        position = offset
+        entries.append((vnum, offset, length, line))
+
+    return entries
+
+
+def get_file_stamp(filepath):
+    stat = os.stat(filepath)
+    return dict(path=filepath, size=stat.st_size, mtime=stat.st_mtime_ns)
+
+
+def build_index(world_dir):
+    """
+    scan every world file under `world_dir`, returning an index of the form
+
+        {
+            'files': [{'path': ..., 'size': ..., 'mtime': ...}, ...],
+            'entries': {'wld': {3001: (file number, offset, length, line)}, ...}
+        }
+
+    if a vnum appears twice for the same type, the first one wins, which is
+    the one a full parse would also list first.
+    """
+    files = []
+    entries = {file_type: {} for file_type in PARSER_LOOKUP}
+
+    for file_type, filepath in find_world_files(world_dir):
+        file_number = len(files)
+        files.append(get_file_stamp(filepath))
+
+        for vnum, offset, length, line in scan_file(filepath):
+            entries[file_type].setdefault(vnum, (file_number, offset, length, line))
+
+    return dict(files=files, entries=entries)
+
+
+def save_index(index, path):
+    """
+    write the index compactly: one [vnum, file number, offset, length, line]
+    row per entry
+    """
+    rows = {}
+    for file_type, by_vnum in index['entries'].items():
+        rows[file_type] = [[vnum] + list(location) for vnum, location in by_vnum.items()]
+
+    with open(path, 'w') as f:
+        json.dump(dict(version=INDEX_VERSION, files=index['files'], entries=rows), f, separators=(',', ':'))
+
+
+def load_index(path):
+    with open(path) as f:
+        saved = json.load(f)
+
+    if saved.get('version') != INDEX_VERSION:
+        raise RuntimeError('Unsupported index version in "{}"'.format(path))
+
+    entries = {}
+    for file_type, rows in saved['entries'].items():
+        entries[file_type] = {row[0]: tuple(row[1:]) for row in rows}
+
+    return dict(files=saved['files'], entries=entries)
+
+
+def locate_entry(index, file_type, vnum):
+    """
+    return (path, offset, length, line) for an entry, raising KeyError if
+    the index doesn't know it, or RuntimeError if the file it lives in has
+    changed since the index was built
+    """
+    file_number, offset, length, line = index['entries'][file_type][vnum]
+    stamp = index['files'][file_number]
+
+    if get_file_stamp(stamp['path']) != stamp:
+        raise RuntimeError('Index is out of date for "{}"'.format(stamp['path']))
+
+    return stamp['path'], offset, length, line
+
+
+def format_parse_error(file_type, vnum, path, line, error):
+    return 'Error parsing {} #{} at {}:{}: {!r}'.format(file_type, vnum, path, line, error)
+
+
+def read_entry_text(index, file_type, vnum):
+    path, offset, length, _ = locate_entry(index, file_type, vnum)
+
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+
+    return decode_entry(data)
+
+
+def get_entry(index, file_type, vnum):
+    """
+    seek to a single entry and parse only that. parse failures are raised
+    with the file and line the entry starts on.
+    """
+    parser, _, _ = PARSER_LOOKUP[file_type]
+    text = read_entry_text(index, file_type, vnum)
+
+    try:
+        return parser(text)
+    except Exception as e:  # intentionally broad
+        path, _, _, line = locate_entry(index, file_type, vnum)
+        raise RuntimeError(format_parse_error(file_type, vnum, path, line, e)) from e
@@ -0,0 +1,176 @@
+# coding: utf-8
+"""
+keyword lookups the way CircleMUD resolves the names players type ("get
+sw", "look 2.guard", "open door"): a name matches an entity when it is an
+abbreviation of any of its keywords, ignoring case. instead of comparing
+the name against every keyword list in a room, each index maps every
+prefix of every keyword straight to the matching vnums, so a lookup is a
+single dict access:
+
+    index = WorldKeywords.from_world(World.load('world'))
+    index.objects.lookup('sw')
+    index.objects.find('2.sw', vnums_in_room)
+    index.find_extra_desc(12001, 'score')
+    index.find_object_extra_desc(1500, 'scales')
+
+with `abbrev=False` only whole keywords match, as in stock CircleMUD 3.0.
+"""
+
+
+def is_abbrev(arg, word):
+    """
+    whether `arg` is a non-empty abbreviation of `word`, ignoring case
+    """
+    return bool(arg) and word.lower().startswith(arg.lower())
+
+
+def isname(name, keywords):
+    """
+    whether `name` abbreviates any of `keywords`
+    """
+    return any(is_abbrev(name, keyword) for keyword in keywords)
+
+
+def get_number(name):
+    """
+    splits CircleMUD's "2.sword" into (2, 'sword'). a name without a dot is
+    (1, name), and a bad number before the dot is 0, which matches nothing.
+    """
+    number, dot, rest = name.partition('.')
+    if not dot:
+        return 1, name
+    return (int(number) if number.isdigit() else 0), rest
+
+
+def get_prefixes(keyword, abbrev=True):
+    keyword = keyword.lower()
+    if not abbrev:
+        return (keyword,)
+    return tuple(keyword[:i] for i in range(1, len(keyword) + 1))
+
+
+def build_prefix_map(entries, abbrev=True):
+    """
+    {prefix: value} from (keywords, value) pairs, where the first value
+    with a keyword wins, as the game takes the first match in the list it
+    scans. `entries` must be in that order.
+    """
+    prefixes = {}
+    for keywords, value in entries:
+        for keyword in keywords:
+            for prefix in get_prefixes(keyword, abbrev):
+                prefixes.setdefault(prefix, value)
+    return prefixes
+
+
+class KeywordIndex(object):
+    """
+    every prefix of every keyword of one kind of entity, mapped to the
+    frozenset of vnums with a keyword starting with it
+    """
+
+    def __init__(self, prefixes):
+        self.prefixes = prefixes
+
+    @classmethod
+    def from_keywords(cls, entries, abbrev=True):
+        """
+        build from (vnum, keywords) pairs
+        """
+        prefixes = {}
+        for vnum, keywords in entries:
+            for keyword in keywords:
+                for prefix in get_prefixes(keyword, abbrev):
+                    vnums = prefixes.get(prefix)
+                    if vnums is None:
+                        vnums = prefixes[prefix] = set()
+                    vnums.add(vnum)
+        return cls({prefix: frozenset(vnums) for prefix, vnums in prefixes.items()})
+
+    def lookup(self, name):
+        """
+        the vnums `name` is a keyword abbreviation of
+        """
+        return self.prefixes.get(name.lower(), frozenset())
+
+    def find(self, name, vnums):
+        """
+        the vnum in the ordered `vnums` (e.g. the objects in a room) that
+        `name` picks, counting "2.sword" as the second match, or None
+        """
+        number, name = get_number(name)
+        matches = self.prefixes.get(name.lower(), frozenset())
+        for vnum in vnums:
+            if vnum in matches:
+                number -= 1
+                if number == 0:
+                    return vnum
+        return None
+
+
+def get_extra_desc_maps(records, abbrev=True):
+    """
+    {vnum: prefix map of its extra descs} for the records with any. the
+    game pushes each extra desc onto the head of its list as it loads them,
+    so the last one in the file is matched first.
+    """
+    maps = {}
+    for record in records:
+        if record.extra_descs:
+            entries = ((extra.keywords, extra.desc) for extra in reversed(record.extra_descs))
+            maps[record.id] = build_prefix_map(entries, abbrev)
+    return maps
+
+
+class WorldKeywords(object):
+    """
+    keyword indexes for the mobs and objects of a world, per room maps of
+    its extra desc and door keywords, and per object maps of its extra desc
+    keywords (what "look <keyword>" reads on an object)
+    """
+
+    def __init__(self, mobs, objects, extra_descs, doors, object_extra_descs):
+        self.mobs = mobs
+        self.objects = objects
+        self.extra_descs = extra_descs
+        self.doors = doors
+        self.object_extra_descs = object_extra_descs
+
+    @classmethod
+    def from_world(cls, world, abbrev=True):
+        mobs = KeywordIndex.from_keywords(((mob.id, mob.aliases) for mob in world.mobs.values()), abbrev)
+        objects = KeywordIndex.from_keywords(((obj.id, obj.aliases) for obj in world.objects.values()), abbrev)
+
+        extra_descs = get_extra_desc_maps(world.rooms.values(), abbrev)
+        object_extra_descs = get_extra_desc_maps(world.objects.values(), abbrev)
+
+        doors = {}
+        for room in world.rooms.values():
+            if any(exit.keywords for exit in room.exits):
+                # doors are searched in direction order
+                exits = sorted(room.exits, key=lambda exit: exit.dir)
+                doors[room.id] = build_prefix_map(((exit.keywords, exit.dir) for exit in exits), abbrev)
+
+        return cls(mobs, objects, extra_descs, doors, object_extra_descs)
+
+    def find_extra_desc(self, room, name):
+        """
+        the extra desc of room `room` that `name` names, or None
+        """
+        descs = self.extra_descs.get(room)
+        return None if descs is None else descs.get(name.lower())
+
+    def find_object_extra_desc(self, obj, name):
+        """
+        the extra desc of object `obj` that `name` names, or None
+        """
+        descs = self.object_extra_descs.get(obj)
+        return None if descs is None else descs.get(name.lower())
+
+    def find_door(self, room, name):
+        """
+        the direction of the exit of room `room` with a door keyword that
+        `name` abbreviates, or None
+        """
+        doors = self.doors.get(room)
+        return None if doors is None else doors.get(name.lower())
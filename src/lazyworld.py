@@ -0,0 +1,275 @@
+# coding: utf-8
+"""
+a world that stays on disk until it is used, for worlds too large to keep
+resident. it starts from the byte-offset index, parses only the zone files
+up front, and materializes the mobs, objects, rooms and shops of a zone the
+first time any of them is asked for. resident zones are kept in an LRU
+capped by entry count and/or bytes of source text:
+
+    world = LazyWorld.load('world', max_entries=5000)
+    world.get_room(3001)
+    world.stats()
+
+descriptions (`desc`, `detail_desc` and extra descs) aren't kept even for
+resident entries. reading one seeks to the entry and parses all of it
+again, every time, so a caller that wants several of them should get them
+in one read with `record.read_deferred()`. if the entry can no longer be
+parsed, or its file changed, reading a description raises a RuntimeError.
+"""
+import collections
+
+from index import build_index
+from index import format_parse_error
+from index import get_entry
+from index import get_file_stamp
+from index import load_index
+from lookup import PARSER_LOOKUP
+from records import RECORD_LOOKUP
+from utils import decode_entry
+from zonemap import ZoneMap
+
+# file types materialized per zone, and their fields left on disk
+DEFERRED_FIELDS = {
+    'mob': ('detail_desc',),
+    'obj': ('extra_descs',),
+    'wld': ('desc', 'extra_descs'),
+    'shp': (),
+}
+
+# empty stand-ins handed to `from_dict` for the deferred fields
+EMPTY_VALUES = {
+    'desc': '',
+    'detail_desc': '',
+    'extra_descs': [],
+}
+
+
+def deferred_field(slot, name):
+    """
+    a property over a record slot that holds None until something else is
+    stored in it, reading the field from the source file on every access
+    """
+
+    def get(self):
+        value = slot.__get__(self)
+        if value is None:
+            value = self.world.read_deferred(self.file_type, self.id)[name]
+        return value
+
+    def set(self, value):
+        slot.__set__(self, value)
+
+    return property(get, set)
+
+
+def read_deferred(self):
+    """
+    {name: value} of every deferred field of the entry, reading and parsing
+    it at most once
+    """
+    values = {name: getattr(self.record_type, name).__get__(self) for name in DEFERRED_FIELDS[self.file_type]}
+    if any(value is None for value in values.values()):
+        read = self.world.read_deferred(self.file_type, self.id)
+        values = {name: read[name] if value is None else value for name, value in values.items()}
+    return values
+
+
+def make_lazy_type(world, file_type):
+    """
+    a subclass of the record type for `file_type` whose deferred fields are
+    read through `world`. it adds no slots, so instances are no larger.
+    """
+    record_type = RECORD_LOOKUP[file_type]
+    namespace = dict(__slots__=(), world=world, file_type=file_type, record_type=record_type)
+    namespace['read_deferred'] = read_deferred
+    for name in DEFERRED_FIELDS[file_type]:
+        namespace[name] = deferred_field(getattr(record_type, name), name)
+    return type('Lazy' + record_type.__name__, (record_type,), namespace)
+
+
+class LazyWorld(object):
+    """
+    records materialized on demand from a byte-offset index, grouped by the
+    zone whose range holds their vnum (entries outside every zone share one
+    group). `hits`, `misses` and `evictions` count zone lookups, and entries
+    that fail to parse are kept in `errors` keyed on (file type, vnum).
+    """
+
+    def __init__(self, index, max_entries=None, max_bytes=None):
+        self.index = index
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.zones = {}
+        self.errors = {}
+        for vnum in index['entries']['zon']:
+            record = self.read_record('zon', vnum)
+            if record is not None:
+                self.zones[vnum] = record
+
+        # file type -> vnum -> zone id, and zone id -> [(file type, vnum)]
+        self.zone_map = ZoneMap.from_zones(self.zones.values())
+        self.zone_of = {}
+        self.groups = collections.defaultdict(list)
+        for file_type in DEFERRED_FIELDS:
+            by_vnum = index['entries'][file_type]
+            self.zone_of[file_type] = zone_of = self.zone_map.map_vnums(by_vnum)
+            for vnum in by_vnum:
+                self.groups[zone_of.get(vnum)].append((file_type, vnum))
+
+        self.lazy_types = {file_type: make_lazy_type(self, file_type) for file_type in DEFERRED_FIELDS}
+        self.resident = collections.OrderedDict()  # zone id -> (records, entries, bytes)
+        self.resident_entries = 0
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def load(cls, world_dir, index_path=None, **limits):
+        """
+        index `world_dir`, or use the index saved at `index_path`
+        """
+        index = load_index(index_path) if index_path else build_index(world_dir)
+        return cls(index, **limits)
+
+    def read_record(self, file_type, vnum):
+        """
+        seek to a single entry and parse it into a plain record, without
+        making it resident. returns None and keeps the error if it fails.
+        """
+        try:
+            return RECORD_LOOKUP[file_type].from_dict(get_entry(self.index, file_type, vnum))
+        except RuntimeError as e:
+            self.errors[file_type, vnum] = str(e)
+            return None
+
+    def read_deferred(self, file_type, vnum):
+        """
+        {name: value} of the deferred fields of one entry, from a single
+        read of its source
+        """
+        record = self.read_record(file_type, vnum)
+        if record is None:
+            fmt = 'Could not read the deferred fields of {} #{}: {}'
+            raise RuntimeError(fmt.format(file_type, vnum, self.errors[file_type, vnum]))
+        return {name: getattr(record, name) for name in DEFERRED_FIELDS[file_type]}
+
+    def read_group(self, zone):
+        """
+        parse every entry of a zone group, opening each source file once.
+        returns ({file type: {vnum: record}}, number of bytes read).
+        """
+        locations = []
+        for file_type, vnum in self.groups[zone]:
+            file_number, offset, length, line = self.index['entries'][file_type][vnum]
+            locations.append((file_number, offset, length, line, file_type, vnum))
+        locations.sort()
+
+        records = {file_type: {} for file_type in DEFERRED_FIELDS}
+        n_bytes = 0
+        f, current = None, None
+        try:
+            for file_number, offset, length, line, file_type, vnum in locations:
+                if file_number != current:
+                    f, current = self.open_source(f, file_number), file_number
+                f.seek(offset)
+                record = self.parse_lazy(file_type, vnum, decode_entry(f.read(length)), line)
+                if record is not None:
+                    records[file_type][vnum] = record
+                n_bytes += length
+        finally:
+            if f is not None:
+                f.close()
+        return records, n_bytes
+
+    def open_source(self, previous, file_number):
+        if previous is not None:
+            previous.close()
+
+        stamp = self.index['files'][file_number]
+        if get_file_stamp(stamp['path']) != stamp:
+            raise RuntimeError('Index is out of date for "{}"'.format(stamp['path']))
+        return open(stamp['path'], 'rb')
+
+    def parse_lazy(self, file_type, vnum, text, line):
+        parser, _, _ = PARSER_LOOKUP[file_type]
+        try:
+            d = parser(text)
+        except Exception as e:  # intentionally broad
+            path = self.index['files'][self.index['entries'][file_type][vnum][0]]['path']
+            self.errors[file_type, vnum] = format_parse_error(file_type, vnum, path, line, e)
+            return None
+
+        deferred = DEFERRED_FIELDS[file_type]
+        for name in deferred:
+            d[name] = EMPTY_VALUES[name]
+        record = self.lazy_types[file_type].from_dict(d)
+        for name in deferred:
+            setattr(record, name, None)
+        return record
+
+    def get(self, file_type, vnum):
+        """
+        the record for `vnum`, making its zone resident, or None if there
+        is no such entry. zones are parsed up front and always resident.
+        """
+        if file_type == 'zon':
+            return self.zones.get(vnum)
+        if vnum not in self.index['entries'][file_type]:
+            return None
+        zone = self.zone_of[file_type].get(vnum)
+
+        if zone in self.resident:
+            self.hits += 1
+            self.resident.move_to_end(zone)
+        else:
+            self.misses += 1
+            records, n_bytes = self.read_group(zone)
+            self.resident[zone] = (records, len(self.groups[zone]), n_bytes)
+            self.resident_entries += len(self.groups[zone])
+            self.resident_bytes += n_bytes
+            self.evict()
+
+        return self.resident[zone][0][file_type].get(vnum)
+
+    def get_mob(self, vnum):
+        return self.get('mob', vnum)
+
+    def get_object(self, vnum):
+        return self.get('obj', vnum)
+
+    def get_room(self, vnum):
+        return self.get('wld', vnum)
+
+    def get_shop(self, vnum):
+        return self.get('shp', vnum)
+
+    def get_zone(self, vnum):
+        return self.get('zon', vnum)
+
+    def is_over_limit(self):
+        if self.max_entries is not None and self.resident_entries > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.resident_bytes > self.max_bytes
+
+    def evict(self):
+        """
+        drop least recently used zones until back under the limits. the
+        most recent zone always stays, even when it alone is over them.
+        """
+        while len(self.resident) > 1 and self.is_over_limit():
+            _, (_, n_entries, n_bytes) = self.resident.popitem(last=False)
+            self.resident_entries -= n_entries
+            self.resident_bytes -= n_bytes
+            self.evictions += 1
+
+    def stats(self):
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            resident_zones=len(self.resident),
+            resident_entries=self.resident_entries,
+            resident_bytes=self.resident_bytes,
+        )
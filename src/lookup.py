@@ -0,0 +1,76 @@
+# coding: utf-8
+"""
+which parser handles which kind of world file, and how to find them
+"""
+import os
+
+from mobile import parse_mob
+from object import parse_object
+from room import parse_room
+from shop import parse_shop
+from zone import parse_zone
+from utils import iter_entries
+from utils import parse_from_file
+from utils import split_on_vnums
+
+# modules whose source goes into the parser version recorded in manifests
+# and snapshots
+PARSER_MODULES = ('constants', 'utils', 'mobile', 'object', 'room', 'shop', 'zone')
+
+PARSER_LOOKUP = {
+    'mob': (parse_mob, split_on_vnums, None),
+    'obj': (parse_object, split_on_vnums, None),
+    'wld': (parse_room, split_on_vnums, None),
+    'shp': (parse_shop, split_on_vnums, None),
+    'zon': (parse_zone, split_on_vnums, None),
+}
+
+
+def get_file_type(filepath):
+    _, filename = os.path.split(filepath)
+    _, file_type = filename.split('.')
+    return file_type
+
+
+def get_parser_args(filepath):
+    # figure out which type of tinyworld file we've been pointed at
+    file_type = get_file_type(filepath)
+
+    if file_type not in PARSER_LOOKUP:
+        fmt = 'No parser found for file type: "{}"'
+        raise RuntimeError(fmt.format(file_type))
+
+    return PARSER_LOOKUP[file_type]
+
+
+def parse_based_on_filepath(filepath):
+    args = get_parser_args(filepath)
+    payload, errors = parse_from_file(filepath, *args)
+
+    return payload, errors
+
+
+def iter_parsed_file(filepath):
+    """
+    yield a (dict, error) pair for each entry of a file as soon as it has
+    been parsed, rather than collecting them all first
+    """
+    parser, _, _ = get_parser_args(filepath)
+    return iter_entries(filepath, parser)
+
+
+def find_world_files(world_dir):
+    """
+    walk a world directory (e.g. `lib/world/`) once and return a list of
+    (file type, path) tuples for every file with a known extension, in
+    the order of PARSER_LOOKUP and then by path so runs are repeatable
+    """
+    found = {file_type: [] for file_type in PARSER_LOOKUP}
+
+    for dirpath, dirnames, filenames in os.walk(world_dir):
+        for filename in filenames:
+            file_type = os.path.splitext(filename)[1].lstrip('.')
+            if file_type in found:
+                found[file_type].append(os.path.join(dirpath, filename))
+
+    return [(file_type, path) for file_type, paths in found.items() for path in sorted(paths)]
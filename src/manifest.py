@@ -0,0 +1,114 @@
+# coding: utf-8
+"""
+bookkeeping for incremental conversion. the manifest remembers, for every
+source file, the size, mtime and content hash it had when its JSON was last
+written, along with a hash of the parser code that wrote it. a file only
+needs to be parsed again when one of those has changed.
+"""
+import hashlib
+import importlib.util
+import json
+import os
+
+from formats import load_payload
+
+MANIFEST_VERSION = 1
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_text(text):
+    return hash_bytes(text.encode('utf-8'))
+
+
+def get_parser_version(module_names):
+    """
+    hash the source of the given modules, so that any edit to the parsers
+    or constants invalidates every previous result. modules are found by
+    name, so this works for `parse` even when it is running as __main__.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(module_names):
+        with open(importlib.util.find_spec(name).origin, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def get_default_manifest_path(out_dir):
+    """
+    the manifest lives next to the output folder, e.g. `_output.manifest.json`
+    """
+    return os.path.normpath(out_dir) + '.manifest.json'
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}
+
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest['files']
+
+
+def save_manifest(path, records):
+    manifest = dict(version=MANIFEST_VERSION, files=records)
+
+    # write to the side and swap in, so an interrupted run can't leave a
+    # truncated manifest behind
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def check_source(path, record, parser_version):
+    """
+    compare a source file against its previous manifest record (or None).
+
+    returns a tuple of (is_unchanged, new_record). the content hash is only
+    computed when the size or mtime differ from the record, the same way
+    `make` trusts timestamps, but a file that was merely touched is still
+    recognized as unchanged.
+    """
+    stat = os.stat(path)
+    new_record = dict(size=stat.st_size, mtime=stat.st_mtime_ns, parser_version=parser_version)
+
+    if record and record['parser_version'] == parser_version:
+        if record['size'] == stat.st_size and record['mtime'] == stat.st_mtime_ns:
+            return True, record
+
+    with open(path, 'rb') as f:
+        new_record['sha256'] = hash_bytes(f.read())
+
+    is_unchanged = bool(record) and record['parser_version'] == parser_version
+    is_unchanged = is_unchanged and record['sha256'] == new_record['sha256']
+    if is_unchanged:
+        # a touched file keeps the entry hashes and parse errors of the
+        # conversion its output was written by
+        for key in ('entries', 'errors'):
+            if key in record:
+                new_record[key] = record[key]
+    return is_unchanged, new_record
+
+
+def load_entry_cache(record, parser_version, dest):
+    """
+    map the text hash of every entry previously written to `dest` to the
+    dictionary that was written for it, so unchanged entries of a changed
+    file can be reused instead of parsed again. the record's `entries` list
+    holds one hash per output entry, in output order.
+    """
+    if not record or record['parser_version'] != parser_version or 'entries' not in record:
+        return {}
+    if not os.path.exists(dest):
+        return {}
+
+    payload = load_payload(dest)
+    if len(payload) != len(record['entries']):
+        return {}
+    return dict(zip(record['entries'], payload))
@@ -3,9 +3,10 @@ from constants import MOB_ACTION_FLAGS
 from constants import MOB_AFFECT_FLAGS
 from constants import MOB_GENDER
 from constants import MOB_POSITION
+from utils import EntryCursor
 from utils import bitvector_to_flags
 from utils import clean_bitvector
-from utils import lookup_value_to_dict
+from utils import lookup_value_to_flag
 
 
 def parse_dice_roll_string_to_tuple(roll_string):
@@ -35,21 +36,16 @@ def parse_dice_roll_string_to_dict(roll_string):
 
 
 def parse_mob(text):
-    fields = [line.rstrip() for line in text.strip().split('\n')]
+    cursor = EntryCursor(text)
 
     d = dict()
-    d['id'] = int(fields[0])
-    d['aliases'] = fields[1].rstrip('~').split()
-    d['short_desc'] = fields[2].rstrip('~')
-    d['long_desc'] = text.split('~')[2].strip('\n')
-    d['detail_desc'] = text.split('~')[3].strip('\n')
+    d['id'] = int(cursor.read_line())
+    d['aliases'] = cursor.read_tilde_string().split()
+    d['short_desc'] = cursor.read_tilde_string()
+    d['long_desc'] = cursor.read_tilde_string().strip('\n')
+    d['detail_desc'] = cursor.read_tilde_string().strip('\n')
 
-    tildes = [i for i, a in enumerate(text) if a == '~']
-    start_bottom_matter = tildes[3] + 1
-    bottom_fields = text[start_bottom_matter:].strip('\n').split('\n')
-
-    vector_line = bottom_fields[0]
-    action, affect, alignment, mob_type = vector_line.split()
+    action, affect, alignment, mob_type = cursor.read_line().split()
 
     d['mob_type'] = mob_type
     d['alignment'] = int(alignment)
@@ -60,9 +56,9 @@ def parse_mob(text):
     affect = clean_bitvector(affect)
     d['affects'] = bitvector_to_flags(affect, MOB_AFFECT_FLAGS)
 
-    level, thac0, ac, max_hp, bare_hand_dmg = bottom_fields[1].split()
-    gold, xp = bottom_fields[2].split()
-    load_position, default_position, gender = bottom_fields[3].split()
+    level, thac0, ac, max_hp, bare_hand_dmg = cursor.read_line().split()
+    gold, xp = cursor.read_line().split()
+    load_position, default_position, gender = cursor.read_line().split()
 
     d['level'] = int(level)
     d['thac0'] = int(thac0)
@@ -72,21 +68,22 @@ def parse_mob(text):
     d['gold'] = int(gold)
     d['xp'] = int(xp)
     d['position'] = {
-        'load': lookup_value_to_dict(int(load_position), MOB_POSITION),
-        'default': lookup_value_to_dict(int(load_position), MOB_POSITION),
+        'load': lookup_value_to_flag(int(load_position), MOB_POSITION),
+        'default': lookup_value_to_flag(int(load_position), MOB_POSITION),
     }
-    d['gender'] = lookup_value_to_dict(int(gender), MOB_GENDER)
+    d['gender'] = lookup_value_to_flag(int(gender), MOB_GENDER)
 
     extra_spec = dict()
-    if len(bottom_fields) > 4:
+    if not cursor.at_end():
         assert mob_type == 'E'
-        assert bottom_fields[-1] == 'E'
 
-        for line in bottom_fields[4:]:
+        line = None
+        for line in cursor.iter_lines():
             if line == 'E':
                 break  # we reached the end of this E-type mob
             key, value = line.split(': ')
             extra_spec[key] = int(value)
+        assert line == 'E'
     d['extra_spec'] = extra_spec
 
     return d
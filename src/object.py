@@ -3,70 +3,61 @@ from constants import OBJECT_AFFECT_LOCATION_FLAGS
 from constants import OBJECT_EXTRA_EFFECTS_FLAGS
 from constants import OBJECT_TYPE_FLAGS
 from constants import OBJECT_WEAR_FLAGS
+from utils import EntryCursor
 from utils import bitvector_to_flags
 from utils import clean_bitvector
-from utils import lookup_value_to_dict
+from utils import lookup_value_to_flag
 
 
-def parse_extra_descs(extra_fields):
-    extra_iterator = iter(extra_fields)
+def read_extra_desc(cursor):
+    """
+    read the keywords and description that follow an 'E' line. returns None
+    if the entry ends before the closing '~', dropping the partial desc.
+    """
+    if cursor.at_end():
+        return None
+    keywords = cursor.read_line().rstrip().rstrip('~').split()
 
-    while True:
-        try:
-            new = next(extra_iterator)
+    desc_lines = []
+    while not cursor.at_end():
+        line = cursor.read_line().rstrip()
+        if line in ('~', '$'):
+            desc = '\n'.join(desc_lines)
+            return dict(keywords=keywords, desc=desc)
+        desc_lines.append(line)
 
-            if new == 'E':
-                keywords = next(extra_iterator).rstrip('~').split()
-                new = next(extra_iterator)
+    return None
 
-                desc_lines = []
-                while new not in ('~', '$'):
-                    desc_lines.append(new)
-                    new = next(extra_iterator)
-                desc = '\n'.join(desc_lines)
 
-                yield dict(keywords=keywords, desc=desc)
-
-        except StopIteration:
-            break
-
-
-def parse_affects(extra_fields):
-    extra_iterator = iter(extra_fields)
-
-    while True:
-        try:
-            new = next(extra_iterator)
-
-            if new == 'A':
-                loc, value = [int(v) for v in next(extra_iterator).split()]
-                note = OBJECT_AFFECT_LOCATION_FLAGS.get(loc, None)
-                yield dict(location=loc, note=note, value=value)
-
-        except StopIteration:
-            break
+def read_affect(cursor):
+    """
+    read the location and value line that follows an 'A' line
+    """
+    loc, value = cursor.read_ints()
+    note = OBJECT_AFFECT_LOCATION_FLAGS.get(loc, None)
+    return dict(location=loc, note=note, value=value)
 
 
 def parse_object(text):
-    fields = [line.rstrip() for line in text.strip().split('\n')]
+    cursor = EntryCursor(text)
 
     d = dict()
 
     # easy fields
-    d['id'] = int(fields[0])
-    d['aliases'] = fields[1].rstrip('~').split()
-    d['short_desc'] = fields[2].rstrip('~')
-    d['long_desc'] = fields[3].rstrip('~')
-    d['values'] = [int(v) for v in fields[6].split()]
-    weight, cost, rent = [int(v) for v in fields[7].split()]
+    d['id'] = int(cursor.read_line())
+    d['aliases'] = cursor.read_line().rstrip().rstrip('~').split()
+    d['short_desc'] = cursor.read_line().rstrip().rstrip('~')
+    d['long_desc'] = cursor.read_line().rstrip().rstrip('~')
+    action_desc = cursor.read_line().rstrip().rstrip('~')
+    type_flag, effects_bits, wear_bitvector = cursor.read_line().split()
+    d['values'] = cursor.read_ints()
+    weight, cost, rent = cursor.read_ints()
     d['weight'] = weight
     d['cost'] = cost
     d['rent'] = rent
 
-    type_flag, effects_bits, wear_bitvector = fields[5].split()
-
     # type flag is always an int
-    d['type'] = lookup_value_to_dict(int(type_flag), OBJECT_TYPE_FLAGS)
+    d['type'] = lookup_value_to_flag(int(type_flag), OBJECT_TYPE_FLAGS)
 
     # parse the bitvectors
     effects_bits = clean_bitvector(effects_bits)
@@ -76,16 +67,21 @@ def parse_object(text):
     wear_bitvector = clean_bitvector(wear_bitvector)
     d['wear'] = bitvector_to_flags(wear_bitvector, OBJECT_WEAR_FLAGS)
 
-    action_desc = fields[4].rstrip('~')
     if action_desc:
         d['action_desc'] = action_desc
 
+    # affects and extra descs can be interleaved in any order
     d['affects'] = []
     d['extra_descs'] = []
-    if len(fields) > 8:
-        extra_fields = fields[8:]
+    for line in cursor.iter_lines():
+        line = line.rstrip()
+
+        if line == 'A' and not cursor.at_end():
+            d['affects'].append(read_affect(cursor))
 
-        d['affects'] = list(parse_affects(extra_fields))
-        d['extra_descs'] = list(parse_extra_descs(extra_fields))
+        elif line == 'E':
+            extra_desc = read_extra_desc(cursor)
+            if extra_desc:
+                d['extra_descs'].append(extra_desc)
 
     return d
@@ -1,25 +1,49 @@
 # coding: utf-8
+import collections
+import itertools
 import json
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 import click
 
-from mobile import parse_mob
-from object import parse_object
-from room import parse_room
-from shop import parse_shop
-from zone import parse_zone
-from utils import parse_from_file
+# the modules of the other commands are imported in their bodies, so that
+# parsing files doesn't pay for loading sqlite3 and the world indexes
+from diff import diff_entries
+from formats import EXTENSIONS
+from formats import entry_to_ndjson
+from formats import load_payload
+from formats import payload_to_json
+from formats import write_payload
+from manifest import check_source
+from manifest import get_default_manifest_path
+from manifest import get_parser_version
+from manifest import hash_text
+from manifest import load_entry_cache
+from manifest import load_manifest
+from manifest import save_manifest
+from lookup import PARSER_LOOKUP
+from lookup import PARSER_MODULES
+from lookup import find_world_files
+from lookup import get_file_type
+from lookup import iter_parsed_file
+from lookup import parse_based_on_filepath
+from utils import iter_mapped_texts
+from utils import parse_entry
+from utils import read_world_file
 from utils import split_on_vnums
 
-PARSER_LOOKUP = {
-    'mob': (parse_mob, split_on_vnums, None),
-    'obj': (parse_object, split_on_vnums, None),
-    'wld': (parse_room, split_on_vnums, None),
-    'shp': (parse_shop, split_on_vnums, None),
-    'zon': (parse_zone, split_on_vnums, None),
-}
+# upper bound on entries handed to a worker at once, so that one very large
+# file is spread over several workers instead of holding up the whole run
+ENTRIES_PER_CHUNK = 64
+
+# the parsers plus the modules that turn their results into output bytes
+CONVERTER_MODULES = PARSER_MODULES + ('formats', 'parse')
+
+# chunks queued in the process pool per worker, enough to keep every
+# worker busy without reading far ahead of them
+CHUNKS_PER_WORKER = 4
 
 
 def indent(text):
@@ -39,34 +63,343 @@ def log_errors(errors):
         logger.error('Error parsing:\n\n%s\n%s', text, trace)
 
 
-def get_file_type(filepath):
+def get_output_path(out_dir, file_type, filepath, fmt='json'):
+    """
+    map e.g. `world/obj/30.obj` to `<out_dir>/obj/30.json`
+    """
     _, filename = os.path.split(filepath)
-    _, file_type = filename.split('.')
-    return file_type
+    number = filename.split('.')[0]
+    return os.path.join(out_dir, file_type, number + EXTENSIONS[fmt])
+
+
+def split_world_file(file_type, filepath):
+    """
+    read and split one world file into lists of at most ENTRIES_PER_CHUNK
+    entry texts, yielded as they are split, so that a memory-mapped file
+    is only decoded a chunk at a time. always yields at least one
+    (possibly empty) chunk so every file produces an output.
+    """
+    _, splitter, validate = PARSER_LOOKUP[file_type]
+    if splitter is split_on_vnums and not validate:
+        texts = iter_mapped_texts(filepath)
+    else:
+        texts = splitter(read_world_file(filepath, validate))
+
+    chunk = list(itertools.islice(texts, ENTRIES_PER_CHUNK))
+    yield chunk
+    while len(chunk) == ENTRIES_PER_CHUNK:
+        chunk = list(itertools.islice(texts, ENTRIES_PER_CHUNK))
+        if chunk:
+            yield chunk
+
+
+def mark_last(items):
+    """
+    yield (item, is_last) pairs, looking one item ahead
+    """
+    items = iter(items)
+    item = next(items)
+    for next_item in items:
+        yield item, False
+        item = next_item
+    yield item, True
+
+
+def parse_chunk(file_type, texts):
+    """
+    parse a list of entry texts, returning one (dict, error) pair per text
+    """
+    parser, _, _ = PARSER_LOOKUP[file_type]
+    return [parse_entry(text, parser) for text in texts]
+
+
+def iter_work_units(world_dir, out_dir, records, previous, manifest_path=None, fmt='json'):
+    """
+    yield the work units of the files that need to be parsed, one at a
+    time: dicts holding up to ENTRIES_PER_CHUNK entry texts of one file,
+    with their hashes and any cached results. a file is only read and
+    split once the units of the files before it have been taken, and its
+    manifest record, describing the source as it is now, is added to
+    `records` before its first unit is yielded. `previous` holds the
+    records of the last run.
+    """
+    parser_version = get_parser_version(CONVERTER_MODULES)
+
+    for file_type, src in find_world_files(world_dir):
+        dest = get_output_path(out_dir, file_type, src, fmt)
+        cache = {}
+
+        if manifest_path:
+            is_unchanged, records[src] = check_source(src, previous.get(src), parser_version)
+            records[src]['dest'] = dest
+            if is_unchanged and os.path.exists(dest):
+                continue
+            cache = load_entry_cache(previous.get(src), parser_version, dest)
+
+        for texts, is_last in mark_last(split_world_file(file_type, src)):
+            hashes = [hash_text(text) for text in texts] if manifest_path else [None] * len(texts)
+            unit = dict(file_type=file_type, src=src, dest=dest, is_last=is_last)
+            unit.update(texts=texts, hashes=hashes, cached=[cache.get(h) for h in hashes])
+            yield unit
+
+
+def plan_conversion(world_dir, out_dir, manifest_path=None, fmt='json', previous=None):
+    """
+    work out which files need to be parsed, returning a lazy iterator of
+    work units (see `iter_work_units`) along with the dict of manifest
+    records, which is only complete once the units have all been taken.
+    nothing is written or removed.
+    """
+    if previous is None:
+        previous = load_manifest(manifest_path) if manifest_path else {}
+    records = {}
+    return iter_work_units(world_dir, out_dir, records, previous, manifest_path, fmt), records
+
+
+def get_stale_records(previous, records):
+    """
+    the (source, record) pairs of the last manifest whose sources are gone
+    """
+    return [(src, record) for src, record in sorted(previous.items()) if src not in records]
+
+
+def remove_stale_outputs(stale):
+    for _, record in stale:
+        if os.path.exists(record['dest']):
+            os.remove(record['dest'])
+
+
+def replay_skipped_errors(records, converted):
+    """
+    log the parse errors that the files skipped as unchanged had when they
+    were last converted, so they aren't lost on a later run. returns their
+    number.
+    """
+    n_errors = 0
+    for src, record in records.items():
+        if src not in converted and record.get('errors'):
+            click.echo('{} is unchanged, repeating its errors'.format(src), err=True)
+            log_errors(record['errors'])
+            n_errors += len(record['errors'])
+    return n_errors
+
+
+def get_uncached_texts(unit):
+    return [text for text, cached in zip(unit['texts'], unit['cached']) if cached is None]
+
+
+def parse_units(units, executor=None, window=1):
+    """
+    yield (unit, parsed results) pairs in unit order. with an executor, at
+    most `window` chunks are queued in the pool at a time, so the next
+    files are read and split while the workers parse the previous ones
+    instead of every entry text of the world being held at once.
+    """
+    if executor is None:
+        for unit in units:
+            yield unit, parse_chunk(unit['file_type'], get_uncached_texts(unit))
+        return
+
+    pending = collections.deque()
+    for unit in units:
+        pending.append((unit, executor.submit(parse_chunk, unit['file_type'], get_uncached_texts(unit))))
+        if len(pending) >= window:
+            unit, future = pending.popleft()
+            yield unit, future.result()
+    while pending:
+        unit, future = pending.popleft()
+        yield unit, future.result()
+
+
+def merge_chunk_results(unit, parsed):
+    """
+    interleave the freshly parsed results of a work unit with its cached
+    entries, returning (payload, errors, hashes of the payload entries)
+    """
+    payload, errors, hashes = [], [], []
+    parsed = iter(parsed)
+
+    for text_hash, cached in zip(unit['hashes'], unit['cached']):
+        d, error = (cached, None) if cached is not None else next(parsed)
+        if error:
+            errors.append(error)
+        else:
+            payload.append(d)
+            hashes.append(text_hash)
+
+    return payload, errors, hashes
+
+
+def write_converted_file(file_type, dest, payload, changes, fmt='json'):
+    """
+    write one output file, first adding its previous and new entries to
+    `changes` (see `write_patch`) when a patch is being built
+    """
+    if changes is not None:
+        old_entries, new_entries = changes[file_type]
+        old_entries.extend(load_payload(dest) if os.path.exists(dest) else [])
+        new_entries.extend(payload)
+
+    with open(dest, 'w') as f:
+        write_payload(payload, f, fmt)
+
+
+def write_patch(patch_path, changes, stale):
+    """
+    write a JSON Patch of the entries that changed across every rewritten
+    and deleted file. `changes` maps each file type to (old entries, new
+    entries) lists, and the type is diffed as a whole, since patch paths
+    don't say which file an entry is in: a room moved from one file to
+    another is unchanged, not removed and added.
+    """
+    for src, record in stale:
+        if os.path.exists(record['dest']):
+            changes[get_file_type(src)][0].extend(load_payload(record['dest']))
+
+    patch = []
+    for file_type, (old_entries, new_entries) in changes.items():
+        patch.extend(diff_entries(file_type, old_entries, new_entries))
+
+    with open(patch_path, 'w') as f:
+        json.dump(patch, f, indent=2, sort_keys=True)
+
+
+def convert_world(world_dir, out_dir, jobs=1, manifest_path=None, patch_path=None, fmt='json'):
+    """
+    parse every recognized file under `world_dir` and write each to
+    `<out_dir>/<type>/<n>.json` (or `.ndjson`), mirroring the layout that `convert_all.sh`
+    used to produce one interpreter at a time.
+
+    files are split into chunks of entries which are parsed by `jobs`
+    worker processes (0 means one per core, 1 parses in this process).
+    results are reassembled in file and entry order, so the JSON written
+    and the errors logged are the same whatever the number of jobs. files
+    are read and split as the workers need more chunks, rather than all
+    up front.
+
+    if `manifest_path` is given, files whose contents and parser code are
+    unchanged since the manifest was written (and whose output still
+    exists) are skipped, and outputs of sources that have disappeared are
+    removed. within a changed file, entries whose text is unchanged reuse
+    their previous output rather than being parsed again.
+
+    if `patch_path` is given, a JSON Patch describing the entries that were
+    added, replaced or removed in the rewritten and deleted files is
+    written there.
+
+    returns the number of entries that failed to parse, counting those of
+    skipped files as of their last conversion.
+    """
+    n_errors = 0
+    changes = {file_type: ([], []) for file_type in PARSER_LOOKUP} if patch_path else None
+
+    for file_type in PARSER_LOOKUP:
+        os.makedirs(os.path.join(out_dir, file_type), exist_ok=True)
+
+    previous = load_manifest(manifest_path) if manifest_path else {}
+    units, records = plan_conversion(world_dir, out_dir, manifest_path, fmt, previous)
+
+    if jobs == 1:
+        executor = None
+        results = parse_units(units)
+    else:
+        workers = jobs or os.cpu_count() or 1
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = parse_units(units, executor, CHUNKS_PER_WORKER * workers)
 
+    converted = set()
+    try:
+        payload, errors, hashes = [], [], []
+        for unit, parsed in results:
+            chunk_payload, chunk_errors, chunk_hashes = merge_chunk_results(unit, parsed)
+            payload.extend(chunk_payload)
+            errors.extend(chunk_errors)
+            hashes.extend(chunk_hashes)
+            if not unit['is_last']:
+                continue
 
-def parse_based_on_filepath(filepath):
-    # figure out which type of tinyworld file we've been pointed at
-    file_type = get_file_type(filepath)
+            click.echo('parsing {} to {}'.format(unit['src'], unit['dest']), err=True)
 
-    if file_type not in PARSER_LOOKUP:
-        fmt = 'No parser found for file type: "{}"'
-        raise RuntimeError(fmt.format(file_type))
+            log_errors(errors)
+            n_errors += len(errors)
 
-    args = PARSER_LOOKUP[file_type]
-    payload, errors = parse_from_file(filepath, *args)
+            write_converted_file(unit['file_type'], unit['dest'], payload, changes, fmt)
+            converted.add(unit['src'])
+            if manifest_path:
+                records[unit['src']].update(entries=hashes, errors=errors)
 
-    return payload, errors
+            payload, errors, hashes = [], [], []
+    finally:
+        if executor:
+            executor.shutdown()
 
+    n_errors += replay_skipped_errors(records, converted)
+    stale = get_stale_records(previous, records)
+    if manifest_path:
+        save_manifest(manifest_path, records)
 
-@click.command()
+    if patch_path:
+        write_patch(patch_path, changes, stale)
+
+    # only once everything else is written, so a failed run leaves the
+    # outputs of deleted sources in place
+    remove_stale_outputs(stale)
+
+    return n_errors
+
+
+def stream_ndjson(src, dest):
+    """
+    write each entry as one line of compact JSON as soon as it is parsed,
+    logging errors as they happen
+    """
+    f = open(dest, 'w') if dest else click.get_text_stream('stdout')
+
+    try:
+        for d, error in iter_parsed_file(src):
+            if error:
+                log_errors([error])
+            else:
+                f.write(entry_to_ndjson(d))
+    finally:
+        if dest:
+            f.close()
+
+
+class DefaultCommandGroup(click.Group):
+    """
+    group that hands anything which isn't a subcommand name to the
+    single-file command, so `parse.py 30.obj` and `parse.py --dest x 30.obj`
+    behave as they always have
+    """
+
+    default_command = 'file'
+
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and args[0] not in ctx.help_option_names:
+            args = [self.default_command] + args
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultCommandGroup)
+def cli():
+    pass
+
+
+@cli.command(name='file')
 @click.option('--dest', default=None, help='output to file')
+@click.option('--format', 'fmt', type=click.Choice(list(EXTENSIONS)), default='json', help='output format')
 @click.argument('src')
-def parse(src, dest):
+def parse(src, dest, fmt):
+    """parse a single world file to JSON"""
+    if fmt == 'ndjson':
+        stream_ndjson(src, dest)
+        return
+
     payload, errors = parse_based_on_filepath(src)
     log_errors(errors)
 
-    payload_json = json.dumps(payload, indent=2, sort_keys=True)
+    payload_json = payload_to_json(payload)
 
     if dest:
         with open(dest, 'w') as f:
@@ -75,5 +408,165 @@ def parse(src, dest):
         click.echo(payload_json)
 
 
+@cli.command()
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=0), help='worker processes, 0 for one per core')
+@click.option('--incremental', is_flag=True, help='only re-parse files and entries changed since the last run')
+@click.option('--patch', default=None, help='write a JSON Patch of the changed entries to this file')
+@click.option('--format', 'fmt', type=click.Choice(list(EXTENSIONS)), default='json', help='output format')
+@click.argument('world_dir')
+@click.argument('out_dir', default='_output')
+def convert(world_dir, out_dir, jobs, incremental, patch, fmt):
+    """convert a whole world directory to JSON, exiting 1 if any entry fails to parse"""
+    manifest_path = get_default_manifest_path(out_dir) if incremental else None
+    n_errors = convert_world(world_dir, out_dir, jobs=jobs, manifest_path=manifest_path, patch_path=patch, fmt=fmt)
+    if n_errors:
+        click.echo('{} entries failed to parse'.format(n_errors), err=True)
+        raise SystemExit(1)
+
+
+@cli.command(name='index')
+@click.argument('world_dir')
+@click.argument('index_path', default='_index.json')
+def index_world(world_dir, index_path):
+    """record the byte offset of every entry for fast lookups"""
+    from index import build_index
+    from index import save_index
+
+    save_index(build_index(world_dir), index_path)
+
+
+@cli.command()
+@click.option('--index', 'index_path', default='_index.json', help='index written by the index command')
+@click.argument('file_type', type=click.Choice(list(PARSER_LOOKUP)))
+@click.argument('vnum', type=int)
+def entry(index_path, file_type, vnum):
+    """parse a single entry by vnum using an index"""
+    from index import get_entry
+    from index import load_index
+
+    try:
+        index = load_index(index_path)
+    except FileNotFoundError:
+        raise click.ClickException('no index at {}, run `index` first'.format(index_path))
+
+    try:
+        payload = get_entry(index, file_type, vnum)
+    except KeyError:
+        raise click.ClickException('no {} entry #{} in {}, run `index` first'.format(file_type, vnum, index_path))
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(payload_to_json(payload))
+
+
+@cli.command(name='routes')
+@click.option('--landmarks', default=16, type=click.IntRange(min=1), help='landmark rooms for cross-zone routes')
+@click.argument('world_dir')
+@click.argument('routes_path', default='_routes.bin')
+def build_routes(world_dir, routes_path, landmarks):
+    """precompute next-hop and landmark tables for tracking"""
+    from graph import RoomGraph
+    from routes import Routes
+    from world import World
+
+    world = World.load(world_dir)
+    graph = RoomGraph.from_rooms(world.rooms.values())
+    Routes.build(graph, world.zone_by_vnum, n_landmarks=landmarks).save(routes_path)
+
+
+@cli.command()
+@click.option('--output', default=None, help='write the JSON report to this file')
+@click.argument('world_dir')
+def check(world_dir, output):
+    """check every reference between entries, exiting 1 on problems"""
+    from check import check_world
+    from world import World
+
+    report = check_world(World.load(world_dir))
+    report_json = json.dumps(report, indent=2)
+
+    if output:
+        with open(output, 'w') as f:
+            f.write(report_json)
+    else:
+        click.echo(report_json)
+
+    for kind, count in report['counts'].items():
+        click.echo('{}: {}'.format(kind, count), err=True)
+    if report['issues']:
+        raise SystemExit(1)
+
+
+@cli.command()
+@click.option('--resets', default=1000, type=click.IntRange(min=1), help='resets of every zone')
+@click.option('--mob-loss', default=0.0, type=click.FloatRange(0, 1), help='chance a mob is killed between resets')
+@click.option('--object-loss', default=0.0, type=click.FloatRange(0, 1), help='chance a floor object is taken')
+@click.option('--occupied', multiple=True, type=int, help='a zone with players in it, can be repeated')
+@click.option('--seed', default=0, help='seed for the losses')
+@click.option('--output', default=None, help='write the JSON report to this file')
+@click.argument('world_dir')
+def simulate(world_dir, resets, mob_loss, object_loss, occupied, seed, output):
+    """replay zone resets and report steady-state populations"""
+    from resets import ResetSimulator
+    from world import World
+
+    simulator = ResetSimulator(World.load(world_dir), mob_loss, object_loss, occupied, seed)
+    report_json = json.dumps(simulator.run(resets), indent=2)
+
+    if output:
+        with open(output, 'w') as f:
+            f.write(report_json)
+    else:
+        click.echo(report_json)
+
+
+@cli.command(name='export-sqlite')
+@click.option('--incremental', is_flag=True, help='only replace the rows of files changed since the last export')
+@click.argument('world_dir')
+@click.argument('db_path', default='_world.sqlite')
+def export_sqlite_db(world_dir, db_path, incremental):
+    """write a world directory to an SQLite database"""
+    from sqlexport import export_sqlite
+
+    try:
+        result = export_sqlite(world_dir, db_path, incremental=incremental)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    log_errors([error for _, error in result['errors']])
+    click.echo('{parsed} files parsed, {skipped} unchanged, {removed} removed'.format(**result), err=True)
+
+
+@cli.command(name='export-columns')
+@click.argument('world_dir')
+@click.argument('out_dir', default='_columns')
+def export_columns_npz(world_dir, out_dir):
+    """write the numeric fields of each entry type to a .npz of columns"""
+    from columns import export_columns
+    from world import World
+
+    world = World.load(world_dir)
+    log_errors([error for _, error in world.errors])
+    export_columns(world, out_dir)
+
+
+@cli.command()
+@click.option('--output', default=None, help='write the JSON curves to this file')
+@click.argument('world_dir')
+def stats(world_dir, output):
+    """per-zone difficulty curves of mob hit points, damage, xp and gold by level"""
+    from columns import Columns
+    from stats import difficulty_curves
+    from stats import mob_stats
+    from world import World
+
+    curves = difficulty_curves(mob_stats(Columns.from_world(World.load(world_dir), 'mob')))
+    curves_json = json.dumps(curves, indent=2)
+
+    if output:
+        with open(output, 'w') as f:
+            f.write(curves_json)
+    else:
+        click.echo(curves_json)
+
+
 if __name__ == '__main__':
-    parse()
+    cli()
@@ -0,0 +1,361 @@
+# coding: utf-8
+"""
+compact records for parsed entries, for programs that keep a
+whole world in memory. each entity is a `__slots__` object instead of a
+dict, nested values are tuples and namedtuples, flags are the shared flag
+dicts from utils and keywords are interned. `to_dict()` gives back exactly
+what the parsers return:
+
+    parse_record('mob', text).to_dict() == parse_mob(text)
+"""
+import collections
+import sys
+
+from lookup import PARSER_LOOKUP
+from lookup import get_file_type
+from lookup import get_parser_args
+from utils import FrozenFlag
+from utils import flags_to_bitmask
+from utils import iter_entries
+
+Dice = collections.namedtuple('Dice', ['dice', 'sides', 'bonus'])
+Position = collections.namedtuple('Position', ['load', 'default'])
+Affect = collections.namedtuple('Affect', ['location', 'note', 'value'])
+ExtraDesc = collections.namedtuple('ExtraDesc', ['keywords', 'desc'])
+Exit = collections.namedtuple('Exit', ['dir', 'desc', 'keywords', 'key_number', 'room_linked', 'door_flag'])
+BuyType = collections.namedtuple('BuyType', ['value', 'note', 'namelist'])
+Hours = collections.namedtuple('Hours', ['open', 'close'])
+ZoneMob = collections.namedtuple('ZoneMob', ['mob', 'max', 'room', 'inventory', 'equipped'])
+Equipped = collections.namedtuple('Equipped', ['location', 'max', 'id', 'note', 'contents'])
+Given = collections.namedtuple('Given', ['max', 'id', 'contents'])
+Loaded = collections.namedtuple('Loaded', ['max', 'id', 'room', 'contents'])
+Put = collections.namedtuple('Put', ['id', 'max', 'contents'])
+Door = collections.namedtuple('Door', ['room', 'exit', 'state'])
+Removal = collections.namedtuple('Removal', ['room', 'id'])
+
+
+def intern_words(words):
+    return tuple(sys.intern(word) for word in words)
+
+
+def build_nested(items, get_children, build):
+    """
+    [build(item, children) for item in items], where `children` is the
+    same list built for get_children(item). P commands nest deeper than
+    the recursion limit, so the tree is walked with an explicit stack.
+    """
+    # (item, its children still to build, the children built so far)
+    stack = [(None, iter(items), [])]
+    while True:
+        item, pending, built = stack[-1]
+        child = next(pending, stack)
+        if child is not stack:
+            stack.append((child, iter(get_children(child)), []))
+            continue
+        stack.pop()
+        if not stack:
+            return built
+        stack[-1][2].append(build(item, built))
+
+
+def put_to_dict(put, contents):
+    return {'id': put.id, 'max': put.max, 'contents': contents}
+
+
+def to_plain(value):
+    """
+    turns records, namedtuples and tuples back into the dicts and lists
+    the parsers produce. flag dicts are shared as they are.
+    """
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, FrozenFlag):
+        return value
+    if isinstance(value, Put):
+        return build_nested([value], lambda put: put.contents, put_to_dict)[0]
+    if isinstance(value, tuple) and hasattr(value, '_fields'):
+        return {name: to_plain(v) for name, v in zip(value._fields, value)}
+    if isinstance(value, tuple):
+        return [to_plain(v) for v in value]
+    if isinstance(value, dict):
+        return {k: to_plain(v) for k, v in value.items()}
+    return value
+
+
+class Record(object):
+    """
+    base for the entity records. subclasses list their fields in
+    `__slots__` and build themselves from a parsed dict in `from_dict`.
+    fields in `optional` are left out of `to_dict()` when they are None.
+    slots named in `bitmasks` aren't fields: they hold the raw bitvector of
+    a list of flags as an int, e.g. {'flag_bits': 'flags'}.
+    """
+
+    __slots__ = ()
+    fields = ()
+    optional = ()
+    bitmasks = {}
+
+    def __init_subclass__(cls, **kwargs):
+        # subclasses of a record that add no slots of their own keep its fields
+        super().__init_subclass__(**kwargs)
+        if cls.__dict__.get('__slots__'):
+            cls.fields = tuple(name for name in cls.__slots__ if name not in cls.bitmasks)
+
+    def __init__(self, *values):
+        for name, value in zip(self.fields, values):
+            setattr(self, name, value)
+        for name, flags in self.bitmasks.items():
+            setattr(self, name, flags_to_bitmask(getattr(self, flags)))
+
+    def to_dict(self):
+        d = dict()
+        for name in self.fields:
+            value = getattr(self, name)
+            if value is None and name in self.optional:
+                continue
+            d[name] = to_plain(value)
+        return d
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.fields)
+
+    def __hash__(self):
+        # equal records always share their type and vnum
+        return hash((type(self), self.id))
+
+    def __repr__(self):
+        return '<{} #{}>'.format(type(self).__name__, self.id)
+
+
+class Mob(Record):
+    __slots__ = (
+        'id',
+        'aliases',
+        'short_desc',
+        'long_desc',
+        'detail_desc',
+        'mob_type',
+        'alignment',
+        'flags',
+        'affects',
+        'level',
+        'thac0',
+        'armor_class',
+        'max_hit_points',
+        'bare_hand_damage',
+        'gold',
+        'xp',
+        'position',
+        'gender',
+        'extra_spec',
+        'flag_bits',
+        'affect_bits',
+    )
+    bitmasks = {'flag_bits': 'flags', 'affect_bits': 'affects'}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(
+            d['id'],
+            intern_words(d['aliases']),
+            d['short_desc'],
+            d['long_desc'],
+            d['detail_desc'],
+            d['mob_type'],
+            d['alignment'],
+            tuple(d['flags']),
+            tuple(d['affects']),
+            d['level'],
+            d['thac0'],
+            d['armor_class'],
+            Dice(**d['max_hit_points']),
+            Dice(**d['bare_hand_damage']),
+            d['gold'],
+            d['xp'],
+            Position(**d['position']),
+            d['gender'],
+            d['extra_spec'],
+        )
+
+
+class Object(Record):
+    __slots__ = (
+        'id',
+        'aliases',
+        'short_desc',
+        'long_desc',
+        'action_desc',
+        'values',
+        'weight',
+        'cost',
+        'rent',
+        'type',
+        'effects',
+        'wear',
+        'affects',
+        'extra_descs',
+        'effect_bits',
+        'wear_bits',
+    )
+    optional = ('action_desc',)
+    bitmasks = {'effect_bits': 'effects', 'wear_bits': 'wear'}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(
+            d['id'],
+            intern_words(d['aliases']),
+            d['short_desc'],
+            d['long_desc'],
+            d.get('action_desc'),
+            tuple(d['values']),
+            d['weight'],
+            d['cost'],
+            d['rent'],
+            d['type'],
+            tuple(d['effects']),
+            tuple(d['wear']),
+            tuple(Affect(**affect) for affect in d['affects']),
+            tuple(ExtraDesc(intern_words(e['keywords']), e['desc']) for e in d['extra_descs']),
+        )
+
+
+class Room(Record):
+    __slots__ = ('id', 'name', 'desc', 'zone_number', 'flags', 'sector_type', 'exits', 'extra_descs', 'flag_bits')
+    bitmasks = {'flag_bits': 'flags'}
+
+    @classmethod
+    def from_dict(cls, d):
+        exits = []
+        for e in d['exits']:
+            keywords = intern_words(e['keywords'])
+            exits.append(Exit(e['dir'], e['desc'], keywords, e['key_number'], e['room_linked'], e['door_flag']))
+
+        return cls(
+            d['id'],
+            d['name'],
+            d['desc'],
+            d['zone_number'],
+            tuple(d['flags']),
+            d['sector_type'],
+            tuple(exits),
+            tuple(ExtraDesc(intern_words(e['keywords']), e['desc']) for e in d['extra_descs']),
+        )
+
+
+class Shop(Record):
+    __slots__ = (
+        'id',
+        'objects',
+        'sell_rate',
+        'buy_rate',
+        'buy_types',
+        'messages',
+        'temper',
+        'flags',
+        'shopkeeper',
+        'trades_with',
+        'rooms',
+        'times',
+        'flag_bits',
+        'trade_bits',
+    )
+    bitmasks = {'flag_bits': 'flags', 'trade_bits': 'trades_with'}
+
+    @classmethod
+    def from_dict(cls, d):
+        buy_types = []
+        for t in d['buy_types']:
+            namelist = None if t['namelist'] is None else intern_words(t['namelist'])
+            buy_types.append(BuyType(t['value'], t['note'], namelist))
+
+        return cls(
+            d['id'],
+            tuple(d['objects']),
+            d['sell_rate'],
+            d['buy_rate'],
+            tuple(buy_types),
+            d['messages'],
+            d['temper'],
+            tuple(d['flags']),
+            d['shopkeeper'],
+            tuple(d['trades_with']),
+            tuple(d['rooms']),
+            tuple(Hours(**times) for times in d['times']),
+        )
+
+
+def contents_to_tuple(contents):
+    puts = build_nested(contents, lambda c: c['contents'], lambda c, inner: Put(c['id'], c['max'], tuple(inner)))
+    return tuple(puts)
+
+
+class Zone(Record):
+    __slots__ = (
+        'id',
+        'name',
+        'bottom_room',
+        'top_room',
+        'lifespan',
+        'reset_mode',
+        'mobs',
+        'objects',
+        'doors',
+        'remove_objects',
+    )
+
+    @classmethod
+    def from_dict(cls, d):
+        mobs = []
+        for m in d['mobs']:
+            inventory = tuple(Given(g['max'], g['id'], contents_to_tuple(g['contents'])) for g in m['inventory'])
+            equipped = tuple(
+                Equipped(e['location'], e['max'], e['id'], e['note'], contents_to_tuple(e['contents']))
+                for e in m['equipped']
+            )
+            mobs.append(ZoneMob(m['mob'], m['max'], m['room'], inventory, equipped))
+
+        objects = tuple(Loaded(o['max'], o['id'], o['room'], contents_to_tuple(o['contents'])) for o in d['objects'])
+
+        return cls(
+            d['id'],
+            d['name'],
+            d['bottom_room'],
+            d['top_room'],
+            d['lifespan'],
+            d['reset_mode'],
+            tuple(mobs),
+            objects,
+            tuple(Door(**door) for door in d['doors']),
+            tuple(Removal(**remove) for remove in d['remove_objects']),
+        )
+
+
+RECORD_LOOKUP = {
+    'mob': Mob,
+    'obj': Object,
+    'wld': Room,
+    'shp': Shop,
+    'zon': Zone,
+}
+
+
+def parse_record(file_type, text):
+    """
+    parses the text of one entry of the given type into a record
+    """
+    parser, _, _ = PARSER_LOOKUP[file_type]
+    return RECORD_LOOKUP[file_type].from_dict(parser(text))
+
+
+def iter_records(filepath):
+    """
+    like lookup.iter_parsed_file, but yields (record, error) pairs
+    """
+    parser, _, _ = get_parser_args(filepath)
+    record_type = RECORD_LOOKUP[get_file_type(filepath)]
+    for d, error in iter_entries(filepath, parser):
+        yield (None if d is None else record_type.from_dict(d)), error
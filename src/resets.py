@@ -0,0 +1,257 @@
+# coding: utf-8
+"""
+replays zone reset commands over simulated time, to see what a world looks
+like once its zones have reset many times:
+
+    simulator = ResetSimulator(World.load('world'), mob_loss=0.5)
+    report = simulator.run(resets=1000)
+    report['rooms'][3001]
+
+resets follow CircleMUD's reset_zone: every zone resets once at boot, and
+then every `lifespan` minutes if its reset_mode allows it (0 never, 1 only
+while no player is in the zone, 2 always). M, O, G, E and P commands load
+only while fewer than `max` copies of the mob or object exist in the whole
+world, and R removes one copy of an object from the floor of a room.
+
+nothing dies in a world without players, so `mob_loss` and `object_loss`
+stand in for them: before each reset of a zone, every mob in its rooms is
+killed (along with everything it carries) with that probability, and every
+object on the floor is taken with the other.
+
+zone records keep their commands grouped by type instead of in file order,
+so a reset runs the R commands first, then each M with its G and E, then
+each O with its P. a G, E or P only runs when the mob or container it
+belongs to was loaded by the same reset, which is what the if-flag is set
+for in nearly every zone.
+"""
+import collections
+import heapq
+import random
+
+from records import build_nested
+
+RESET_NEVER = 0
+RESET_WHEN_EMPTY = 1
+RESET_ALWAYS = 2
+
+
+def compile_contents(contents, objects):
+    """
+    (vnum, max, contents) tuples for the contents of a zone command,
+    leaving out objects that don't exist along with anything put into them
+    """
+
+    def get_children(put):
+        return [inner for inner in put.contents if inner.id in objects]
+
+    def build(put, inner):
+        return put.id, put.max, tuple(inner)
+
+    return tuple(build_nested([put for put in contents if put.id in objects], get_children, build))
+
+
+def compile_zone(world, zone):
+    """
+    flattens the commands of a zone record into the tuples a reset runs:
+    (removals, mobs, objects, rooms). commands naming a mob, object or room
+    that doesn't exist are dropped, as the game would fail them.
+    """
+    removals = tuple((r.room, r.id) for r in zone.remove_objects if r.room in world.rooms)
+
+    mobs = []
+    for mob in zone.mobs:
+        if mob.mob in world.mobs and mob.room in world.rooms:
+            carried = compile_contents(mob.inventory + mob.equipped, world.objects)
+            mobs.append((mob.mob, mob.max, mob.room, carried))
+
+    objects = []
+    for loaded in zone.objects:
+        if loaded.id in world.objects and loaded.room in world.rooms:
+            objects.append((loaded.id, loaded.max, loaded.room, compile_contents(loaded.contents, world.objects)))
+
+    rooms = sorted(set(room for room, _ in removals) | set(m[2] for m in mobs) | set(o[2] for o in objects))
+    return removals, tuple(mobs), tuple(objects), tuple(rooms)
+
+
+class ResetSimulator(object):
+    """
+    the simulated world: `mob_counts` and `object_counts` are the copies of
+    each vnum in existence, and `rooms` maps a room to its (mobs, floor)
+    lists. a mob is a (vnum, items) tuple and an object a (vnum, contents)
+    tuple, where items and contents are lists of objects. zones listed in
+    `occupied` have a player in them for the whole run.
+    """
+
+    def __init__(self, world, mob_loss=0.0, object_loss=0.0, occupied=(), seed=0):
+        self.programs = {zone.id: compile_zone(world, zone) for zone in world.zones.values()}
+        self.lifespans = {zone.id: max(zone.lifespan, 1) for zone in world.zones.values()}
+        self.reset_modes = {zone.id: zone.reset_mode for zone in world.zones.values()}
+        self.mob_loss = mob_loss
+        self.object_loss = object_loss
+        self.occupied = set(occupied)
+        self.random = random.Random(seed)
+
+        self.mob_counts = collections.Counter()
+        self.object_counts = collections.Counter()
+        self.rooms = {}
+        for removals, mobs, objects, rooms in self.programs.values():
+            for room in rooms:
+                self.rooms[room] = ([], [])
+
+        self.minutes = 0
+        self.resets = collections.Counter()
+        # room -> (mob vnum totals, object vnum totals, number of samples)
+        self.totals = {room: (collections.Counter(), collections.Counter(), [0]) for room in self.rooms}
+
+    def can_reset(self, zone):
+        mode = self.reset_modes[zone]
+        return mode == RESET_ALWAYS or (mode == RESET_WHEN_EMPTY and zone not in self.occupied)
+
+    def run(self, resets=1000, warmup=None):
+        """
+        reset every zone `resets` times (or just once at boot, for zones
+        that never reset) in the order simulated time has them happen, and
+        return the report. populations are sampled right after each reset,
+        except for the first `warmup` resets of a zone (a tenth by default).
+        """
+        warmup = resets // 10 if warmup is None else warmup
+        queue = [(0, zone) for zone in sorted(self.programs)]
+        heapq.heapify(queue)
+
+        while queue:
+            self.minutes, zone = heapq.heappop(queue)
+            self.reset_zone(zone)
+            self.resets[zone] += 1
+
+            again = self.resets[zone] < resets and self.can_reset(zone)
+            if again:
+                heapq.heappush(queue, (self.minutes + self.lifespans[zone], zone))
+            # a zone that won't reset again is sampled as it was left
+            if self.resets[zone] > warmup or not again:
+                self.sample(self.programs[zone][3])
+
+        return self.report()
+
+    def reset_zone(self, zone):
+        removals, mobs, objects, rooms = self.programs[zone]
+        if self.resets[zone] and (self.mob_loss or self.object_loss):
+            self.apply_losses(rooms)
+
+        for room, vnum in removals:
+            floor = self.rooms[room][1]
+            # the newest copy, as objects are added to the head of a room's list in the game
+            for i in range(len(floor) - 1, -1, -1):
+                if floor[i][0] == vnum:
+                    self.extract(floor.pop(i))
+                    break
+
+        mob_counts = self.mob_counts
+        for vnum, max, room, carried in mobs:
+            if mob_counts[vnum] < max:
+                mob_counts[vnum] += 1
+                items = []
+                self.load_contents(carried, items)
+                self.rooms[room][0].append((vnum, items))
+
+        object_counts = self.object_counts
+        for vnum, max, room, contents in objects:
+            if object_counts[vnum] < max:
+                object_counts[vnum] += 1
+                inside = []
+                self.load_contents(contents, inside)
+                self.rooms[room][1].append((vnum, inside))
+
+    def load_contents(self, contents, into):
+        object_counts = self.object_counts
+        # (contents still to load, the list they go into), innermost last
+        pending = [(iter(contents), into)]
+        while pending:
+            items, into = pending[-1]
+            for vnum, max, inner in items:
+                if object_counts[vnum] < max:
+                    object_counts[vnum] += 1
+                    inside = []
+                    into.append((vnum, inside))
+                    if inner:
+                        pending.append((iter(inner), inside))
+                        break
+            else:
+                pending.pop()
+
+    def extract(self, obj):
+        """
+        take an object and everything inside it out of the world
+        """
+        pending = [obj]
+        while pending:
+            vnum, contents = pending.pop()
+            self.object_counts[vnum] -= 1
+            pending.extend(contents)
+
+    def apply_losses(self, rooms):
+        chance = self.random.random
+        for room in rooms:
+            mobs, floor = self.rooms[room]
+            if self.mob_loss and mobs:
+                kept = []
+                for mob in mobs:
+                    if chance() < self.mob_loss:
+                        self.mob_counts[mob[0]] -= 1
+                        for item in mob[1]:
+                            self.extract(item)
+                    else:
+                        kept.append(mob)
+                mobs[:] = kept
+            if self.object_loss and floor:
+                kept = []
+                for obj in floor:
+                    if chance() < self.object_loss:
+                        self.extract(obj)
+                    else:
+                        kept.append(obj)
+                floor[:] = kept
+
+    def sample(self, rooms):
+        for room in rooms:
+            mobs, floor = self.rooms[room]
+            mob_totals, object_totals, samples = self.totals[room]
+            samples[0] += 1
+            mob_totals.update(vnum for vnum, _ in mobs)
+
+            # objects carried by the room's mobs count as in the room
+            vnums = []
+            pending = list(floor)
+            for _, items in mobs:
+                pending.extend(items)
+            while pending:
+                vnum, contents = pending.pop()
+                vnums.append(vnum)
+                pending.extend(contents)
+            object_totals.update(vnums)
+
+    def report(self):
+        """
+        {'minutes': simulated time, 'resets': {zone: resets}, 'rooms': {room:
+        {'mobs': {vnum: mean}, 'objects': {vnum: mean}}}, 'mobs': {vnum:
+        mean}, 'objects': {vnum: mean}}, with the world-wide means summed
+        over rooms. rooms that never held anything are left out.
+        """
+        rooms = {}
+        mobs = collections.Counter()
+        objects = collections.Counter()
+        for room, (mob_totals, object_totals, (samples,)) in sorted(self.totals.items()):
+            if not samples or not (mob_totals or object_totals):
+                continue
+            room_mobs = {vnum: total / samples for vnum, total in sorted(mob_totals.items())}
+            room_objects = {vnum: total / samples for vnum, total in sorted(object_totals.items())}
+            rooms[room] = dict(mobs=room_mobs, objects=room_objects)
+            mobs.update(room_mobs)
+            objects.update(room_objects)
+
+        return dict(
+            minutes=self.minutes,
+            resets=dict(sorted(self.resets.items())),
+            rooms=rooms,
+            mobs=dict(sorted(mobs.items())),
+            objects=dict(sorted(objects.items())),
+        )
@@ -6,7 +6,7 @@ from constants import ROOM_FLAGS
 from constants import ROOM_SECTOR_TYPES
 from utils import bitvector_to_flags
 from utils import clean_bitvector
-from utils import lookup_value_to_dict
+from utils import lookup_value_to_flag
 
 EXIT_RE = r"""D(\d+)
 (.*?)~
@@ -37,7 +37,7 @@ def parse_exits(text):
         exit['keywords'] = keys.split()
         exit['key_number'] = int(key_num)
         exit['room_linked'] = int(to)
-        exit['door_flag'] = {'value': int(flag), 'note': ROOM_DOOR_FLAGS.get(int(flag), None)}
+        exit['door_flag'] = lookup_value_to_flag(int(flag), ROOM_DOOR_FLAGS)
         exits.append(exit)
 
     return exits
@@ -69,7 +69,7 @@ def parse_room(text):
         d['flags'] = bitvector_to_flags(flags, ROOM_FLAGS)
 
     # sector type flag is always an int
-    d['sector_type'] = lookup_value_to_dict(int(sector), ROOM_SECTOR_TYPES)
+    d['sector_type'] = lookup_value_to_flag(int(sector), ROOM_SECTOR_TYPES)
 
     bottom_matter = '~'.join(parts[2:])
     d['exits'] = parse_exits(bottom_matter)
@@ -0,0 +1,403 @@
+# coding: utf-8
+"""
+precomputed route tables for answering "which way from room A toward room
+B" without a search per call, the way `track` and hunting mobs need it.
+
+inside a zone the answer is a lookup in that zone's all-pairs next-hop
+table, built with one BFS per room over the zone's own exits. between
+zones it comes from an A* search over the room graph, guided by landmark
+(ALT) distance tables: the BFS distance from and to a handful of far-apart
+landmark rooms bounds the distance between any two rooms from below.
+
+everything is written to one file of flat arrays that `Routes.open` maps
+into memory instead of reading:
+
+    Routes.build(graph, world.zone_by_vnum).save('_routes.bin')
+    Routes.open('_routes.bin').next_direction(3001, 3054)
+"""
+import array
+import bisect
+import heapq
+import mmap
+import struct
+import sys
+
+ROUTES_MAGIC = b'CMROUTES'
+ROUTES_VERSION = 1
+
+# magic, version, byte order, rooms, exits, zones, table bytes, landmarks
+HEADER = struct.Struct('<8sI8sQQQQQ')
+
+# distances are stored as unsigned shorts, with this meaning unreachable
+UNREACHABLE = 0xFFFF
+
+# the arrays in the file, in order: attribute name and array typecode
+SECTIONS = (
+    ('vnums', 'i'),
+    ('offsets', 'i'),
+    ('targets', 'i'),
+    ('directions', 'b'),
+    ('room_zone', 'i'),
+    ('room_local', 'i'),
+    ('zone_ids', 'i'),
+    ('zone_sizes', 'i'),
+    ('zone_offsets', 'q'),
+    ('tables', 'b'),
+    ('landmarks', 'i'),
+    ('from_landmark', 'H'),
+    ('to_landmark', 'H'),
+)
+
+
+def get_section_lengths(n_rooms, n_exits, n_zones, n_table_bytes, n_landmarks):
+    return (
+        n_rooms,
+        n_rooms + 1,
+        n_exits,
+        n_exits,
+        n_rooms,
+        n_rooms,
+        n_zones,
+        n_zones,
+        n_zones,
+        n_table_bytes,
+        n_landmarks,
+        n_landmarks * n_rooms,
+        n_landmarks * n_rooms,
+    )
+
+
+def get_padding(position):
+    # sections start on 8-byte boundaries so they can be viewed in place
+    return -position % 8
+
+
+def reverse_csr(offsets, targets, n_rooms):
+    """
+    offsets and sources of the graph with every exit turned around
+    """
+    counts = array.array('i', [0]) * (n_rooms + 1)
+    for target in targets:
+        counts[target + 1] += 1
+    for node in range(n_rooms):
+        counts[node + 1] += counts[node]
+
+    reverse_offsets = array.array('i', counts)
+    sources = array.array('i', [0]) * len(targets)
+    for node in range(n_rooms):
+        for i in range(offsets[node], offsets[node + 1]):
+            target = targets[i]
+            sources[counts[target]] = node
+            counts[target] += 1
+    return reverse_offsets, sources
+
+
+def bfs_distances(offsets, targets, source, n_rooms):
+    """
+    the number of exits on a shortest walk from `source` to every room, a
+    level of the search at a time
+    """
+    distances = array.array('H', [UNREACHABLE]) * n_rooms
+    distances[source] = 0
+    frontier = [source]
+    distance = 0
+    while frontier:
+        distance = min(distance + 1, UNREACHABLE - 1)
+        next_frontier = []
+        for node in frontier:
+            for target in targets[offsets[node] : offsets[node + 1]]:
+                if distances[target] == UNREACHABLE:
+                    distances[target] = distance
+                    next_frontier.append(target)
+        frontier = next_frontier
+    return distances
+
+
+def choose_landmarks(graph, reverse_offsets, sources, n_landmarks):
+    """
+    landmarks picked one at a time as the room farthest from the ones
+    picked so far, counting exits in either direction. rooms unreachable
+    from every landmark so far are preferred, so each separate part of the
+    world gets a landmark while there are any left.
+
+    returns (landmark, distances from it, distances to it) tuples.
+    """
+    n_rooms = len(graph.vnums)
+    nearest = array.array('H', [UNREACHABLE]) * n_rooms
+    landmarks = []
+    candidate = 0
+
+    while n_rooms and len(landmarks) < n_landmarks:
+        forward = bfs_distances(graph.offsets, graph.targets, candidate, n_rooms)
+        backward = bfs_distances(reverse_offsets, sources, candidate, n_rooms)
+        landmarks.append((candidate, forward, backward))
+
+        nearest = array.array('H', map(min, nearest, forward, backward))
+        candidate = max(range(n_rooms), key=nearest.__getitem__)
+        if nearest[candidate] == 0:
+            break  # every room is a landmark already
+    return landmarks
+
+
+def build_zone_table(graph, nodes):
+    """
+    the next-hop table of one zone: for local rooms i and j, entry
+    i * len(nodes) + j is the direction of the first exit on a shortest
+    walk from i to j that stays inside the zone, or -1 if there is none
+    """
+    k = len(nodes)
+    local = {node: i for i, node in enumerate(nodes)}
+
+    # the zone's own exits, as (local target, direction) lists
+    exits = []
+    for node in nodes:
+        start, end = graph.offsets[node], graph.offsets[node + 1]
+        pairs = zip(graph.targets[start:end], graph.directions[start:end])
+        exits.append([(local[target], direction) for target, direction in pairs if target in local])
+    neighbours = [[target for target, _ in pairs] for pairs in exits]
+
+    table = array.array('b')
+    for source in range(k):
+        row = [-1] * k
+        seen = [False] * k
+        seen[source] = True
+        queue = []
+        for target, direction in exits[source]:
+            if not seen[target]:
+                seen[target] = True
+                row[target] = direction
+                queue.append(target)
+        for node in queue:
+            first = row[node]
+            for target in neighbours[node]:
+                if not seen[target]:
+                    seen[target] = True
+                    row[target] = first
+                    queue.append(target)
+        table.extend(row)
+    return table
+
+
+class Routes(object):
+    """
+    the route tables as flat arrays. built ones hold `array.array`s and
+    opened ones hold memoryviews into the mapped file; both are read the
+    same way.
+    """
+
+    def __init__(self, arrays, f=None, mm=None, view=None):
+        for (name, _), values in zip(SECTIONS, arrays):
+            setattr(self, name, values)
+        self.file = f
+        self.mmap = mm
+        self.view = view
+
+    @classmethod
+    def build(cls, graph, zone_of, n_landmarks=16):
+        """
+        build the tables for a RoomGraph, grouping rooms into zones with
+        `zone_of` (vnum -> zone id, e.g. `world.zone_by_vnum`). rooms in no
+        zone get no table.
+        """
+        n_rooms = len(graph.vnums)
+
+        nodes_by_zone = {}
+        for node, vnum in enumerate(graph.vnums):
+            zone = zone_of.get(vnum)
+            if zone is not None:
+                nodes_by_zone.setdefault(zone, []).append(node)
+
+        room_zone = array.array('i', [-1]) * n_rooms
+        room_local = array.array('i', [-1]) * n_rooms
+        zone_ids, zone_sizes, zone_offsets = array.array('i'), array.array('i'), array.array('q')
+        tables = array.array('b')
+        for slot, zone in enumerate(sorted(nodes_by_zone)):
+            nodes = nodes_by_zone[zone]
+            for i, node in enumerate(nodes):
+                room_zone[node] = slot
+                room_local[node] = i
+            zone_ids.append(zone)
+            zone_sizes.append(len(nodes))
+            zone_offsets.append(len(tables))
+            tables.extend(build_zone_table(graph, nodes))
+
+        reverse_offsets, sources = reverse_csr(graph.offsets, graph.targets, n_rooms)
+        landmarks = array.array('i')
+        from_landmark, to_landmark = array.array('H'), array.array('H')
+        for landmark, forward, backward in choose_landmarks(graph, reverse_offsets, sources, n_landmarks):
+            landmarks.append(landmark)
+            from_landmark.extend(forward)
+            to_landmark.extend(backward)
+
+        arrays = (
+            array.array('i', graph.vnums),
+            array.array('i', graph.offsets),
+            array.array('i', graph.targets),
+            array.array('b', graph.directions),
+            room_zone,
+            room_local,
+            zone_ids,
+            zone_sizes,
+            zone_offsets,
+            tables,
+            landmarks,
+            from_landmark,
+            to_landmark,
+        )
+        return cls(arrays)
+
+    def get_counts(self):
+        return len(self.vnums), len(self.targets), len(self.zone_ids), len(self.tables), len(self.landmarks)
+
+    def save(self, path):
+        n_rooms, n_exits, n_zones, n_table_bytes, n_landmarks = self.get_counts()
+        header = HEADER.pack(
+            ROUTES_MAGIC,
+            ROUTES_VERSION,
+            sys.byteorder.encode('ascii'),
+            n_rooms,
+            n_exits,
+            n_zones,
+            n_table_bytes,
+            n_landmarks,
+        )
+
+        with open(path, 'wb') as f:
+            f.write(header)
+            position = len(header)
+            for name, typecode in SECTIONS:
+                f.write(b'\0' * get_padding(position))
+                position += get_padding(position)
+                data = array.array(typecode, getattr(self, name)).tobytes()
+                f.write(data)
+                position += len(data)
+
+    @classmethod
+    def open(cls, path):
+        """
+        map a file written by `save` into memory. nothing but the header is
+        read up front.
+        """
+        f = open(path, 'rb')
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, byteorder, *counts = HEADER.unpack_from(mm)
+        if magic != ROUTES_MAGIC or version != ROUTES_VERSION:
+            raise RuntimeError('Not a routes file, or an unsupported version: "{}"'.format(path))
+        if byteorder.rstrip(b'\0').decode('ascii') != sys.byteorder:
+            raise RuntimeError('Routes file "{}" was written with a different byte order'.format(path))
+
+        view = memoryview(mm)
+        arrays = []
+        position = HEADER.size
+        for (_, typecode), length in zip(SECTIONS, get_section_lengths(*counts)):
+            position += get_padding(position)
+            size = length * array.array(typecode).itemsize
+            arrays.append(view[position : position + size].cast(typecode))
+            position += size
+        return cls(arrays, f, mm, view)
+
+    def close(self):
+        if self.mmap is not None:
+            for name, _ in SECTIONS:
+                getattr(self, name).release()
+            self.view.release()
+            self.mmap.close()
+            self.file.close()
+            self.mmap = self.file = self.view = None
+
+    def get_node(self, vnum):
+        node = bisect.bisect_left(self.vnums, vnum)
+        if node == len(self.vnums) or self.vnums[node] != vnum:
+            raise KeyError(vnum)
+        return node
+
+    def lookup_direction(self, a, b):
+        """
+        the next-hop table entry for nodes `a` and `b`: a direction, -1 when
+        the zone has no inside walk between them, None when they aren't in
+        the same zone
+        """
+        zone = self.room_zone[a]
+        if zone == -1 or zone != self.room_zone[b]:
+            return None
+        k = self.zone_sizes[zone]
+        return self.tables[self.zone_offsets[zone] + self.room_local[a] * k + self.room_local[b]]
+
+    def distance_bound(self, a, b):
+        """
+        a lower bound on the number of exits between nodes `a` and `b`
+        """
+        n_rooms = len(self.vnums)
+        bound = 0
+        for i in range(len(self.landmarks)):
+            start = i * n_rooms
+            from_a, from_b = self.from_landmark[start + a], self.from_landmark[start + b]
+            if from_a != UNREACHABLE and from_b != UNREACHABLE:
+                bound = max(bound, from_b - from_a)
+            to_a, to_b = self.to_landmark[start + a], self.to_landmark[start + b]
+            if to_a != UNREACHABLE and to_b != UNREACHABLE:
+                bound = max(bound, to_a - to_b)
+        return bound
+
+    def search(self, a, b):
+        """
+        A* from node `a` to node `b` with the landmark bound as heuristic.
+        returns the list of nodes on a shortest walk, or None.
+        """
+        offsets, targets = self.offsets, self.targets
+        parents = {a: a}
+        costs = {a: 0}
+
+        # among equally promising rooms the one farthest along comes first,
+        # which keeps grid-like areas with many shortest walks from being
+        # explored in full
+        heap = [(self.distance_bound(a, b), 0, a)]
+
+        while heap:
+            _, negative_cost, node = heapq.heappop(heap)
+            cost = -negative_cost
+            if node == b:
+                path = [node]
+                while parents[node] != node:
+                    node = parents[node]
+                    path.append(node)
+                return path[::-1]
+            if cost > costs[node]:
+                continue  # already reached more cheaply
+
+            cost += 1
+            for target in targets[offsets[node] : offsets[node + 1]]:
+                if cost < costs.get(target, UNREACHABLE):
+                    costs[target] = cost
+                    parents[target] = node
+                    heapq.heappush(heap, (cost + self.distance_bound(target, b), -cost, target))
+        return None
+
+    def find_path(self, a, b):
+        """
+        the vnums of the rooms on a shortest walk from room `a` to room `b`,
+        both included, or None if there is no walk
+        """
+        path = self.search(self.get_node(a), self.get_node(b))
+        return None if path is None else [self.vnums[node] for node in path]
+
+    def next_direction(self, a, b):
+        """
+        the direction of the exit to take from room `a` toward room `b`, or
+        None if `b` can't be reached (or is `a`). inside a zone this is a
+        table lookup.
+        """
+        a, b = self.get_node(a), self.get_node(b)
+        if a == b:
+            return None
+
+        direction = self.lookup_direction(a, b)
+        if direction is not None and direction != -1:
+            return direction
+
+        path = self.search(a, b)
+        if path is None:
+            return None
+        for i in range(self.offsets[a], self.offsets[a + 1]):
+            if self.targets[i] == path[1]:
+                return self.directions[i]
@@ -10,6 +10,7 @@ from constants import SHOP_FLAGS
 from constants import SHOP_TRADES_WITH
 from utils import bitvector_to_flags
 from utils import clean_bitvector
+from utils import get_flag_table
 
 
 def buy_type_to_dict(line):
@@ -38,8 +39,7 @@ def buy_type_to_dict(line):
         namelist = [token.lower() for token in tokens[1:]]
 
     # lookup the bitvector value from the flag for standardization
-    reverse = {v: k for k, v in OBJECT_TYPE_FLAGS.items()}
-    value = reverse.get(item_type, None)
+    value = get_flag_table(OBJECT_TYPE_FLAGS).reverse.get(item_type, None)
 
     return dict(value=value, note=item_type, namelist=namelist)
 
@@ -0,0 +1,521 @@
+# coding: utf-8
+"""
+exports a world directory into an SQLite database with one table per kind
+of entry and child tables for everything the parsers return as a list, so
+that questions across the whole world are a query:
+
+    SELECT rooms.vnum FROM rooms JOIN room_flags ON room_flags.room = rooms.vnum
+    WHERE room_flags.flag = 'DEATH' AND rooms.zone BETWEEN 30 AND 40
+
+flags are stored once per entity and flag in the `*_flags` junction tables
+(`kind` tells the bitvectors of an entity apart), `zone` is the zone whose
+range holds the vnum, and the `search` table is an FTS5 index over the
+names, keywords and descriptions of every entry:
+
+    SELECT file_type, vnum FROM search WHERE search MATCH 'fountain'
+
+every row of a top-level table remembers the file it came from. with
+`incremental`, files that haven't changed since the last export are left
+alone and the rows of the others are replaced. child rows go with their
+parent through ON DELETE CASCADE.
+
+as in World, the first entry with a vnum wins, and the entries skipped
+for it are listed in the `duplicates` table. an incremental export also
+re-exports the unchanged files sharing a vnum with a changed or removed
+one, so the same entry wins as in an export from scratch.
+"""
+import collections
+import json
+import os
+import sqlite3
+
+from lookup import PARSER_MODULES
+from lookup import find_world_files
+from lookup import iter_parsed_file
+from manifest import check_source
+from manifest import get_parser_version
+from zonemap import ZoneMap
+
+SCHEMA_VERSION = 3
+
+# kept in the `meta` table, so that only databases written here are ever
+# replaced
+EXPORT_MARKER = ('format', 'circlemud-world')
+
+SCHEMA = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE files (path TEXT PRIMARY KEY, record TEXT NOT NULL);
+CREATE TABLE duplicates (file_type TEXT NOT NULL, vnum INTEGER NOT NULL, file TEXT NOT NULL);
+
+CREATE TABLE zones (
+    vnum INTEGER PRIMARY KEY, file TEXT NOT NULL, name TEXT, bottom_room INTEGER, top_room INTEGER,
+    lifespan INTEGER, reset_mode INTEGER
+);
+CREATE TABLE zone_commands (
+    zone INTEGER NOT NULL REFERENCES zones ON DELETE CASCADE, seq INTEGER NOT NULL, parent INTEGER,
+    command TEXT NOT NULL, vnum INTEGER, max INTEGER, room INTEGER, arg INTEGER, state INTEGER
+);
+
+CREATE TABLE rooms (
+    vnum INTEGER PRIMARY KEY, file TEXT NOT NULL, zone INTEGER, zone_number INTEGER, name TEXT, desc TEXT,
+    sector_type TEXT
+);
+CREATE TABLE room_flags (
+    room INTEGER NOT NULL REFERENCES rooms ON DELETE CASCADE, kind TEXT, value INTEGER, flag TEXT
+);
+CREATE TABLE exits (
+    room INTEGER NOT NULL REFERENCES rooms ON DELETE CASCADE, dir INTEGER, desc TEXT, keywords TEXT,
+    key_number INTEGER, room_linked INTEGER, door_flag TEXT
+);
+CREATE TABLE room_extra_descs (
+    room INTEGER NOT NULL REFERENCES rooms ON DELETE CASCADE, keywords TEXT, desc TEXT
+);
+
+CREATE TABLE mobs (
+    vnum INTEGER PRIMARY KEY, file TEXT NOT NULL, zone INTEGER, aliases TEXT, short_desc TEXT, long_desc TEXT,
+    detail_desc TEXT, mob_type TEXT, alignment INTEGER, level INTEGER, thac0 INTEGER, armor_class INTEGER,
+    hp_dice INTEGER, hp_sides INTEGER, hp_bonus INTEGER, damage_dice INTEGER, damage_sides INTEGER,
+    damage_bonus INTEGER, gold INTEGER, xp INTEGER, load_position TEXT, default_position TEXT, gender TEXT
+);
+CREATE TABLE mob_flags (
+    mob INTEGER NOT NULL REFERENCES mobs ON DELETE CASCADE, kind TEXT, value INTEGER, flag TEXT
+);
+
+CREATE TABLE objects (
+    vnum INTEGER PRIMARY KEY, file TEXT NOT NULL, zone INTEGER, aliases TEXT, short_desc TEXT, long_desc TEXT,
+    action_desc TEXT, type TEXT, value0 INTEGER, value1 INTEGER, value2 INTEGER, value3 INTEGER,
+    weight INTEGER, cost INTEGER, rent INTEGER
+);
+CREATE TABLE object_flags (
+    object INTEGER NOT NULL REFERENCES objects ON DELETE CASCADE, kind TEXT, value INTEGER, flag TEXT
+);
+CREATE TABLE object_affects (
+    object INTEGER NOT NULL REFERENCES objects ON DELETE CASCADE, location INTEGER, note TEXT, value INTEGER
+);
+CREATE TABLE object_extra_descs (
+    object INTEGER NOT NULL REFERENCES objects ON DELETE CASCADE, keywords TEXT, desc TEXT
+);
+
+CREATE TABLE shops (
+    vnum INTEGER PRIMARY KEY, file TEXT NOT NULL, zone INTEGER, shopkeeper INTEGER, sell_rate REAL,
+    buy_rate REAL, temper INTEGER, open1 INTEGER, close1 INTEGER, open2 INTEGER, close2 INTEGER
+);
+CREATE TABLE shop_objects (shop INTEGER NOT NULL REFERENCES shops ON DELETE CASCADE, object INTEGER);
+CREATE TABLE shop_rooms (shop INTEGER NOT NULL REFERENCES shops ON DELETE CASCADE, room INTEGER);
+CREATE TABLE shop_flags (
+    shop INTEGER NOT NULL REFERENCES shops ON DELETE CASCADE, kind TEXT, value INTEGER, flag TEXT
+);
+CREATE TABLE shop_buy_types (
+    shop INTEGER NOT NULL REFERENCES shops ON DELETE CASCADE, value INTEGER, type TEXT, namelist TEXT
+);
+CREATE TABLE shop_messages (
+    shop INTEGER NOT NULL REFERENCES shops ON DELETE CASCADE, name TEXT, message TEXT
+);
+
+CREATE VIRTUAL TABLE search USING fts5(
+    file_type UNINDEXED, vnum UNINDEXED, file UNINDEXED, name, keywords, desc
+);
+
+CREATE INDEX duplicates_file ON duplicates (file);
+CREATE INDEX zones_file ON zones (file);
+CREATE INDEX zone_commands_zone ON zone_commands (zone);
+CREATE INDEX zone_commands_vnum ON zone_commands (command, vnum);
+CREATE INDEX rooms_file ON rooms (file);
+CREATE INDEX rooms_zone ON rooms (zone);
+CREATE INDEX room_flags_room ON room_flags (room);
+CREATE INDEX room_flags_flag ON room_flags (flag, room);
+CREATE INDEX exits_room ON exits (room);
+CREATE INDEX exits_room_linked ON exits (room_linked);
+CREATE INDEX room_extra_descs_room ON room_extra_descs (room);
+CREATE INDEX mobs_file ON mobs (file);
+CREATE INDEX mobs_zone ON mobs (zone);
+CREATE INDEX mob_flags_mob ON mob_flags (mob);
+CREATE INDEX mob_flags_flag ON mob_flags (flag, mob);
+CREATE INDEX objects_file ON objects (file);
+CREATE INDEX objects_zone ON objects (zone);
+CREATE INDEX object_flags_object ON object_flags (object);
+CREATE INDEX object_flags_flag ON object_flags (flag, object);
+CREATE INDEX object_affects_object ON object_affects (object);
+CREATE INDEX object_extra_descs_object ON object_extra_descs (object);
+CREATE INDEX shops_file ON shops (file);
+CREATE INDEX shops_zone ON shops (zone);
+CREATE INDEX shop_objects_shop ON shop_objects (shop);
+CREATE INDEX shop_objects_object ON shop_objects (object);
+CREATE INDEX shop_rooms_shop ON shop_rooms (shop);
+CREATE INDEX shop_flags_shop ON shop_flags (shop);
+CREATE INDEX shop_flags_flag ON shop_flags (flag, shop);
+CREATE INDEX shop_buy_types_shop ON shop_buy_types (shop);
+CREATE INDEX shop_messages_shop ON shop_messages (shop);
+'''
+
+# the table for the entries of each file type, with a zone column for all
+# but the zones themselves
+ENTRY_TABLES = {
+    'mob': 'mobs',
+    'obj': 'objects',
+    'wld': 'rooms',
+    'shp': 'shops',
+    'zon': 'zones',
+}
+
+# rows are inserted parents first, so the foreign keys hold
+TABLE_ORDER = (
+    'zones',
+    'zone_commands',
+    'rooms',
+    'room_flags',
+    'exits',
+    'room_extra_descs',
+    'mobs',
+    'mob_flags',
+    'objects',
+    'object_flags',
+    'object_affects',
+    'object_extra_descs',
+    'shops',
+    'shop_objects',
+    'shop_rooms',
+    'shop_flags',
+    'shop_buy_types',
+    'shop_messages',
+    'search',
+    'duplicates',
+)
+
+
+def flag_rows(vnum, kind, flags):
+    return [(vnum, kind, flag['value'], flag['note']) for flag in flags]
+
+
+def join_words(words):
+    return None if words is None else ' '.join(words)
+
+
+def add_room(rows, d, path):
+    vnum = d['id']
+    rows['rooms'].append((vnum, path, None, d['zone_number'], d['name'], d['desc'], d['sector_type']['note']))
+    rows['room_flags'].extend(flag_rows(vnum, 'flags', d['flags']))
+    for e in d['exits']:
+        exit_row = (vnum, e['dir'], e['desc'], join_words(e['keywords']), e['key_number'], e['room_linked'])
+        rows['exits'].append(exit_row + (e['door_flag']['note'],))
+    rows['room_extra_descs'].extend((vnum, join_words(e['keywords']), e['desc']) for e in d['extra_descs'])
+
+    extra = [e['desc'] for e in d['extra_descs']]
+    keywords = [word for e in d['extra_descs'] for word in e['keywords']]
+    rows['search'].append(('wld', vnum, path, d['name'], ' '.join(keywords), '\n'.join([d['desc']] + extra)))
+
+
+def add_mob(rows, d, path):
+    vnum = d['id']
+    hp, damage, position = d['max_hit_points'], d['bare_hand_damage'], d['position']
+    rows['mobs'].append(
+        (
+            vnum,
+            path,
+            None,
+            join_words(d['aliases']),
+            d['short_desc'],
+            d['long_desc'],
+            d['detail_desc'],
+            d['mob_type'],
+            d['alignment'],
+            d['level'],
+            d['thac0'],
+            d['armor_class'],
+            hp['dice'],
+            hp['sides'],
+            hp['bonus'],
+            damage['dice'],
+            damage['sides'],
+            damage['bonus'],
+            d['gold'],
+            d['xp'],
+            position['load']['note'],
+            position['default']['note'],
+            d['gender']['note'],
+        )
+    )
+    rows['mob_flags'].extend(flag_rows(vnum, 'flags', d['flags']))
+    rows['mob_flags'].extend(flag_rows(vnum, 'affects', d['affects']))
+
+    desc = '\n'.join([d['long_desc'], d['detail_desc']])
+    rows['search'].append(('mob', vnum, path, d['short_desc'], join_words(d['aliases']), desc))
+
+
+def add_object(rows, d, path):
+    vnum = d['id']
+    values = (list(d['values']) + [None] * 4)[:4]
+    rows['objects'].append(
+        (
+            vnum,
+            path,
+            None,
+            join_words(d['aliases']),
+            d['short_desc'],
+            d['long_desc'],
+            d.get('action_desc'),
+            d['type']['note'],
+            *values,
+            d['weight'],
+            d['cost'],
+            d['rent'],
+        )
+    )
+    rows['object_flags'].extend(flag_rows(vnum, 'effects', d['effects']))
+    rows['object_flags'].extend(flag_rows(vnum, 'wear', d['wear']))
+    rows['object_affects'].extend((vnum, a['location'], a['note'], a['value']) for a in d['affects'])
+    rows['object_extra_descs'].extend((vnum, join_words(e['keywords']), e['desc']) for e in d['extra_descs'])
+
+    desc = '\n'.join([d['long_desc']] + [e['desc'] for e in d['extra_descs']])
+    rows['search'].append(('obj', vnum, path, d['short_desc'], join_words(d['aliases']), desc))
+
+
+def add_shop(rows, d, path):
+    vnum = d['id']
+    times = [t for hours in d['times'] for t in (hours['open'], hours['close'])]
+    times = (times + [None] * 4)[:4]
+    rows['shops'].append((vnum, path, None, d['shopkeeper'], d['sell_rate'], d['buy_rate'], d['temper'], *times))
+    rows['shop_objects'].extend((vnum, obj) for obj in d['objects'])
+    rows['shop_rooms'].extend((vnum, room) for room in d['rooms'])
+    rows['shop_flags'].extend(flag_rows(vnum, 'flags', d['flags']))
+    rows['shop_flags'].extend(flag_rows(vnum, 'trades_with', d['trades_with']))
+    rows['shop_buy_types'].extend((vnum, t['value'], t['note'], join_words(t['namelist'])) for t in d['buy_types'])
+    rows['shop_messages'].extend((vnum, name, message) for name, message in d['messages'].items())
+
+
+def add_contents(commands, zone, parent, contents):
+    """
+    P commands for the (nested) contents of the command numbered `parent`,
+    walked without recursion
+    """
+    pending = [(parent, put) for put in reversed(contents)]
+    while pending:
+        parent, put = pending.pop()
+        seq = len(commands)
+        commands.append((zone, seq, parent, 'P', put['id'], put['max'], None, None, None))
+        pending.extend((seq, inner) for inner in reversed(put['contents']))
+
+
+def add_zone(rows, d, path):
+    vnum = d['id']
+    rows['zones'].append((vnum, path, d['name'], d['bottom_room'], d['top_room'], d['lifespan'], d['reset_mode']))
+
+    # zone, seq, parent, command, vnum, max, room, arg, state
+    commands = []
+    for m in d['mobs']:
+        mob_seq = len(commands)
+        commands.append((vnum, mob_seq, None, 'M', m['mob'], m['max'], m['room'], None, None))
+        for g in m['inventory']:
+            commands.append((vnum, len(commands), mob_seq, 'G', g['id'], g['max'], None, None, None))
+            add_contents(commands, vnum, len(commands) - 1, g['contents'])
+        for e in m['equipped']:
+            commands.append((vnum, len(commands), mob_seq, 'E', e['id'], e['max'], None, e['location'], None))
+            add_contents(commands, vnum, len(commands) - 1, e['contents'])
+    for o in d['objects']:
+        commands.append((vnum, len(commands), None, 'O', o['id'], o['max'], o['room'], None, None))
+        add_contents(commands, vnum, len(commands) - 1, o['contents'])
+    for door in d['doors']:
+        commands.append((vnum, len(commands), None, 'D', None, None, door['room'], door['exit'], door['state']))
+    for r in d['remove_objects']:
+        commands.append((vnum, len(commands), None, 'R', r['id'], None, r['room'], None, None))
+    rows['zone_commands'].extend(commands)
+
+
+ROW_BUILDERS = {
+    'mob': add_mob,
+    'obj': add_object,
+    'wld': add_room,
+    'shp': add_shop,
+    'zon': add_zone,
+}
+
+
+def get_tables(db):
+    try:
+        return set(name for name, in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+    except sqlite3.DatabaseError as e:
+        raise RuntimeError('Not an SQLite database: {}'.format(e))
+
+
+def is_export(db, tables):
+    """
+    whether the database holds the meta table this module writes
+    """
+    if 'meta' not in tables:
+        return False
+    return db.execute('SELECT value FROM meta WHERE key = ?', EXPORT_MARKER[:1]).fetchone() == EXPORT_MARKER[1:]
+
+
+def connect(db_path, fresh=False):
+    """
+    open the database at `db_path`, creating the schema if it is new, or
+    when it is an export by another version of this module or `fresh`.
+    any other database is left alone and raises a RuntimeError.
+    """
+    db = sqlite3.connect(db_path)
+    try:
+        tables = get_tables(db)
+        if tables and not is_export(db, tables):
+            raise RuntimeError('"{}" is not a world export, refusing to overwrite it'.format(db_path))
+    except RuntimeError:
+        db.close()
+        raise
+
+    if tables and not fresh and db.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION:
+        db.execute('PRAGMA foreign_keys = ON')
+        return db
+
+    if tables:
+        db.close()
+        os.remove(db_path)
+        db = sqlite3.connect(db_path)
+    db.execute('PRAGMA foreign_keys = ON')
+    db.executescript(SCHEMA)
+    with db:
+        db.execute('INSERT INTO meta VALUES (?, ?)', EXPORT_MARKER)
+    db.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+    return db
+
+
+def delete_file_rows(db, path):
+    for table in ENTRY_TABLES.values():
+        db.execute('DELETE FROM {} WHERE file = ?'.format(table), (path,))
+    db.execute('DELETE FROM search WHERE file = ?', (path,))
+    db.execute('DELETE FROM duplicates WHERE file = ?', (path,))
+
+
+def parse_files(files):
+    """
+    {path: (file type, parsed dicts)} for (file type, path) pairs, and
+    the parse errors as (path, error) pairs
+    """
+    parsed, errors = {}, []
+    for file_type, path in files:
+        dicts = []
+        for d, error in iter_parsed_file(path):
+            if error:
+                errors.append((path, error))
+            else:
+                dicts.append(d)
+        parsed[path] = (file_type, dicts)
+    return parsed, errors
+
+
+def get_files_by_vnum(db):
+    """
+    {(file type, vnum): set of files} of every exported entry, whether its
+    row won or it was skipped as a duplicate
+    """
+    files = collections.defaultdict(set)
+    for file_type, table in ENTRY_TABLES.items():
+        for vnum, path in db.execute('SELECT vnum, file FROM {}'.format(table)):
+            files[file_type, vnum].add(path)
+    for file_type, vnum, path in db.execute('SELECT file_type, vnum, file FROM duplicates'):
+        files[file_type, vnum].add(path)
+    return files
+
+
+def get_sharing_files(db, stale, parsed):
+    """
+    the unchanged files with an entry whose vnum is also in one of the
+    `stale` (changed or removed) files, before or after the change. their
+    rows have to be exported again for the right entry to win.
+    """
+    files_by_vnum = get_files_by_vnum(db)
+    keys = set(key for key, paths in files_by_vnum.items() if paths & stale)
+    for file_type, dicts in parsed.values():
+        keys.update((file_type, d['id']) for d in dicts)
+    return set(path for key in keys for path in files_by_vnum.get(key, ())) - stale
+
+
+def collect_rows(db, exported, parsed):
+    """
+    the rows of every table for the entries of the `exported` (file type,
+    path) pairs, from their dicts in `parsed`. entries whose vnum is
+    already in the database, or earlier in `exported`, go in `duplicates`
+    instead.
+    """
+    seen = {}
+    for file_type, table in ENTRY_TABLES.items():
+        seen[file_type] = set(vnum for vnum, in db.execute('SELECT vnum FROM {}'.format(table)))
+
+    rows = collections.defaultdict(list)
+    for file_type, path in exported:
+        for d in parsed[path][1]:
+            if d['id'] in seen[file_type]:
+                rows['duplicates'].append((file_type, d['id'], path))
+            else:
+                seen[file_type].add(d['id'])
+                ROW_BUILDERS[file_type](rows, d, path)
+    return rows
+
+
+def update_zones(db):
+    """
+    point the zone column of every entry at the zone whose range holds it
+    """
+    zone_map = ZoneMap.from_ranges(db.execute('SELECT bottom_room, top_room, vnum FROM zones'))
+    for table in ('rooms', 'mobs', 'objects', 'shops'):
+        updates = []
+        for vnum, zone in db.execute('SELECT vnum, zone FROM {}'.format(table)):
+            owner = zone_map.zone_for_vnum(vnum)
+            if owner != zone:
+                updates.append((owner, vnum))
+        db.executemany('UPDATE {} SET zone = ? WHERE vnum = ?'.format(table), updates)
+
+
+def check_files(db, world_files, parser_version):
+    """
+    compare the world files against the `files` table, returning the
+    changed (file type, path) pairs, the removed paths and the (path,
+    record) rows to store. unchanged files whose size or mtime moved get
+    their record refreshed, so they aren't hashed again next time.
+    """
+    previous = {path: json.loads(record) for path, record in db.execute('SELECT path, record FROM files')}
+
+    changed, records = [], []
+    for file_type, path in world_files:
+        is_unchanged, record = check_source(path, previous.get(path), parser_version)
+        if not is_unchanged:
+            changed.append((file_type, path))
+        if record is not previous.get(path):
+            records.append((path, json.dumps(record)))
+
+    removed = set(previous) - set(path for _, path in world_files)
+    return changed, removed, records
+
+
+def export_sqlite(world_dir, db_path, incremental=False):
+    """
+    write the world in `world_dir` to the database at `db_path`, from
+    scratch unless `incremental`. returns a dict with the number of files
+    `parsed`, `skipped` as unchanged and `removed`, and the parse `errors`.
+    """
+    db = connect(db_path, fresh=not incremental)
+    parser_version = get_parser_version(PARSER_MODULES + ('sqlexport',))
+    try:
+        with db:
+            world_files = find_world_files(world_dir)
+            changed, removed, records = check_files(db, world_files, parser_version)
+
+            parsed, errors = parse_files(changed)
+            stale = removed | set(path for _, path in changed)
+            sharing = get_sharing_files(db, stale, parsed)
+            parsed.update(parse_files([(file_type, path) for file_type, path in world_files if path in sharing])[0])
+
+            for path in stale | sharing:
+                delete_file_rows(db, path)
+            db.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in removed])
+
+            exported = [(file_type, path) for file_type, path in world_files if path in parsed]
+            rows = collect_rows(db, exported, parsed)
+            for table in TABLE_ORDER:
+                if rows[table]:
+                    placeholders = ', '.join('?' * len(rows[table][0]))
+                    db.executemany('INSERT INTO {} VALUES ({})'.format(table, placeholders), rows[table])
+            db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?)', records)
+            update_zones(db)
+    finally:
+        db.close()
+
+    return dict(parsed=len(changed), skipped=len(world_files) - len(changed), removed=len(removed), errors=errors)
@@ -0,0 +1,122 @@
+# coding: utf-8
+"""
+dice and combat statistics for every mob at once, computed over the mob
+columns from `columns` rather than mob by mob:
+
+    stats = mob_stats(Columns.from_world(World.load('world'), 'mob'))
+    stats['hp_mean'], stats['damage_max']
+    difficulty_curves(stats)[30][10]
+
+a roll of NdS+B is N independent dice of S sides plus B, so its mean is
+N(S+1)/2 + B, its variance N(S^2-1)/12, and it ranges from N+B to NS+B.
+as in CircleMUD's dice(), no dice or dice with no sides roll nothing and
+leave just the bonus. with NumPy installed every statistic is one array
+expression over all the mobs, and without it the same arithmetic runs in
+a loop over `array.array`s.
+"""
+import array
+import collections
+
+from columns import Columns
+
+# the dice of each roll, as (dice, sides, bonus) mob columns
+ROLLS = {
+    'hp': ('hp_dice', 'hp_sides', 'hp_bonus'),
+    'damage': ('damage_dice', 'damage_sides', 'damage_bonus'),
+}
+
+# mob columns carried over into the stats
+KEPT_COLUMNS = ('vnum', 'zone', 'level', 'xp', 'gold')
+
+
+def dice_stats(dice, sides, bonus, numpy=None):
+    """
+    {'mean', 'variance', 'min', 'max'} arrays for the rolls NdS+B given
+    as aligned arrays, NumPy arrays when `numpy` is the numpy module
+    """
+    if numpy is not None:
+        rolled = (dice > 0) & (sides > 0)
+        n = numpy.where(rolled, dice, 0)
+        s = numpy.where(rolled, sides, 1)
+        return dict(
+            mean=n * (s + 1) / 2 + bonus,
+            variance=n * (s * s - 1) / 12,
+            min=n + bonus,
+            max=n * s + bonus,
+        )
+
+    stats = dict(mean=array.array('d'), variance=array.array('d'), min=array.array('q'), max=array.array('q'))
+    for n, s, b in zip(dice, sides, bonus):
+        if n <= 0 or s <= 0:
+            n, s = 0, 1
+        stats['mean'].append(n * (s + 1) / 2 + b)
+        stats['variance'].append(n * (s * s - 1) / 12)
+        stats['min'].append(n + b)
+        stats['max'].append(n * s + b)
+    return stats
+
+
+def mob_stats(mobs):
+    """
+    Columns with vnum, zone, level, xp and gold of every mob in the mob
+    Columns `mobs`, plus the mean, variance, min and max of its hit points
+    (`hp_mean`...) and bare hand damage (`damage_mean`...)
+    """
+    arrays = {name: mobs[name] for name in KEPT_COLUMNS}
+    for roll, names in ROLLS.items():
+        for stat, values in dice_stats(*(mobs[name] for name in names), numpy=mobs.numpy).items():
+            arrays['{}_{}'.format(roll, stat)] = values
+    return Columns(arrays, mobs.numpy)
+
+
+def sum_by_zone_and_level(stats, names):
+    """
+    {(zone, level): (number of mobs, {name: sum})} over the mob stats
+    """
+    zones, levels = stats['zone'], stats['level']
+    if stats.numpy is not None:
+        numpy = stats.numpy
+        if not len(zones):
+            return {}
+        order = numpy.lexsort((levels, zones))
+        zones, levels = zones[order], levels[order]
+        changed = (zones[1:] != zones[:-1]) | (levels[1:] != levels[:-1])
+        starts = numpy.flatnonzero(numpy.r_[True, changed])
+        counts = numpy.diff(numpy.r_[starts, len(zones)]).tolist()
+        sums = {name: numpy.add.reduceat(stats[name][order], starts).tolist() for name in names}
+        keys = zip(zones[starts].tolist(), levels[starts].tolist())
+        return {key: (counts[i], {name: sums[name][i] for name in names}) for i, key in enumerate(keys)}
+
+    groups = {}
+    columns = [stats[name] for name in names]
+    for i, key in enumerate(zip(zones, levels)):
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = [0, collections.Counter()]
+        group[0] += 1
+        for name, values in zip(names, columns):
+            group[1][name] += values[i]
+    return {key: (count, dict(sums)) for key, (count, sums) in groups.items()}
+
+
+def difficulty_curves(stats):
+    """
+    {zone: {level: curve point}} from `mob_stats`, where each point has
+    the number of `mobs` at that level in the zone, their mean `hp`,
+    `damage`, `xp` and `gold`, `xp_per_hp` (total xp over total mean hit
+    points) and `gold_per_level` (None at level 0)
+    """
+    names = ('hp_mean', 'damage_mean', 'xp', 'gold')
+    curves = collections.defaultdict(dict)
+    for (zone, level), (count, sums) in sorted(sum_by_zone_and_level(stats, names).items()):
+        gold = sums['gold'] / count
+        curves[zone][level] = dict(
+            mobs=count,
+            hp=sums['hp_mean'] / count,
+            damage=sums['damage_mean'] / count,
+            xp=sums['xp'] / count,
+            gold=gold,
+            xp_per_hp=sums['xp'] / sums['hp_mean'] if sums['hp_mean'] else None,
+            gold_per_level=gold / level if level else None,
+        )
+    return dict(curves)
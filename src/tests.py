@@ -1,20 +1,70 @@
 # coding: utf-8
+import array
 import glob
+import itertools
+import json
 import os
+import pickle
+import shutil
+import sqlite3
+import tempfile
 import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
 
+from click.testing import CliRunner
+
+import index
+import lazyworld
+import manifest
 import parse
+import records
+import routes
+import utils
+import columns
+import world
+from world import World
+from zonemap import ZoneMap
+from check import check_world
+from columns import Columns
+from columns import get_numpy
+from flagmatrix import FlagMatrix
+from diff import diff_entries
+from formats import iter_ndjson
+from formats import load_payload
+from formats import write_payload
+from graph import RoomGraph
+from keywords import KeywordIndex
+from keywords import WorldKeywords
+from keywords import get_number
+from keywords import isname
+from resets import ResetSimulator
+from sqlexport import export_sqlite
+from stats import dice_stats
+from stats import difficulty_curves
+from stats import mob_stats
+from constants import ROOM_FLAGS
 from mobile import parse_mob
 from object import parse_object
 from room import parse_room
 from shop import parse_shop
 from zone import parse_zone
+from utils import EntryCursor
+from utils import bitvector_letter_to_number
 from utils import bitvector_to_numbers
 from utils import bitvector_letters_to_numbers
 from utils import bitvector_number_to_numbers
 from utils import bitvector_to_flags
+from utils import iter_entries
+from utils import iter_mapped_texts
+from utils import lookup_note_to_dict
+from utils import lookup_value_to_dict
+from utils import lookup_value_to_flag
 from utils import parse_from_file
+from utils import parse_from_mapped_file
 from utils import parse_from_string
+from utils import read_world_file
+from utils import split_lines_on_vnums
 from utils import split_on_vnums
 
 
@@ -53,6 +103,52 @@ class BitvectorParsingTests(unittest.TestCase):
         actual = bitvector_to_flags(bitvector, test_flags)
         self.assertListEqual(actual, expected)
 
+    def test_flags_are_shared_and_immutable(self):
+        first = bitvector_to_flags('ab', ROOM_FLAGS)
+        second = bitvector_to_flags(3, ROOM_FLAGS)
+        self.assertListEqual(first, second)
+        self.assertIs(first[0], second[0])
+        self.assertIs(lookup_value_to_flag(2, ROOM_FLAGS), first[1])
+        with self.assertRaises(TypeError):
+            first[0]['note'] = 'OOZING'
+        self.assertEqual(pickle.loads(pickle.dumps(first)), second)
+        self.assertEqual(json.dumps(first[0], sort_keys=True), '{"note": "DARK", "value": 1}')
+
+        # the public lookup still hands out a dict of the caller's own
+        flag = lookup_value_to_dict(2, ROOM_FLAGS)
+        flag['note'] = 'LIT'
+        self.assertEqual(lookup_value_to_dict(2, ROOM_FLAGS)['note'], 'DEATH')
+
+    def test_flag_tables_are_not_kept_for_other_dicts(self):
+        n_tables = len(utils.FLAG_TABLES)
+        test_flags = {1: 'GLOWING', 2: 'BUZZING'}
+        self.assertIsNot(utils.get_flag_table(test_flags), utils.get_flag_table(test_flags))
+        self.assertIs(utils.get_flag_table(ROOM_FLAGS), utils.get_flag_table(ROOM_FLAGS))
+        self.assertEqual(len(utils.FLAG_TABLES), n_tables)
+
+    def test_lookup_note_to_dict(self):
+        test_flags = {1: 'GLOWING', 2: 'BUZZING'}
+        self.assertDictEqual(lookup_note_to_dict('BUZZING', test_flags), {'value': 2, 'note': 'BUZZING'})
+        self.assertDictEqual(lookup_note_to_dict('OOZING', test_flags), {'value': None, 'note': 'OOZING'})
+        with self.assertRaises(ValueError):
+            bitvector_letter_to_number('1')
+
+
+class EntryCursorTests(unittest.TestCase):
+    def test_reading_lines_and_tilde_strings(self):
+        cursor = EntryCursor('3001\nkey dull~\nfirst line\nsecond line\n~\n1 2 3\n4\n-1\n5  \n\n')
+
+        self.assertEqual(cursor.read_line(), '3001')
+        self.assertEqual(cursor.read_tilde_string(), 'key dull')
+        self.assertEqual(cursor.read_tilde_string(), 'first line\nsecond line\n')
+        self.assertListEqual(cursor.read_ints(), [1, 2, 3])
+        self.assertListEqual(list(cursor.iter_lines()), ['4', '-1', '5'])
+        self.assertTrue(cursor.at_end())
+        self.assertEqual(cursor.read_line(), '')
+
+    def test_missing_terminators(self):
+        self.assertRaises(ValueError, EntryCursor('no tilde\nhere').read_tilde_string)
+
 
 class ObjectParsingTests(unittest.TestCase):
     maxDiff = None
@@ -645,6 +741,63 @@ S"""
         ]
         self.assertListEqual(zone['remove_objects'], expected_removals)
 
+    def test_comments_in_header(self):
+        zone = parse_zone('60\n* the forest\nHaon-Dor, Light Forest~\n*\n6000 6099 13 2\nD 0 6009 0 1\n* end\nS')
+        self.assertEqual(zone['name'], 'Haon-Dor, Light Forest')
+        self.assertEqual(zone['top_room'], 6099)
+        self.assertListEqual(zone['doors'], [dict(room=6009, exit=0, state=1)])
+
+    def test_nested_containers(self):
+        text = """61
+Nesting~
+6100 6199 13 2
+O 0 1 1 6100            Chest
+P 1 2 1 1                       Bag in the chest
+P 1 3 1 1                       Box in the chest
+P 1 4 1 2                       Pouch in the bag
+P 1 5 1 3                       Gem in the box
+O 0 6 1 6101            Table
+S"""
+
+        zone = parse_zone(text)
+
+        expected_contents = [
+            {'id': 2, 'max': 1, 'contents': [{'id': 4, 'max': 1, 'contents': []}]},
+            {'id': 3, 'max': 1, 'contents': [{'id': 5, 'max': 1, 'contents': []}]},
+        ]
+        self.assertListEqual(zone['objects'][0]['contents'], expected_contents)
+        self.assertListEqual(zone['objects'][1]['contents'], [])
+
+    def test_deeply_nested_containers(self):
+        # deeper than the recursion limit
+        depth = 5000
+        puts = ['P 1 {} 1 {}'.format(vnum + 1, vnum) for vnum in range(1, depth + 1)]
+        text = '\n'.join(['62', 'Matryoshka~', '6200 6299 13 2', 'O 0 1 1 6200'] + puts + ['S'])
+
+        contents = parse_zone(text)['objects'][0]['contents']
+        for vnum in range(2, depth + 2):
+            self.assertEqual(contents[0]['id'], vnum)
+            contents = contents[0]['contents']
+        self.assertListEqual(contents, [])
+
+        world_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, world_dir)
+        objects = ['#{}\nmatryoshka~\na doll~\nA doll.~\n~\n15 0 1\n10 0 0 0\n1 1 0'.format(v) for v in range(1, depth + 2)]
+        files = {
+            'zon/62.zon': '#' + text + '\n$\n',
+            'obj/62.obj': '\n'.join(objects) + '\n$\n',
+            'wld/62.wld': '#6200\nThe Nursery~\nDolls everywhere.\n~\n62 0 0\nS\n$\n',
+        }
+        for name, data in files.items():
+            os.makedirs(os.path.join(world_dir, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(world_dir, name), 'w') as f:
+                f.write(data)
+
+        w = World.load(world_dir)
+        self.assertListEqual(w.errors, [])
+        self.assertEqual(w.zones[62].to_dict()['objects'][0]['contents'][0]['id'], 2)
+        self.assertEqual(ResetSimulator(w).run(resets=1)['rooms'][6200]['objects'][1], 1.0)
+
 
 class ShopParsingTests(unittest.TestCase):
     def setUp(self):
@@ -765,5 +918,1244 @@ class TestParsingActualTinyworldFiles(unittest.TestCase):
                     self.assertListEqual(errors, [])
 
 
+
+class RecordTests(unittest.TestCase):
+    def test_records_round_trip(self):
+        for file_type in ['mob', 'obj', 'wld', 'shp', 'zon']:
+            path = 'world/{0}/30.{0}'.format(file_type)
+            parser = parse.PARSER_LOOKUP[file_type][0]
+            for (d, _), (record, _) in zip(iter_entries(path, parser), records.iter_records(path)):
+                self.assertEqual(record.to_dict(), d)
+                self.assertEqual(json.dumps(record.to_dict(), sort_keys=True), json.dumps(d, sort_keys=True))
+
+    def test_record_fields(self):
+        text = open('world/wld/30.wld').read().split('#')[2]
+        room = records.parse_record('wld', text)
+        self.assertIsInstance(room, records.Room)
+        self.assertEqual(room.id, 3001)
+        self.assertIsInstance(room.exits, tuple)
+        self.assertEqual(room.exits[0].room_linked, 3054)
+        self.assertFalse(hasattr(room, '__dict__'))
+        self.assertEqual(pickle.loads(pickle.dumps(room)), room)
+        self.assertSetEqual({room, records.parse_record('wld', text)}, {room})
+
+    def test_optional_fields_are_left_out(self):
+        obj = records.parse_record('obj', open('world/obj/30.obj').read().split('#')[2])
+        self.assertIsNone(obj.action_desc)
+        self.assertNotIn('action_desc', obj.to_dict())
+
+    def test_raw_bitmasks(self):
+        text = open('world/mob/30.mob').read().split('#')[1]
+        mob = records.parse_record('mob', text)
+        self.assertEqual(mob.flag_bits, sum(bitvector_letters_to_numbers('ablno')))
+        self.assertEqual(mob.affect_bits, 8)
+        self.assertNotIn('flag_bits', mob.to_dict())
+        self.assertNotIn('flag_bits', mob.fields)
+
+        # the same bits written as a number
+        numeric = records.parse_record('mob', text.replace('ablno d 900 S', '26627 8 900 S'))
+        self.assertEqual(numeric.flag_bits, mob.flag_bits)
+        self.assertEqual(pickle.loads(pickle.dumps(mob)).flag_bits, mob.flag_bits)
+
+
+class WorldTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.world = World.load('world')
+
+    def test_records_by_vnum(self):
+        self.assertEqual(self.world.rooms[3001].name, 'The Temple Of Midgaard')
+        self.assertEqual(self.world.mobs[3005].id, 3005)
+        self.assertEqual(self.world.get_zone(3001).id, 30)
+        self.assertEqual(self.world.get_zone(3108).id, 31)
+
+    def test_exits(self):
+        self.assertEqual(self.world.get_exit(3001, 0).room_linked, 3054)
+        self.assertEqual(self.world.get_exit_room(3001, 0).id, 3054)
+        self.assertIsNone(self.world.get_exit(3001, 4))
+        self.assertIsNone(self.world.get_exit(-1, 0))
+
+    def test_load_indexes(self):
+        [load] = self.world.mob_loads[3005]
+        self.assertEqual((load.zone, load.command.room), (30, 3008))
+
+        where = [(load.zone, load.how, load.target) for load in self.world.object_loads[3108]]
+        self.assertListEqual(where, [(31, 'container', 3109)])
+        self.assertIn((30, 'equipped', 3005), [(load.zone, load.how, load.target)
+                                               for load in self.world.object_loads[3022]])
+
+    def test_shop_and_key_indexes(self):
+        self.assertListEqual([shop.id for shop in self.world.shops_by_keeper[3000]], [3000])
+        doors = [(door.room, door.exit.dir) for door in self.world.doors_by_key[3105]]
+        self.assertListEqual(doors, [(3110, 1), (3111, 3)])
+
+
+class WorldSnapshotTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.world_dir = os.path.join(self.tmp, 'world')
+        self.snapshot_path = world.get_default_snapshot_path(self.world_dir)
+
+        for file_type in ('wld', 'zon'):
+            os.makedirs(os.path.join(self.world_dir, file_type))
+            filename = os.path.join(file_type, '30.' + file_type)
+            shutil.copy(os.path.join('world', filename), os.path.join(self.world_dir, filename))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def snapshot_stamp(self):
+        return os.stat(self.snapshot_path).st_mtime_ns
+
+    def test_snapshot_is_reused(self):
+        first = world.load_world(self.world_dir)
+        stamp = self.snapshot_stamp()
+
+        second = world.load_world(self.world_dir)
+        self.assertEqual(self.snapshot_stamp(), stamp)
+        self.assertEqual(second.rooms[3001], first.rooms[3001])
+        self.assertListEqual(sorted(second.rooms), sorted(first.rooms))
+        self.assertEqual(second.get_zone(3001).id, 30)
+
+    def test_snapshot_is_stale_after_changes(self):
+        world.load_world(self.world_dir)
+
+        path = os.path.join(self.world_dir, 'wld', '30.wld')
+        with open(path) as f:
+            text = f.read()
+        with open(path, 'w') as f:
+            f.write(text.replace('The Temple Of Midgaard', 'The Temple Of Somewhere Else'))
+
+        self.assertEqual(world.load_world(self.world_dir).rooms[3001].name, 'The Temple Of Somewhere Else')
+
+        shutil.copy('world/wld/31.wld', os.path.join(self.world_dir, 'wld', '31.wld'))
+        self.assertIn(3101, world.load_world(self.world_dir).rooms)
+
+    def test_uncached_and_corrupt_snapshots(self):
+        world.load_world(self.world_dir, cached=False)
+        self.assertFalse(os.path.exists(self.snapshot_path))
+
+        with open(self.snapshot_path, 'wb') as f:
+            f.write(b'not a snapshot')
+        self.assertIn(3001, world.load_world(self.world_dir).rooms)
+
+
+class LazyWorldTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.world_dir = os.path.join(self.tmp, 'world')
+
+        for file_type in ('mob', 'obj', 'wld', 'zon'):
+            os.makedirs(os.path.join(self.world_dir, file_type))
+            for number in ('30', '31'):
+                filename = os.path.join(file_type, number + '.' + file_type)
+                shutil.copy(os.path.join('world', filename), os.path.join(self.world_dir, filename))
+
+        self.world = World.load(self.world_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_records_match_full_load(self):
+        lazy = lazyworld.LazyWorld.load(self.world_dir)
+        for vnum, room in self.world.rooms.items():
+            self.assertEqual(lazy.get_room(vnum).to_dict(), room.to_dict())
+        for vnum, mob in self.world.mobs.items():
+            self.assertEqual(lazy.get_mob(vnum).to_dict(), mob.to_dict())
+        for vnum, obj in self.world.objects.items():
+            self.assertEqual(lazy.get_object(vnum).to_dict(), obj.to_dict())
+        self.assertIsNone(lazy.get_room(-1))
+        self.assertEqual(lazy.stats()['misses'], 2)
+
+        for vnum, zone in self.world.zones.items():
+            self.assertEqual(lazy.get('zon', vnum), zone)
+        self.assertIsNone(lazy.get_zone(99999))
+        self.assertEqual(lazy.stats()['misses'], 2)
+
+    def test_descriptions_stay_on_disk(self):
+        lazy = lazyworld.LazyWorld.load(self.world_dir)
+        room = lazy.get_room(3001)
+        self.assertIsNone(records.Room.desc.__get__(room))
+        self.assertEqual(room.desc, self.world.rooms[3001].desc)
+        self.assertIsNone(records.Room.desc.__get__(room))
+
+        deferred = room.read_deferred()
+        self.assertEqual(deferred['desc'], self.world.rooms[3001].desc)
+        self.assertEqual(deferred['extra_descs'], self.world.rooms[3001].extra_descs)
+
+        # once the file changes, descriptions can't be read from it
+        with open(os.path.join(self.world_dir, 'wld', '30.wld'), 'a') as f:
+            f.write('\n')
+        with self.assertRaisesRegex(RuntimeError, 'wld #3001.*out of date'):
+            room.desc
+        self.assertRaises(RuntimeError, room.read_deferred)
+
+    def test_zones_are_evicted(self):
+        # room for zone 30 alone
+        vnums = itertools.chain(self.world.rooms, self.world.mobs, self.world.objects)
+        zone_size = sum(1 for vnum in vnums if self.world.zone_by_vnum[vnum] == 30)
+        lazy = lazyworld.LazyWorld.load(self.world_dir, max_entries=zone_size)
+        lazy.get_room(3001)
+        lazy.get_mob(3005)
+        lazy.get_room(3101)
+        lazy.get_room(3001)
+
+        stats = lazy.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (1, 3, 2))
+        self.assertEqual(stats['resident_zones'], 1)
+        self.assertListEqual(list(lazy.resident), [30])
+
+        lazy = lazyworld.LazyWorld.load(self.world_dir, max_bytes=1)
+        lazy.get_room(3001)
+        lazy.get_room(3101)
+        self.assertEqual(lazy.stats()['resident_zones'], 1)
+        self.assertGreater(lazy.stats()['resident_bytes'], 1)
+
+
+class RoomGraphTests(unittest.TestCase):
+    def setUp(self):
+        # 1 <-> 2 <-> 3 -> 4, 5 -> 5, and an exit from 2 to nowhere
+        edges = [(1, 1, 2), (2, 3, 1), (2, 1, 3), (3, 3, 2), (3, 2, 4), (2, 0, -1), (5, 4, 5)]
+        self.graph = RoomGraph.from_edges([1, 2, 3, 4, 5], edges)
+
+    def test_csr_arrays(self):
+        self.assertEqual(list(self.graph.offsets), [0, 1, 3, 5, 5, 6])
+        self.assertListEqual(self.graph.get_exits(2), [(3, 1), (1, 3)])
+        self.assertListEqual(self.graph.dangling, [(2, 0, -1)])
+
+    def test_paths(self):
+        self.assertListEqual(self.graph.shortest_path(1, 4), [1, 2, 3, 4])
+        self.assertListEqual(self.graph.get_path_directions([1, 2, 3, 4]), [1, 1, 2])
+        self.assertListEqual(self.graph.shortest_path(2, 2), [2])
+        self.assertIsNone(self.graph.shortest_path(4, 1))
+        self.assertIsNone(self.graph.shortest_path(1, 99))
+        self.assertListEqual(self.graph.reachable(2), [1, 2, 3, 4])
+        self.assertListEqual(self.graph.reachable(4), [4])
+
+    def test_components_and_one_way_exits(self):
+        self.assertListEqual(self.graph.components(), [[1, 2, 3, 4], [5]])
+        self.assertListEqual(self.graph.one_way_exits(), [(3, 2, 4)])
+
+    def test_graph_of_world(self):
+        rooms = World.load('world').rooms
+        graph = RoomGraph.from_rooms(rooms.values())
+        self.assertEqual(len(graph), len(rooms))
+        self.assertListEqual(graph.shortest_path(3001, 3054), [3001, 3054])
+        self.assertIn(3054, graph.reachable(3001))
+
+
+class RoutesTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'routes.bin')
+
+        # zone 1 is 10 <-> 11 -> 12 and zone 2 is 20 <-> 21, joined by
+        # 12 -> 20 and 21 -> 10, so 12 only gets back to 11 through zone 2
+        edges = [(10, 1, 11), (11, 3, 10), (11, 1, 12), (12, 2, 20), (20, 1, 21), (21, 3, 20), (21, 0, 10)]
+        zone_of = {10: 1, 11: 1, 12: 1, 20: 2, 21: 2}
+        self.graph = RoomGraph.from_edges(zone_of, edges)
+        routes.Routes.build(self.graph, zone_of, n_landmarks=2).save(self.path)
+        self.routes = routes.Routes.open(self.path)
+
+    def tearDown(self):
+        self.routes.close()
+        shutil.rmtree(self.tmp)
+
+    def test_directions(self):
+        self.assertEqual(self.routes.next_direction(10, 12), 1)
+        self.assertEqual(self.routes.next_direction(12, 11), 2)
+        self.assertEqual(self.routes.next_direction(10, 21), 1)
+        self.assertEqual(self.routes.next_direction(21, 12), 0)
+        self.assertIsNone(self.routes.next_direction(10, 10))
+        self.assertListEqual(self.routes.find_path(12, 11), [12, 20, 21, 10, 11])
+
+    def test_tables_match_bfs(self):
+        built = routes.Routes.build(self.graph, {})
+        vnums = list(self.graph.vnums)
+        for a in vnums:
+            for b in vnums:
+                path = self.graph.shortest_path(a, b)
+                self.assertEqual(built.find_path(a, b), path)
+                self.assertEqual(self.routes.find_path(a, b), path)
+                self.assertLessEqual(self.routes.distance_bound(vnums.index(a), vnums.index(b)), len(path) - 1)
+
+    def test_not_a_routes_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 64)
+        with self.assertRaises(RuntimeError):
+            routes.Routes.open(self.path)
+
+
+class CheckTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.world_dir = os.path.join(self.tmp, 'world')
+        files = {
+            'wld/1.wld': """#100
+Room A~
+A room.
+~
+1 0 0
+D0
+~
+~
+0 0 101
+D1
+~
+~
+0 0 999
+D2
+~
+door~
+1 777 101
+S
+#101
+Room B~
+Another room.
+~
+1 0 0
+S
+#250
+Stray~
+A room outside its zone.
+~
+1 0 0
+S
+$~
+""",
+            'zon/1.zon': """#1
+Test Zone~
+100 199 10 2
+M 0 500 1 100
+G 1 600 1
+O 0 601 1 100
+P 1 602 1 601
+D 0 100 3 1
+R 0 102 601
+S
+$~
+""",
+        }
+        for name, text in files.items():
+            os.makedirs(os.path.dirname(os.path.join(self.world_dir, name)), exist_ok=True)
+            with open(os.path.join(self.world_dir, name), 'w') as f:
+                f.write(text)
+        os.makedirs(os.path.join(self.world_dir, 'shp'))
+        shutil.copy(os.path.join('world', 'shp', '30.shp'), os.path.join(self.world_dir, 'shp', '30.shp'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_broken_references(self):
+        report = check_world(World.load(self.world_dir))
+        found = set((issue['kind'], issue['file_type'], issue['vnum'], issue['ref']) for issue in report['issues'])
+
+        expected = {
+            ('missing_room', 'wld', 100, 999),
+            ('missing_object', 'wld', 100, 777),
+            ('outside_zone', 'wld', 250, 1),
+            ('missing_mob', 'zon', 1, 500),
+            ('missing_object', 'zon', 1, 600),
+            ('missing_object', 'zon', 1, 601),
+            ('missing_object', 'zon', 1, 602),
+            ('missing_exit', 'zon', 1, 100),
+            ('missing_room', 'zon', 1, 102),
+            ('missing_mob', 'shp', 3000, 3000),
+            ('missing_object', 'shp', 3000, 3050),
+            ('missing_room', 'shp', 3000, 3033),
+        }
+        self.assertTrue(expected <= found, expected - found)
+        self.assertNotIn(('missing_room', 'wld', 100, 101), found)
+        self.assertEqual(report['counts']['missing_room'], sum(kind == 'missing_room' for kind, _, _, _ in found))
+        self.assertNotIn('parse_error', report['counts'])
+
+    def test_clean_world(self):
+        world = World.load(self.world_dir)
+        world.shops.clear()
+        world.zones.clear()
+        world.rooms = {vnum: room for vnum, room in world.rooms.items() if vnum == 101}
+        self.assertDictEqual(check_world(world), {'counts': {'missing_zone': 1}, 'issues': [
+            {'kind': 'missing_zone', 'file_type': 'wld', 'vnum': 101, 'ref': 1, 'path': None,
+             'detail': 'room belongs to a missing zone'}]})
+
+    def test_parse_errors_and_duplicates(self):
+        path = os.path.join(self.world_dir, 'wld', '2.wld')
+        with open(path, 'w') as f:
+            f.write('#101\nRoom B again~\nThe same vnum.\n~\n1 0 0\nS\n#102\nBroken~\n~\nnot numbers\nS\n$~\n')
+
+        report = check_world(World.load(self.world_dir))
+        issues = [issue for issue in report['issues'] if issue['kind'] in ('parse_error', 'duplicate_vnum')]
+        self.assertListEqual([(i['kind'], i['file_type'], i['vnum'], i['path']) for i in issues], [
+            ('parse_error', 'wld', 102, path),
+            ('duplicate_vnum', 'wld', 101, path),
+        ])
+        self.assertIn(os.path.join(self.world_dir, 'wld', '1.wld'), issues[1]['detail'])
+
+
+class ZoneMapTests(unittest.TestCase):
+    def test_zone_for_vnum(self):
+        zones = ZoneMap.from_ranges([(3000, 3099, 30), (0, 99, 0), (3100, 3299, 31)])
+        self.assertEqual(zones.zone_for_vnum(0), 0)
+        self.assertEqual(zones.zone_for_vnum(99), 0)
+        self.assertIsNone(zones.zone_for_vnum(100))
+        self.assertIsNone(zones.zone_for_vnum(-5))
+        self.assertEqual(zones.zone_for_vnum(3099), 30)
+        self.assertEqual(zones.zone_for_vnum(3100), 31)
+        self.assertIsNone(zones.zone_for_vnum(3300))
+        self.assertListEqual(zones.overlaps, [])
+        self.assertDictEqual(zones.map_vnums([50, 500, 3150]), {50: 0, 3150: 31})
+
+    def test_overlapping_ranges(self):
+        # 2 sits inside 1, and 3 starts before 1 ends
+        zones = ZoneMap.from_ranges([(100, 300, 1), (150, 160, 2), (250, 400, 3)])
+        self.assertListEqual(zones.overlaps, [(1, 2), (1, 3)])
+        self.assertEqual(zones.zone_for_vnum(149), 1)
+        self.assertEqual(zones.zone_for_vnum(155), 2)
+        self.assertEqual(zones.zone_for_vnum(161), 1)
+        self.assertEqual(zones.zone_for_vnum(260), 3)
+        self.assertEqual(zones.zone_for_vnum(400), 3)
+        self.assertIsNone(zones.zone_for_vnum(401))
+
+    def test_matches_scan(self):
+        ranges = [(0, 99, 0), (50, 60, 1), (55, 200, 2), (150, 150, 3), (300, 310, 4)]
+        zones = ZoneMap.from_ranges(ranges)
+        for vnum in range(-1, 320):
+            covering = [(bottom, -zone, zone) for bottom, top, zone in ranges if bottom <= vnum <= top]
+            self.assertEqual(zones.zone_for_vnum(vnum), max(covering)[2] if covering else None, vnum)
+
+    def test_world(self):
+        world = World.load('world')
+        self.assertEqual(world.zone_for_vnum(3001), 30)
+        self.assertEqual(world.zone_for_vnum(3299), 31)
+        self.assertIsNone(world.zone_for_vnum(100))
+        self.assertListEqual(world.zone_map.overlaps, [])
+
+
+class ResetSimulatorTests(unittest.TestCase):
+    def make_world(self, zone_texts):
+        w = World()
+        w.zones = {}
+        for text in zone_texts:
+            zone = records.parse_record('zon', text)
+            w.zones[zone.id] = zone
+        w.mobs = dict.fromkeys([500])
+        w.objects = dict.fromkeys([600, 601, 602, 603])
+        w.rooms = dict.fromkeys([100, 101, 200])
+        return w
+
+    zone_text = """1
+Test Zone~
+100 199 10 2
+M 0 500 2 100
+G 1 600 5
+M 0 500 2 101
+G 1 600 5
+M 0 500 2 101
+G 1 600 5
+O 0 601 1 100
+P 1 602 10 601
+R 0 100 603
+O 0 603 1 100
+O 0 999 1 100
+"""
+
+    def test_populations(self):
+        simulator = ResetSimulator(self.make_world([self.zone_text]))
+        report = simulator.run(resets=5)
+
+        self.assertEqual(report['minutes'], 40)
+        self.assertDictEqual(report['resets'], {1: 5})
+        self.assertDictEqual(report['rooms'], {
+            100: {'mobs': {500: 1.0}, 'objects': {600: 1.0, 601: 1.0, 602: 1.0, 603: 1.0}},
+            101: {'mobs': {500: 1.0}, 'objects': {600: 1.0}},
+        })
+        self.assertDictEqual(report['mobs'], {500: 2.0})
+        self.assertEqual(simulator.mob_counts[500], 2)
+        self.assertEqual(simulator.object_counts[603], 1)
+
+    def test_losses(self):
+        simulator = ResetSimulator(self.make_world([self.zone_text]), mob_loss=1.0, object_loss=1.0)
+        report = simulator.run(resets=20, warmup=0)
+
+        # everything is lost before each reset, and loaded again by it
+        self.assertDictEqual(report['mobs'], {500: 2.0})
+        self.assertDictEqual(report['objects'], {600: 2.0, 601: 1.0, 602: 1.0, 603: 1.0})
+        self.assertDictEqual(dict(+simulator.object_counts), {600: 2, 601: 1, 602: 1, 603: 1})
+
+        simulator = ResetSimulator(self.make_world([self.zone_text]), mob_loss=0.5, seed=1)
+        report = simulator.run(resets=200)
+        # the first M command refills its room before the others get a turn
+        self.assertEqual(report['mobs'][500], 2.0)
+        self.assertTrue(1.0 < report['rooms'][100]['mobs'][500] < 2.0)
+        self.assertEqual(simulator.mob_counts[500], sum(len(mobs) for mobs, _ in simulator.rooms.values()))
+
+    def test_reset_modes(self):
+        never = self.zone_text.replace('100 199 10 2', '100 199 10 0')
+        occupied = '2\nOccupied~\n200 299 5 1\nO 0 603 3 200\n'
+        simulator = ResetSimulator(self.make_world([never, occupied]), occupied=[2])
+        report = simulator.run(resets=10)
+        self.assertDictEqual(report['resets'], {1: 1, 2: 1})
+        self.assertEqual(report['rooms'][200]['objects'], {603: 1.0})
+
+    def test_world(self):
+        report = ResetSimulator(World.load('world'), mob_loss=0.5).run(resets=20)
+        self.assertEqual(report['resets'][30], 20)
+        self.assertIn(3001, report['rooms'])
+        self.assertTrue(all(0 < mean for mean in report['mobs'].values()))
+
+
+class SqliteExportTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.world_dir = os.path.join(self.tmp, 'world')
+        self.db_path = os.path.join(self.tmp, 'world.sqlite')
+        for filename in ['wld/30.wld', 'mob/30.mob', 'obj/30.obj', 'shp/30.shp', 'zon/30.zon', 'wld/31.wld']:
+            os.makedirs(os.path.join(self.world_dir, os.path.dirname(filename)), exist_ok=True)
+            shutil.copy(os.path.join('world', filename), os.path.join(self.world_dir, filename))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def query(self, sql, *args):
+        db = sqlite3.connect(self.db_path)
+        try:
+            return db.execute(sql, args).fetchall()
+        finally:
+            db.close()
+
+    def test_export(self):
+        result = export_sqlite(self.world_dir, self.db_path)
+        self.assertEqual((result['parsed'], result['skipped'], result['removed']), (6, 0, 0))
+
+        w = World.load(self.world_dir)
+        self.assertEqual(self.query('SELECT count(*) FROM rooms'), [(len(w.rooms),)])
+        self.assertEqual(self.query('SELECT count(*) FROM mobs'), [(len(w.mobs),)])
+        self.assertEqual(self.query('SELECT count(*) FROM exits'), [(sum(len(r.exits) for r in w.rooms.values()),)])
+
+        self.assertEqual(
+            self.query('SELECT name, zone, sector_type FROM rooms WHERE vnum = 3001'),
+            [('The Temple Of Midgaard', 30, 'INSIDE')])
+        self.assertEqual(self.query('SELECT room_linked FROM exits WHERE room = 3000'), [(3001,)])
+        self.assertEqual(
+            self.query('SELECT hp_dice, hp_sides, hp_bonus, level FROM mobs WHERE vnum = 3000'),
+            [(1, 1, 30000, 33)])
+        self.assertEqual(
+            self.query("SELECT flag FROM mob_flags WHERE mob = 3000 AND kind = 'affects'"), [('DETECT_INVIS',)])
+        self.assertEqual(self.query('SELECT room FROM shop_rooms WHERE shop = 3000'), [(3033,)])
+
+        flagged = self.query(
+            "SELECT room FROM room_flags JOIN rooms ON rooms.vnum = room WHERE flag = 'INDOORS' AND zone = 30")
+        self.assertIn((3000,), flagged)
+
+        mobs = self.query("SELECT vnum FROM zone_commands WHERE zone = 30 AND command = 'M'")
+        self.assertEqual(len(mobs), len(w.zones[30].mobs))
+        nested = self.query("SELECT count(*) FROM zone_commands WHERE command = 'P' AND parent IS NOT NULL")
+        self.assertEqual(nested, [(sum(1 for load in w.object_loads.values() for o in load if o.how == 'container'),)])
+
+        found = self.query("SELECT file_type, vnum FROM search WHERE search MATCH 'wizard' AND file_type = 'mob'")
+        self.assertIn(('mob', 3000), found)
+
+    def test_incremental(self):
+        export_sqlite(self.world_dir, self.db_path)
+        result = export_sqlite(self.world_dir, self.db_path, incremental=True)
+        self.assertEqual((result['parsed'], result['skipped'], result['removed']), (0, 6, 0))
+
+        path = os.path.join(self.world_dir, 'wld', '30.wld')
+        with open(path) as f:
+            text = f.read()
+        with open(path, 'w') as f:
+            f.write(text.replace('The Reading Room', 'The Scriptorium'))
+        os.remove(os.path.join(self.world_dir, 'wld', '31.wld'))
+
+        result = export_sqlite(self.world_dir, self.db_path, incremental=True)
+        self.assertEqual((result['parsed'], result['skipped'], result['removed']), (1, 4, 1))
+        self.assertEqual(self.query('SELECT name FROM rooms WHERE vnum = 3000'), [('The Scriptorium',)])
+        self.assertEqual(self.query('SELECT count(*) FROM rooms WHERE vnum >= 3100'), [(0,)])
+        self.assertEqual(self.query('SELECT count(*) FROM exits WHERE room = 3000'), [(1,)])
+        self.assertEqual(self.query('SELECT count(*) FROM exits WHERE room >= 3100'), [(0,)])
+        self.assertEqual(self.query("SELECT vnum FROM search WHERE search MATCH 'scriptorium'"), [(3000,)])
+        self.assertEqual(self.query("SELECT count(*) FROM search WHERE file_type = 'wld'"),
+                         self.query('SELECT count(*) FROM rooms'))
+
+    def test_duplicate_vnums(self):
+        # 29.wld sorts first, so its copy of room 3001 wins
+        with open(os.path.join(self.world_dir, 'wld', '30.wld')) as f:
+            room = f.read().split('#3002')[0].split('#3001')[1]
+        duplicate = os.path.join(self.world_dir, 'wld', '29.wld')
+        with open(duplicate, 'w') as f:
+            f.write('#3001' + room.replace('The Temple Of Midgaard', 'The Old Temple') + '$~\n')
+        names = 'SELECT name FROM rooms WHERE vnum = 3001'
+        duplicates = 'SELECT file_type, vnum FROM duplicates'
+
+        export_sqlite(self.world_dir, self.db_path)
+        self.assertEqual(self.query(names), [('The Old Temple',)])
+        self.assertEqual(self.query(duplicates), [('wld', 3001)])
+
+        path = os.path.join(self.world_dir, 'wld', '30.wld')
+        with open(path) as f:
+            text = f.read()
+        with open(path, 'w') as f:
+            f.write(text.replace('The Reading Room', 'The Scriptorium'))
+        export_sqlite(self.world_dir, self.db_path, incremental=True)
+        self.assertEqual(self.query(names), [('The Old Temple',)])
+        self.assertEqual(self.query(duplicates), [('wld', 3001)])
+
+        os.remove(duplicate)
+        export_sqlite(self.world_dir, self.db_path, incremental=True)
+        self.assertEqual(self.query(names), [('The Temple Of Midgaard',)])
+        self.assertEqual(self.query(duplicates), [])
+        self.assertEqual(self.query("SELECT count(*) FROM search WHERE file_type = 'wld' AND vnum = 3001"), [(1,)])
+
+    def test_other_databases_are_kept(self):
+        db = sqlite3.connect(self.db_path)
+        db.execute('CREATE TABLE notes (note TEXT)')
+        db.commit()
+        db.close()
+        for incremental in (False, True):
+            with self.assertRaisesRegex(RuntimeError, 'not a world export'):
+                export_sqlite(self.world_dir, self.db_path, incremental=incremental)
+        self.assertEqual(self.query('SELECT count(*) FROM notes'), [(0,)])
+
+        with open(self.db_path, 'w') as f:
+            f.write('not a database, but long enough for sqlite to look at its header')
+        with self.assertRaisesRegex(RuntimeError, 'Not an SQLite database'):
+            export_sqlite(self.world_dir, self.db_path)
+        self.assertTrue(os.path.exists(self.db_path))
+
+        os.remove(self.db_path)
+        export_sqlite(self.world_dir, self.db_path)
+        db = sqlite3.connect(self.db_path)
+        db.execute('PRAGMA user_version = 1')
+        db.close()
+        result = export_sqlite(self.world_dir, self.db_path, incremental=True)
+        self.assertEqual(result['parsed'], 6)
+
+    def test_touched_file(self):
+        export_sqlite(self.world_dir, self.db_path)
+        path = os.path.join(self.world_dir, 'wld', '30.wld')
+        os.utime(path, (0, 0))
+
+        with mock.patch('manifest.hash_bytes', wraps=manifest.hash_bytes) as hash_bytes:
+            result = export_sqlite(self.world_dir, self.db_path, incremental=True)
+            self.assertEqual((result['parsed'], result['skipped']), (0, 6))
+            self.assertEqual(hash_bytes.call_count, 1)
+
+            hash_bytes.reset_mock()
+            export_sqlite(self.world_dir, self.db_path, incremental=True)
+            self.assertEqual(hash_bytes.call_count, 0)
+
+
+class ColumnsTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.world = World.load('world')
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_columns(self):
+        mobs = Columns.from_world(self.world, 'mob', use_numpy=False)
+        self.assertEqual(len(mobs), len(self.world.mobs))
+        self.assertListEqual(list(mobs['vnum']), sorted(self.world.mobs))
+
+        i = list(mobs['vnum']).index(3000)
+        self.assertEqual(mobs['zone'][i], 30)
+        self.assertEqual(mobs['level'][i], 33)
+        self.assertEqual(mobs['hp_bonus'][i], 30000)
+        self.assertEqual(mobs['flags'][i], 1 | 2 | 2048 | 8192 | 16384)
+
+        affects = Columns.from_world(self.world, 'affect', use_numpy=False)
+        self.assertEqual(len(affects), sum(len(obj.affects) for obj in self.world.objects.values()))
+
+    def test_round_trip(self):
+        columns.export_columns(self.world, self.tmp)
+        self.assertSetEqual(set(os.listdir(self.tmp)), set(kind + '.npz' for kind in columns.COLUMNS))
+        for kind in columns.COLUMNS:
+            loaded = columns.read_npz(os.path.join(self.tmp, kind + '.npz'))
+            self.assertDictEqual(loaded, columns.build_columns(self.world, kind))
+
+    def check_queries(self, mobs):
+        levels = [mob.level for mob in self.world.mobs.values()]
+        strong = mobs.where(mobs.mask(level=(20, 30)))
+        self.assertEqual(len(strong), sum(20 <= level <= 30 for level in levels))
+        self.assertEqual(strong.aggregate('level', 'min'), 20)
+        self.assertEqual(mobs.aggregate('level', 'max'), max(levels))
+        self.assertAlmostEqual(mobs.aggregate('level', 'mean'), sum(levels) / len(levels))
+        self.assertEqual(mobs.aggregate('gold', 'count'), len(levels))
+
+        gold = {}
+        for mob in self.world.mobs.values():
+            zone = self.world.zone_by_vnum.get(mob.id, -1)
+            gold[zone] = gold.get(zone, 0) + mob.gold
+        self.assertDictEqual(mobs.aggregate('gold', 'sum', by='zone'), gold)
+
+        # SENTINEL but not AGGRESSIVE
+        sentinels = mobs.where(mobs.flag_mask('flags', all=2, none=32))
+        expected = [mob.id for mob in self.world.mobs.values()
+                    if any(f['note'] == 'SENTINEL' for f in mob.flags)
+                    and not any(f['note'] == 'AGGRESSIVE' for f in mob.flags)]
+        self.assertListEqual([int(vnum) for vnum in sentinels['vnum']], sorted(expected))
+        either = [mob for mob in self.world.mobs.values()
+                  if any(f['note'] in ('SENTINEL', 'AGGRESSIVE') for f in mob.flags)]
+        self.assertEqual(len(mobs.where(mobs.flag_mask('flags', any=2 | 32))), len(either))
+
+        empty = mobs.where(mobs.mask(level=(1000, 2000)))
+        self.assertIsNone(empty.aggregate('xp', 'mean'))
+        self.assertDictEqual(empty.aggregate('xp', 'mean', by='zone'), {})
+
+    def test_queries(self):
+        columns.export_columns(self.world, self.tmp)
+        self.check_queries(Columns.load(os.path.join(self.tmp, 'mob.npz'), use_numpy=False))
+
+    @unittest.skipIf(get_numpy() is None, 'NumPy is not installed')
+    def test_numpy_queries(self):
+        columns.export_columns(self.world, self.tmp)
+        mobs = Columns.load(os.path.join(self.tmp, 'mob.npz'))
+        self.assertIsNotNone(mobs.numpy)
+        self.check_queries(mobs)
+
+
+class StatsTests(unittest.TestCase):
+    def check_dice(self, numpy):
+        def to_array(values):
+            return numpy.array(values) if numpy else array.array('q', values)
+
+        stats = dice_stats(to_array([4, 1, 0, 3]), to_array([6, 1, 8, 0]), to_array([20, 0, 5, 2]), numpy)
+        self.assertListEqual(list(stats['mean']), [34.0, 1.0, 5.0, 2.0])
+        self.assertListEqual(list(stats['variance']), [4 * 35 / 12, 0.0, 0.0, 0.0])
+        self.assertListEqual(list(stats['min']), [24, 1, 5, 2])
+        self.assertListEqual(list(stats['max']), [44, 1, 5, 2])
+
+    def test_dice(self):
+        self.check_dice(None)
+
+    @unittest.skipIf(get_numpy() is None, 'NumPy is not installed')
+    def test_numpy_dice(self):
+        self.check_dice(get_numpy())
+
+    def test_dice_matches_enumeration(self):
+        # every outcome of 3d4+1
+        rolls = [a + b + c + 1 for a, b, c in itertools.product(range(1, 5), repeat=3)]
+        mean = sum(rolls) / len(rolls)
+        stats = dice_stats([3], [4], [1])
+        self.assertAlmostEqual(stats['mean'][0], mean)
+        self.assertAlmostEqual(stats['variance'][0], sum((r - mean) ** 2 for r in rolls) / len(rolls))
+        self.assertEqual((stats['min'][0], stats['max'][0]), (min(rolls), max(rolls)))
+
+    def check_world(self, use_numpy):
+        w = World.load('world')
+        stats = mob_stats(Columns.from_world(w, 'mob', use_numpy=use_numpy))
+        i = list(stats['vnum']).index(3000)
+        self.assertEqual(stats['hp_mean'][i], 30001.0)
+        self.assertEqual(stats['damage_mean'][i], 2 * 4.5 + 18)
+        self.assertEqual(stats['damage_max'][i], 34)
+
+        curves = difficulty_curves(stats)
+        zone_30 = [mob for mob in w.mobs.values() if w.zone_by_vnum.get(mob.id) == 30]
+        self.assertEqual(sum(point['mobs'] for point in curves[30].values()), len(zone_30))
+
+        level_33 = [mob for mob in zone_30 if mob.level == 33]
+        point = curves[30][33]
+        self.assertEqual(point['mobs'], len(level_33))
+        self.assertAlmostEqual(point['gold'], sum(mob.gold for mob in level_33) / len(level_33))
+        self.assertAlmostEqual(point['gold_per_level'], point['gold'] / 33)
+        self.assertAlmostEqual(point['xp_per_hp'], point['xp'] / point['hp'])
+        return curves
+
+    def test_world(self):
+        self.check_world(False)
+
+    @unittest.skipIf(get_numpy() is None, 'NumPy is not installed')
+    def test_numpy_world(self):
+        self.assertDictEqual(self.check_world(True), self.check_world(False))
+
+
+class FlagMatrixTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.world = World.load('world')
+
+    def scan(self, records, field, all=(), any=(), none=()):
+        """
+        the slow way: every record's list of flag dicts
+        """
+        found = []
+        for record in sorted(records.values(), key=lambda record: record.id):
+            notes = set(flag['note'] for flag in getattr(record, field))
+            if set(all) <= notes and (not any or notes & set(any)) and not notes & set(none):
+                found.append(record.id)
+        return found
+
+    def check_queries(self, flags):
+        self.assertListEqual(
+            flags.query('obj', effects=dict(all=['NODROP', 'ANTI_GOOD'])),
+            self.scan(self.world.objects, 'effects', all=['NODROP', 'ANTI_GOOD']))
+        self.assertListEqual(
+            flags.query('wld', flags=dict(any=['DARK', 'INDOORS'], none=['DEATH'])),
+            self.scan(self.world.rooms, 'flags', any=['DARK', 'INDOORS'], none=['DEATH']))
+        self.assertListEqual(
+            flags.query('mob', flags=dict(all=['SENTINEL']), affects=dict(all=['DETECT_INVIS'])),
+            [vnum for vnum in self.scan(self.world.mobs, 'flags', all=['SENTINEL'])
+             if vnum in self.scan(self.world.mobs, 'affects', all=['DETECT_INVIS'])])
+        self.assertListEqual(
+            flags.query('shp', flags=dict(all=[2])), self.scan(self.world.shops, 'flags', all=['WILL_BANK_MONEY']))
+        self.assertListEqual(flags.query('shp'), sorted(self.world.shops))
+
+    def test_queries(self):
+        self.check_queries(FlagMatrix.from_world(self.world, use_numpy=False))
+
+    @unittest.skipIf(get_numpy() is None, 'NumPy is not installed')
+    def test_numpy_queries(self):
+        flags = FlagMatrix.from_world(self.world)
+        self.assertIsNotNone(flags.tables['mob'].numpy)
+        self.check_queries(flags)
+
+    def test_errors(self):
+        flags = FlagMatrix.from_world(self.world, use_numpy=False)
+        with self.assertRaises(RuntimeError):
+            flags.query('obj', effects=dict(all=['NOT_A_FLAG']))
+        with self.assertRaises(RuntimeError):
+            flags.query('obj', sector=dict(all=['DARK']))
+        with self.assertRaises(RuntimeError):
+            flags.query('obj', effects=dict(every=['NODROP']))
+
+
+class KeywordTests(unittest.TestCase):
+    def test_isname(self):
+        self.assertTrue(isname('sw', ['long', 'sword']))
+        self.assertTrue(isname('SWORD', ['long', 'sword']))
+        self.assertFalse(isname('swords', ['long', 'sword']))
+        self.assertFalse(isname('', ['long', 'sword']))
+        self.assertFalse(isname('ord', ['long', 'sword']))
+
+    def test_get_number(self):
+        self.assertEqual(get_number('sword'), (1, 'sword'))
+        self.assertEqual(get_number('2.sword'), (2, 'sword'))
+        self.assertEqual(get_number('x.sword'), (0, 'sword'))
+        self.assertEqual(get_number('.sword'), (0, 'sword'))
+
+    def test_index(self):
+        index = KeywordIndex.from_keywords([(1, ['long', 'sword']), (2, ['short', 'Sword']), (3, ['shield'])])
+        self.assertSetEqual(index.lookup('sw'), {1, 2})
+        self.assertSetEqual(index.lookup('S'), {1, 2, 3})
+        self.assertSetEqual(index.lookup('sh'), {2, 3})
+        self.assertSetEqual(index.lookup('swordfish'), set())
+        self.assertSetEqual(index.lookup(''), set())
+
+        room = [3, 2, 1, 2]
+        self.assertEqual(index.find('sw', room), 2)
+        self.assertEqual(index.find('2.sw', room), 1)
+        self.assertEqual(index.find('3.sw', room), 2)
+        self.assertIsNone(index.find('4.sw', room))
+        self.assertIsNone(index.find('0.sw', room))
+
+        exact = KeywordIndex.from_keywords([(1, ['long', 'sword'])], abbrev=False)
+        self.assertSetEqual(exact.lookup('sword'), {1})
+        self.assertSetEqual(exact.lookup('sw'), set())
+
+    def test_matches_scan(self):
+        w = World.load('world')
+        index = WorldKeywords.from_world(w)
+        for name in ['sw', 'guard', 'b', 'cityguard', 'fountain', 'xyzzy']:
+            for records, keyword_index in [(w.objects, index.objects), (w.mobs, index.mobs)]:
+                expected = set(vnum for vnum, record in records.items() if isname(name, record.aliases))
+                self.assertSetEqual(keyword_index.lookup(name), expected, name)
+
+    def test_rooms(self):
+        index = WorldKeywords.from_world(World.load('world'))
+        self.assertEqual(index.find_door(12001, 'trap'), 5)
+        self.assertEqual(index.find_door(12002, 'TRAPDOOR'), 4)
+        self.assertIsNone(index.find_door(12001, 'ladder'))
+        self.assertIsNone(index.find_door(3001, 'door'))
+        self.assertIsNotNone(index.find_extra_desc(12001, 'score'))
+        self.assertEqual(index.find_extra_desc(12001, 'score'), index.find_extra_desc(12001, 'SCORECARDS'))
+        self.assertIsNone(index.find_extra_desc(12001, 'xyzzy'))
+        self.assertIsNone(index.find_extra_desc(3001, 'statue'))
+        self.assertIsNotNone(index.find_object_extra_desc(1500, 'sc'))
+        self.assertEqual(index.find_object_extra_desc(1500, 'justice'), index.find_object_extra_desc(1500, 'scale'))
+        self.assertIsNone(index.find_object_extra_desc(1500, 'xyzzy'))
+        self.assertIsNone(index.find_object_extra_desc(3001, 'statue'))
+
+    def test_last_extra_desc_wins(self):
+        index = WorldKeywords.from_world(World.load('world'))
+        # 'desk' comes before 'documents' in the file, but is matched after it
+        self.assertTrue(index.find_extra_desc(12036, 'd').startswith('The documents'))
+        self.assertTrue(index.find_extra_desc(12036, 'desk').startswith('The desk'))
+
+
+class StreamingSplitTests(unittest.TestCase):
+    def test_split_lines_on_vnums_matches_split_on_vnums(self):
+        for file_type, src in parse.find_world_files('world'):
+            with open(src) as f:
+                streamed = list(split_lines_on_vnums(f))
+            self.assertListEqual(streamed, list(split_on_vnums(read_world_file(src))), src)
+
+    def test_only_whole_vnum_lines_start_entries(self):
+        lines = ['junk\n', '#1\n', 'first~\n', '#hashtag but no vnum\n', '#2\n', 'second~\n', '$~\n']
+        expected = ['1\nfirst~\n#hashtag but no vnum\n', '2\nsecond']
+        self.assertListEqual(list(split_lines_on_vnums(iter(lines))), expected)
+
+    def test_iter_entries(self):
+        filename = os.path.join('world', 'obj', '0.obj')
+        payload, errors = parse_from_file(filename, parse_object)
+
+        results = list(iter_entries(filename, parse_object))
+        self.assertListEqual([d for d, error in results if not error], payload)
+        self.assertEqual(len([error for d, error in results if error]), len(errors))
+
+
+class MappedSplitTests(unittest.TestCase):
+    def test_iter_mapped_texts_matches_split_on_vnums(self):
+        for file_type, src in parse.find_world_files('world'):
+            self.assertListEqual(list(iter_mapped_texts(src)), list(split_on_vnums(read_world_file(src))), src)
+
+    def test_crlf_and_empty_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            crlf = os.path.join(tmp, '1.obj')
+            with open(os.path.join('world', 'obj', '30.obj')) as f, open(crlf, 'w', newline='\r\n') as out:
+                out.write(f.read())
+            self.assertListEqual(list(iter_mapped_texts(crlf)), list(split_on_vnums(read_world_file(crlf))))
+
+            empty = os.path.join(tmp, '2.obj')
+            open(empty, 'w').close()
+            self.assertListEqual(list(iter_mapped_texts(empty)), [])
+
+    def test_parse_from_mapped_file(self):
+        filename = os.path.join('world', 'obj', '0.obj')
+        payload, errors = parse_from_file(filename, parse_object)
+        mapped_payload, mapped_errors = parse_from_mapped_file(filename, parse_object)
+
+        self.assertListEqual(mapped_payload, payload)
+        self.assertEqual(len(mapped_errors), len(errors))
+
+
+class EntryIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.index = index.build_index('world')
+
+    def test_index_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.json')
+            index.save_index(self.index, path)
+            self.assertEqual(index.load_index(path), self.index)
+
+    def test_get_entry_matches_full_parse(self):
+        for file_type, filename in [('wld', 'world/wld/30.wld'), ('shp', 'world/shp/30.shp'), ('zon', 'world/zon/30.zon')]:
+            payload, _ = parse.parse_based_on_filepath(filename)
+            for expected in payload:
+                self.assertEqual(index.get_entry(self.index, file_type, expected['id']), expected)
+
+    def test_locate_entry_line_number(self):
+        path, offset, length, line = index.locate_entry(self.index, 'wld', 3001)
+        self.assertEqual(path, os.path.join('world', 'wld', '30.wld'))
+        with open(path) as f:
+            self.assertEqual(f.readlines()[line - 1], '#3001\n')
+
+    def test_parse_errors_include_location(self):
+        with self.assertRaisesRegex(RuntimeError, r'obj #0 at world/obj/0.obj:1'):
+            index.get_entry(self.index, 'obj', 0)
+
+    def test_entry_command_errors(self):
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.json')
+            result = runner.invoke(parse.cli, ['entry', '--index', path, 'wld', '3001'])
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn('no index at {}, run `index` first'.format(path), result.output)
+
+            index.save_index(self.index, path)
+            result = runner.invoke(parse.cli, ['entry', '--index', path, 'wld', '99999'])
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn('no wld entry #99999 in {}, run `index` first'.format(path), result.output)
+
+
+class BatchConversionTests(unittest.TestCase):
+    def test_find_world_files(self):
+        found = parse.find_world_files('world')
+        types = [file_type for file_type, _ in found]
+
+        self.assertIn(('obj', os.path.join('world', 'obj', '30.obj')), found)
+        self.assertNotIn('lst', types)
+        self.assertListEqual(types, sorted(types, key=list(parse.PARSER_LOOKUP).index))
+
+    def test_convert_world_matches_single_file_output(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            parse.convert_world('world', out_dir)
+
+            for filename in ('obj/30.obj', 'zon/30.zon'):
+                payload, _ = parse.parse_based_on_filepath(os.path.join('world', filename))
+                file_type, number = filename.split('/')
+                dest = os.path.join(out_dir, file_type, number.split('.')[0] + '.json')
+                with open(dest) as f:
+                    self.assertEqual(f.read(), parse.payload_to_json(payload))
+
+    def test_convert_exit_status(self):
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as tmp:
+            world_dir = os.path.join(tmp, 'world')
+            os.makedirs(os.path.join(world_dir, 'obj'))
+            shutil.copy(os.path.join('world', 'obj', '30.obj'), os.path.join(world_dir, 'obj'))
+            result = runner.invoke(parse.cli, ['convert', world_dir, os.path.join(tmp, 'out')])
+            self.assertEqual(result.exit_code, 0)
+
+            # the stock 0.obj has an entry that doesn't parse
+            shutil.copy(os.path.join('world', 'obj', '0.obj'), os.path.join(world_dir, 'obj'))
+            result = runner.invoke(parse.cli, ['convert', world_dir, os.path.join(tmp, 'out')])
+            self.assertEqual(result.exit_code, 1)
+            self.assertTrue(os.path.exists(os.path.join(tmp, 'out', 'obj', '0.json')))
+
+    def test_incremental_convert_exit_status(self):
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as tmp:
+            world_dir = os.path.join(tmp, 'world')
+            os.makedirs(os.path.join(world_dir, 'obj'))
+            shutil.copy(os.path.join('world', 'obj', '0.obj'), os.path.join(world_dir, 'obj'))
+            args = ['convert', '--incremental', world_dir, os.path.join(tmp, 'out')]
+
+            for _ in range(2):
+                result = runner.invoke(parse.cli, args)
+                self.assertEqual(result.exit_code, 1)
+                self.assertIn('1 entries failed to parse', result.output)
+
+            # touched but unchanged, it is still skipped with its errors
+            os.utime(os.path.join(world_dir, 'obj', '0.obj'), (0, 0))
+            result = runner.invoke(parse.cli, args)
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn('is unchanged, repeating its errors', result.output)
+
+    def test_split_world_file_into_chunks(self):
+        chunks = list(parse.split_world_file('wld', os.path.join('world', 'wld', '54.wld')))
+        texts = [text for chunk in chunks for text in chunk]
+
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= parse.ENTRIES_PER_CHUNK for chunk in chunks))
+        self.assertListEqual(texts, list(split_on_vnums(read_world_file('world/wld/54.wld'))))
+
+        # chunks come lazily, and exactly full or empty files still give one chunk each
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, '1.wld')
+            with open(path, 'w') as f:
+                f.write(''.join('#' + text for text in texts[: parse.ENTRIES_PER_CHUNK]))
+            chunks = parse.split_world_file('wld', path)
+            self.assertEqual(len(next(chunks)), parse.ENTRIES_PER_CHUNK)
+            self.assertListEqual(list(chunks), [])
+
+            open(path, 'w').close()
+            self.assertListEqual(list(parse.split_world_file('wld', path)), [[]])
+
+    def test_plan_conversion_is_lazy(self):
+        units, records = parse.plan_conversion('world', 'unused', manifest.get_default_manifest_path('unused'))
+        first = next(units)
+        self.assertListEqual(list(records), [first['src']])
+
+        sources = set(unit['src'] for unit in units) | {first['src']}
+        self.assertEqual(len(sources), len(parse.find_world_files('world')))
+        self.assertSetEqual(set(records), sources)
+
+    def test_parse_units_window(self):
+        pulled = []
+
+        texts = list(split_on_vnums(read_world_file('world/wld/30.wld')))[:10]
+
+        def iter_units():
+            for text in texts:
+                pulled.append(text)
+                yield dict(file_type='wld', texts=[text], cached=[None])
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            results = parse.parse_units(iter_units(), executor, window=3)
+            unit, parsed = next(results)
+            self.assertEqual(len(pulled), 3)
+            vnums = [parsed[0][0]['id']] + [parsed[0][0]['id'] for _, parsed in results]
+            self.assertListEqual(vnums, [parse_room(text)['id'] for text in texts])
+
+    def test_parallel_conversion_is_identical_to_serial(self):
+        with tempfile.TemporaryDirectory() as serial, tempfile.TemporaryDirectory() as parallel:
+            serial_errors = parse.convert_world('world', serial, jobs=1)
+            parallel_errors = parse.convert_world('world', parallel, jobs=2)
+            self.assertEqual(serial_errors, parallel_errors)
+
+            for file_type, src in parse.find_world_files('world'):
+                with open(parse.get_output_path(serial, file_type, src)) as f:
+                    expected = f.read()
+                with open(parse.get_output_path(parallel, file_type, src)) as f:
+                    self.assertEqual(f.read(), expected)
+
+
+
+class IncrementalConversionTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.world_dir = os.path.join(self.tmp, 'world')
+        self.out_dir = os.path.join(self.tmp, 'output')
+        self.manifest_path = manifest.get_default_manifest_path(self.out_dir)
+
+        os.makedirs(os.path.join(self.world_dir, 'wld'))
+        for number in ('30', '31'):
+            filename = os.path.join('wld', number + '.wld')
+            shutil.copy(os.path.join('world', filename), os.path.join(self.world_dir, filename))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def planned_sources(self):
+        units, _ = parse.plan_conversion(self.world_dir, self.out_dir, self.manifest_path)
+        return sorted(set(os.path.basename(unit['src']) for unit in units))
+
+    def test_only_changed_files_are_reparsed(self):
+        parse.convert_world(self.world_dir, self.out_dir, manifest_path=self.manifest_path)
+        self.assertListEqual(self.planned_sources(), [])
+
+        # touching without changing the contents doesn't force a re-parse,
+        # or lose the entry hashes
+        os.utime(os.path.join(self.world_dir, 'wld', '30.wld'), ns=(0, 0))
+        self.assertListEqual(self.planned_sources(), [])
+        units, records = parse.plan_conversion(self.world_dir, self.out_dir, self.manifest_path)
+        list(units)
+        self.assertIn('entries', records[os.path.join(self.world_dir, 'wld', '30.wld')])
+
+        with open(os.path.join(self.world_dir, 'wld', '31.wld'), 'a') as f:
+            f.write('\n')
+        self.assertListEqual(self.planned_sources(), ['31.wld'])
+
+    def test_parser_version_change_reparses_everything(self):
+        parse.convert_world(self.world_dir, self.out_dir, manifest_path=self.manifest_path)
+
+        records = manifest.load_manifest(self.manifest_path)
+        for record in records.values():
+            record['parser_version'] = 'old'
+        manifest.save_manifest(self.manifest_path, records)
+
+        self.assertListEqual(self.planned_sources(), ['30.wld', '31.wld'])
+
+    def test_only_changed_entries_are_reparsed(self):
+        parse.convert_world(self.world_dir, self.out_dir, manifest_path=self.manifest_path)
+
+        filename = os.path.join(self.world_dir, 'wld', '30.wld')
+        with open(filename) as f:
+            text = f.read()
+        with open(filename, 'w') as f:
+            f.write(text.replace("The Thieves' Bar", "The Robbers' Bar"))
+
+        units, _ = parse.plan_conversion(self.world_dir, self.out_dir, self.manifest_path)
+        uncached = [text for unit in units for text, c in zip(unit['texts'], unit['cached']) if c is None]
+        self.assertEqual(len(uncached), 1)
+        self.assertIn("The Robbers' Bar", uncached[0])
+
+        patch_path = os.path.join(self.tmp, 'patch.json')
+        parse.convert_world(self.world_dir, self.out_dir, manifest_path=self.manifest_path, patch_path=patch_path)
+        with open(patch_path) as f:
+            patch = json.load(f)
+        self.assertListEqual([(op['op'], op['path']) for op in patch], [('replace', '/wld/3028')])
+
+        payload, _ = parse.parse_based_on_filepath(filename)
+        with open(os.path.join(self.out_dir, 'wld', '30.json')) as f:
+            self.assertEqual(f.read(), parse.payload_to_json(payload))
+
+    def convert_with_patch(self):
+        patch_path = os.path.join(self.tmp, 'patch.json')
+        parse.convert_world(self.world_dir, self.out_dir, manifest_path=self.manifest_path, patch_path=patch_path)
+        with open(patch_path) as f:
+            return [(op['op'], op['path']) for op in json.load(f)]
+
+    def test_moved_entry_is_not_in_patch(self):
+        parse.convert_world(self.world_dir, self.out_dir, manifest_path=self.manifest_path)
+
+        path_30, path_31 = [os.path.join(self.world_dir, 'wld', name) for name in ('30.wld', '31.wld')]
+        with open(path_30) as f:
+            text_30 = f.read()
+        with open(path_31) as f:
+            text_31 = f.read()
+        moved = '#' + next(split_on_vnums(text_31))
+        vnum = parse_room(moved[1:])['id']
+
+        with open(path_31, 'w') as f:
+            f.write(text_31.replace(moved, '', 1))
+        with open(path_30, 'w') as f:
+            f.write(text_30.replace('$', moved + '$', 1))
+        self.assertListEqual(self.convert_with_patch(), [])
+
+        # and a change to it while it moves is a replace
+        with open(path_30, 'w') as f:
+            f.write(text_30)
+        with open(path_31, 'w') as f:
+            f.write(text_31.replace(moved, moved.replace('~', ' changed~', 1), 1))
+        self.assertListEqual(self.convert_with_patch(), [('replace', '/wld/{}'.format(vnum))])
+
+    def test_removed_source_in_patch(self):
+        parse.convert_world(self.world_dir, self.out_dir, manifest_path=self.manifest_path)
+        payload, _ = parse.parse_based_on_filepath(os.path.join(self.world_dir, 'wld', '31.wld'))
+
+        os.remove(os.path.join(self.world_dir, 'wld', '31.wld'))
+        expected = [('remove', '/wld/{}'.format(vnum)) for vnum in sorted(d['id'] for d in payload)]
+        self.assertListEqual(self.convert_with_patch(), expected)
+
+    def test_removed_source_removes_output(self):
+        parse.convert_world(self.world_dir, self.out_dir, manifest_path=self.manifest_path)
+        dest = os.path.join(self.out_dir, 'wld', '31.json')
+        self.assertTrue(os.path.exists(dest))
+
+        os.remove(os.path.join(self.world_dir, 'wld', '31.wld'))
+        self.assertListEqual(self.planned_sources(), [])
+        self.assertTrue(os.path.exists(dest))
+
+        # a run that fails part way leaves the old outputs alone
+        with open(os.path.join(self.world_dir, 'wld', '30.wld'), 'a') as f:
+            f.write('\n')
+        with mock.patch.object(parse, 'parse_chunk', side_effect=RuntimeError):
+            self.assertRaises(RuntimeError, parse.convert_world, self.world_dir, self.out_dir, 1, self.manifest_path)
+        self.assertTrue(os.path.exists(dest))
+
+        parse.convert_world(self.world_dir, self.out_dir, manifest_path=self.manifest_path)
+        self.assertFalse(os.path.exists(dest))
+
+
+
+class NdjsonTests(unittest.TestCase):
+    def test_ndjson_round_trip(self):
+        payload, _ = parse.parse_based_on_filepath(os.path.join('world', 'wld', '30.wld'))
+
+        with tempfile.NamedTemporaryFile('w+', suffix='.ndjson') as f:
+            write_payload(payload, f, 'ndjson')
+            f.seek(0)
+            lines = f.read().split('\n')
+            f.seek(0)
+
+            self.assertEqual(len(lines), len(payload) + 1)
+            self.assertListEqual(list(iter_ndjson(f)), payload)
+            self.assertListEqual(load_payload(f.name), payload)
+
+    def test_iter_parsed_file_matches_parse_from_file(self):
+        filename = os.path.join('world', 'obj', '0.obj')
+        payload, errors = parse.parse_based_on_filepath(filename)
+
+        results = list(parse.iter_parsed_file(filename))
+        self.assertListEqual([d for d, error in results if not error], payload)
+        self.assertListEqual([error['text'] for d, error in results if error], [e['text'] for e in errors])
+
+    def test_convert_world_to_ndjson(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            parse.convert_world('world', out_dir, fmt='ndjson')
+
+            payload, _ = parse.parse_based_on_filepath(os.path.join('world', 'mob', '30.mob'))
+            self.assertListEqual(load_payload(os.path.join(out_dir, 'mob', '30.ndjson')), payload)
+
+
+class DiffTests(unittest.TestCase):
+    def test_diff_entries(self):
+        old = [dict(id=1, name='a'), dict(id=2, name='b'), dict(id=3, name='c')]
+        new = [dict(id=1, name='a'), dict(id=3, name='changed'), dict(id=4, name='d')]
+
+        expected = [
+            dict(op='remove', path='/wld/2'),
+            dict(op='replace', path='/wld/3', value=dict(id=3, name='changed')),
+            dict(op='add', path='/wld/4', value=dict(id=4, name='d')),
+        ]
+        self.assertListEqual(diff_entries('wld', old, new), expected)
+
+
 if __name__ == '__main__':
     unittest.main()
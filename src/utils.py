@@ -1,8 +1,72 @@
 # coding: utf-8
+import functools
+import locale
+import mmap
+import os
 import re
 import string
 import traceback
 
+import constants
+
+
+class EntryCursor(object):
+    """
+    splits the text of a single entry into lines once and then reads it
+    front to back, one line or one tilde-terminated string at a time, so
+    each parser walks its entry exactly once instead of splitting and
+    re-joining it several ways. trailing whitespace at the end of the entry
+    is ignored, the same as when parsers worked on `text.strip()`.
+    """
+
+    __slots__ = ('lines', 'pos')
+
+    def __init__(self, text):
+        lines = text.rstrip().split('\n')
+        if lines == ['']:
+            lines = []
+
+        self.lines = lines
+        self.pos = 0
+
+    def at_end(self):
+        return self.pos >= len(self.lines)
+
+    def read_line(self):
+        """
+        return the next line without its newline ('' once at the end)
+        """
+        pos = self.pos
+        self.pos = pos + 1
+        return self.lines[pos] if pos < len(self.lines) else ''
+
+    def read_tilde_string(self):
+        """
+        return everything up to the next '~', which may span several lines,
+        and move to the start of the line after the '~'
+        """
+        lines, start = self.lines, self.pos
+        end, n_lines = start, len(lines)
+
+        while end < n_lines:
+            if '~' in lines[end]:
+                self.pos = end + 1
+                if end == start:
+                    return lines[start].partition('~')[0]  # the usual case
+                return '\n'.join(lines[start : end + 1]).partition('~')[0]
+            end += 1
+
+        raise ValueError('Expected a "~"')
+
+    def read_ints(self):
+        return [int(v) for v in self.read_line().split()]
+
+    def iter_lines(self):
+        lines = self.lines
+        while self.pos < len(lines):
+            self.pos += 1
+            yield lines[self.pos - 1]
+
 
 def clean_bitvector(bitvector):
     try:
@@ -11,9 +75,76 @@ def clean_bitvector(bitvector):
         return bitvector
 
 
+# bitvector letters 'a'..'z' then 'A'..'Z' map to consecutive bits
+LETTER_BITS = {letter: 2**i for i, letter in enumerate(string.ascii_letters)}
+
+
+class FrozenFlag(dict):
+    """
+    a `{'value', 'note'}` dict that can't be changed once it's made, so a
+    single instance can be shared by every entity that has the flag. it is
+    still a plain dict as far as json and comparisons are concerned.
+    """
+
+    __slots__ = ()
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('flag dicts are shared between entities and cannot be modified')
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        # pickle would otherwise rebuild the dict through __setitem__
+        return (FrozenFlag, (dict(self),))
+
+
+class FlagTable(object):
+    """
+    prebuilt lookups for one of the flag dicts in constants: the reverse
+    note -> value mapping and one interned flag dict per value. flag dicts
+    are treated as constants, so changing one after it has been used to
+    decode a bitvector won't be picked up.
+    """
+
+    __slots__ = ('flags', 'reverse', 'interned')
+
+    def __init__(self, flags):
+        self.flags = flags
+        self.reverse = {note: value for value, note in flags.items()}
+        self.interned = {}
+
+    def flag(self, value):
+        flag = self.interned.get(value)
+        if flag is None:
+            flag = self.interned[value] = FrozenFlag(value=value, note=self.flags.get(value, None))
+        return flag
+
+
+# the tables of the flag dicts in constants, keyed on id(). those dicts live
+# as long as the module, so their ids can't be reused by other objects.
+FLAG_TABLES = {
+    id(flags): FlagTable(flags) for name, flags in vars(constants).items() if name.isupper() and isinstance(flags, dict)
+}
+
+
+def get_flag_table(flag_dict):
+    """
+    the prebuilt table of one of the flag dicts in constants. any other
+    dict gets a new table that isn't kept, so flags decoded with it are
+    only shared within a single call.
+    """
+    table = FLAG_TABLES.get(id(flag_dict))
+    if table is None or table.flags is not flag_dict:
+        table = FlagTable(flag_dict)
+    return table
+
+
 def bitvector_letter_to_number(letter):
-    index = string.ascii_letters.index(letter)
-    return 2**index
+    number = LETTER_BITS.get(letter)
+    if number is None:
+        raise ValueError('Invalid bitvector letter: {}'.format(letter))
+    return number
 
 
 def bitvector_letters_to_numbers(letters):
@@ -34,10 +165,37 @@ def bitvector_to_numbers(value):
     return list(bitvector_letters_to_numbers(value))
 
 
+@functools.lru_cache(maxsize=4096)
+def decode_bitvector(bitvector, table):
+    """
+    the shared flag dicts for every bit set in `bitvector`, as a tuple.
+    worlds only use a handful of distinct bitvectors per table, so nearly
+    every call is a cache hit.
+    """
+    return tuple(table.flag(number) for number in bitvector_to_numbers(bitvector))
+
+
 def bitvector_to_flags(bitvector, flag_dict):
-    numbers = bitvector_to_numbers(bitvector)
-    flags = [{'value': number, 'note': flag_dict.get(number, None)} for number in numbers]
-    return flags
+    return list(decode_bitvector(bitvector, get_flag_table(flag_dict)))
+
+
+def flags_to_bitmask(flags):
+    """
+    the bitvector a list of flag dicts was decoded from, as one int. letter
+    bitvectors give the bits bitvector_letters_to_numbers does, so 'ad' and
+    9 are the same mask.
+    """
+    mask = 0
+    for flag in flags:
+        mask |= flag['value'] or 0
+    return mask
+
+
+def lookup_value_to_flag(value, flag_dict):
+    """
+    the shared, read-only flag dict the parsers put in their entries
+    """
+    return get_flag_table(flag_dict).flag(value)
 
 
 def lookup_value_to_dict(value, flag_dict):
@@ -46,8 +204,7 @@ def lookup_value_to_dict(value, flag_dict):
 
 
 def lookup_note_to_dict(note, flag_dict):
-    reverse_dict = {v: k for k, v in flag_dict.items()}
-    value = reverse_dict.get(note, None)
+    value = get_flag_table(flag_dict).reverse.get(note, None)
     return dict(value=value, note=note)
 
 
@@ -75,35 +232,138 @@ def split_on_vnums(file_text):
             return
 
 
-def parse_from_string(file_text, parse_function, splitter):
+VNUM_LINE_PATTERN = re.compile(r"""\#(\d+)""")
+
+
+def split_lines_on_vnums(lines):
     """
-    given the text of a file, split it up into individual entries using
-    the passed splitting function, then feed each piece into the
-    individual entry parser, accumulating all results into an array.
+    streaming counterpart of `split_on_vnums`: given any iterable of lines
+    (such as an open file, which reads through a buffer), yield the same
+    entry texts while holding only one entry in memory. a vnum line that
+    straddles two reads of the underlying buffer is still seen whole,
+    because the file object only hands out complete lines.
+    """
+    entry_lines = None
 
-    returns the resulting array of dictionaries.
+    for line in lines:
+        if VNUM_LINE_PATTERN.match(line):
+            if entry_lines is not None:
+                yield ''.join(entry_lines)
+            entry_lines = [line[1:]]  # drop the '#', like split_on_vnums
+        elif entry_lines is not None:
+            entry_lines.append(line)
+
+    if entry_lines is not None:
+        # the end of the file is where the `$` markers are, so only the
+        # last entry needs the same stripping as `read_world_file` does
+        yield ''.join(entry_lines).rstrip('$\n').rstrip('$~\n')
+
+
+VNUM_BYTES_PATTERN = re.compile(rb"""^\#(\d+)""", re.MULTILINE)
+
+
+def get_stripped_length(buffer):
     """
-    texts = splitter(file_text)
+    length of a world file's bytes once the trailing `$` markers have been
+    stripped the way `read_world_file` strips its text, without copying
+    """
+    end = len(buffer)
+    for chars in (b'$\r\n', b'$~\r\n'):
+        while end and buffer[end - 1] in chars:
+            end -= 1
+    return end
+
+
+def split_buffer_on_vnums(buffer):
+    """
+    byte-level counterpart of `split_on_vnums` for bytes or an mmap: yield a
+    (vnum, offset, length) tuple per entry, where offset and length delimit
+    the same text `split_on_vnums` would yield (starting after the '#')
+    """
+    end = get_stripped_length(buffer)
+    match = VNUM_BYTES_PATTERN.search(buffer, 0, end)
+
+    while match:
+        next_match = VNUM_BYTES_PATTERN.search(buffer, match.end(), end)
+        offset = match.start() + 1
+        stop = next_match.start() if next_match else end
+        yield int(match.group(1)), offset, stop - offset
+        match = next_match
+
+
+def decode_entry(data):
+    """
+    decode the bytes of one entry the way text-mode `open` would have
+    """
+    text = str(data, locale.getpreferredencoding(False))
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
 
+def iter_mapped_texts(filename):
+    """
+    memory-map a world file and yield its entry texts, decoding each entry
+    from the mapped bytes only when it is reached. unlike reading the file
+    into one string, no copy of the whole file is ever made: the largest
+    string alive at once is a single entry.
+    """
+    with open(filename, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return  # empty files can't be mapped
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            for _, offset, length in split_buffer_on_vnums(mapped):
+                with view[offset : offset + length] as data:
+                    yield decode_entry(data)
+
+
+def parse_entry(text, parse_function):
+    """
+    run the individual entry parser on one entry, returning a tuple of
+    (parsed dictionary, None) or, if it fails, (None, error record).
+    """
+    try:
+        return parse_function(text), None
+    except Exception:  # intentionally broad
+        trace = traceback.format_exc()
+        return None, dict(text=text, trace=trace)
+
+
+def parse_entries(texts, parse_function):
+    """
+    feed each already split entry into the individual entry parser,
+    collecting parsed dictionaries and error records separately.
+    """
     dicts = []
     errors = []
 
     for text in texts:
-        try:
-            d = parse_function(text)
-            dicts.append(d)
-        except Exception:  # intentionally broad
-            trace = traceback.format_exc()
-            error = dict(text=text, trace=trace)
+        d, error = parse_entry(text, parse_function)
+        if error:
             errors.append(error)
+        else:
+            dicts.append(d)
 
     return dicts, errors
 
 
-def parse_from_file(filename, parser, splitter=split_on_vnums, validate=None):
+def parse_from_string(file_text, parse_function, splitter):
     """
-    given a filename and an individual item parsing function, read the
-    file contents and pass to the string parser.
+    given the text of a file, split it up into individual entries using
+    the passed splitting function, then feed each piece into the
+    individual entry parser, accumulating all results into an array.
+
+    returns the resulting array of dictionaries.
+    """
+    texts = splitter(file_text)
+    return parse_entries(texts, parse_function)
+
+
+def read_world_file(filename, validate=None):
+    """
+    read a world file and strip the trailing end-of-file markers, returning
+    text that is ready to be split into entries.
     """
     with open(filename) as f:
         file_text = f.read()
@@ -114,4 +374,32 @@ def parse_from_file(filename, parser, splitter=split_on_vnums, validate=None):
     file_text = file_text.rstrip('$\n')  # world files
     file_text = file_text.rstrip('$~\n')  # shop files
 
+    return file_text
+
+
+def parse_from_mapped_file(filename, parser):
+    """
+    same as `parse_from_file` with the default splitter, but splitting the
+    memory-mapped bytes of the file instead of a copy of its text
+    """
+    return parse_entries(iter_mapped_texts(filename), parser)
+
+
+def parse_from_file(filename, parser, splitter=split_on_vnums, validate=None):
+    """
+    given a filename and an individual item parsing function, read the
+    file contents and pass to the string parser.
+    """
+    file_text = read_world_file(filename, validate)
     return parse_from_string(file_text, parser, splitter=splitter)
+
+
+def iter_entries(filename, parser):
+    """
+    lazily parse a file one entry at a time, reading it incrementally
+    rather than all at once. yields a (parsed dictionary, None) or
+    (None, error record) tuple per entry, in file order.
+    """
+    with open(filename) as f:
+        for text in split_lines_on_vnums(f):
+            yield parse_entry(text, parser)
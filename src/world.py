@@ -0,0 +1,251 @@
+# coding: utf-8
+"""
+a whole world directory parsed into records, with the indexes needed to
+answer cross-reference questions ("which zones load mob 3005", "where does
+exit 3 of room 3001 lead") with dict lookups instead of scanning every
+entry:
+
+    world = World.load('world')
+    world.mob_loads[3005]
+    world.get_exit(3001, 3)
+
+`load_world` keeps a pickled snapshot of the loaded world next to the
+world directory and loads that instead while the sources are unchanged.
+"""
+import collections
+import itertools
+import os
+import pickle
+
+from lookup import PARSER_MODULES
+from lookup import find_world_files
+from manifest import check_source
+from manifest import get_parser_version
+from records import iter_records
+from zonemap import ZoneMap
+
+SNAPSHOT_VERSION = 1
+
+# a snapshot is also stale when the records or indexes change shape
+SNAPSHOT_MODULES = PARSER_MODULES + ('records', 'world', 'zonemap')
+
+# the attribute of World holding the records of each file type
+TABLES = {
+    'mob': 'mobs',
+    'obj': 'objects',
+    'wld': 'rooms',
+    'shp': 'shops',
+    'zon': 'zones',
+}
+
+# where a zone loads an object: `how` is one of 'room', 'inventory',
+# 'equipped' or 'container', and `target` is the vnum of that room, mob or
+# container object. `command` is the zone command record itself.
+ObjectLoad = collections.namedtuple('ObjectLoad', ['zone', 'how', 'target', 'command'])
+
+# a zone command loading a mob
+MobLoad = collections.namedtuple('MobLoad', ['zone', 'command'])
+
+# a door that the key object opens
+KeyDoor = collections.namedtuple('KeyDoor', ['room', 'exit'])
+
+
+class World(object):
+    """
+    records by vnum for each file type, plus reverse indexes built from
+    them by `build_indexes`. when a vnum appears more than once the first
+    entry wins, as in the byte-offset index, and the others are kept in
+    `duplicates` as (file type, vnum, path, path of the first) tuples.
+    entries that failed to parse are kept in `errors` as (path, error)
+    pairs.
+    """
+
+    def __init__(self):
+        self.mobs = {}
+        self.objects = {}
+        self.rooms = {}
+        self.shops = {}
+        self.zones = {}
+        self.errors = []
+        self.duplicates = []
+        self.build_indexes()
+
+    @classmethod
+    def load(cls, world_dir):
+        world = cls()
+        first_paths = {}
+        for file_type, path in find_world_files(world_dir):
+            table = getattr(world, TABLES[file_type])
+            for record, error in iter_records(path):
+                if error:
+                    world.errors.append((path, error))
+                elif record.id not in table:
+                    table[record.id] = record
+                    first_paths[file_type, record.id] = path
+                else:
+                    world.duplicates.append((file_type, record.id, path, first_paths[file_type, record.id]))
+        world.build_indexes()
+        return world
+
+    def build_indexes(self):
+        self.zone_map = ZoneMap.from_zones(self.zones.values())
+        self.zone_by_vnum = self.zone_map.map_vnums(itertools.chain(self.mobs, self.objects, self.rooms, self.shops))
+        self.mob_loads = collections.defaultdict(list)
+        self.object_loads = collections.defaultdict(list)
+        self.shops_by_keeper = collections.defaultdict(list)
+        self.doors_by_key = collections.defaultdict(list)
+
+        for zone in self.zones.values():
+            self.index_zone_commands(zone)
+
+        for shop in self.shops.values():
+            self.shops_by_keeper[shop.shopkeeper].append(shop)
+
+        for room in self.rooms.values():
+            for exit in room.exits:
+                if exit.key_number > 0:
+                    self.doors_by_key[exit.key_number].append(KeyDoor(room.id, exit))
+
+    def index_zone_commands(self, zone):
+        # (container vnum, contents) pairs still to be walked, outermost first
+        containers = collections.deque()
+
+        for mob in zone.mobs:
+            self.mob_loads[mob.mob].append(MobLoad(zone.id, mob))
+            for given in mob.inventory:
+                self.object_loads[given.id].append(ObjectLoad(zone.id, 'inventory', mob.mob, given))
+                containers.append((given.id, given.contents))
+            for equipped in mob.equipped:
+                self.object_loads[equipped.id].append(ObjectLoad(zone.id, 'equipped', mob.mob, equipped))
+                containers.append((equipped.id, equipped.contents))
+
+        for loaded in zone.objects:
+            self.object_loads[loaded.id].append(ObjectLoad(zone.id, 'room', loaded.room, loaded))
+            containers.append((loaded.id, loaded.contents))
+
+        while containers:
+            container, contents = containers.popleft()
+            for put in contents:
+                self.object_loads[put.id].append(ObjectLoad(zone.id, 'container', container, put))
+                containers.append((put.id, put.contents))
+
+    def zone_for_vnum(self, vnum):
+        """
+        the id of the zone whose range holds `vnum`, whether or not an
+        entry with that vnum exists
+        """
+        return self.zone_map.zone_for_vnum(vnum)
+
+    def get_zone(self, vnum):
+        """
+        the zone whose range holds the mob, object, room or shop `vnum`
+        """
+        zone = self.zone_by_vnum.get(vnum)
+        return None if zone is None else self.zones[zone]
+
+    def get_exit(self, vnum, direction):
+        """
+        the exit of room `vnum` in `direction`, or None
+        """
+        room = self.rooms.get(vnum)
+        for exit in room.exits if room else ():
+            if exit.dir == direction:
+                return exit
+        return None
+
+    def get_exit_room(self, vnum, direction):
+        """
+        the room that exit `direction` of room `vnum` leads to, or None
+        """
+        exit = self.get_exit(vnum, direction)
+        return None if exit is None else self.rooms.get(exit.room_linked)
+
+
+def get_default_snapshot_path(world_dir):
+    """
+    the snapshot lives next to the world folder, e.g. `world.snapshot.pickle`
+    """
+    return os.path.normpath(world_dir) + '.snapshot.pickle'
+
+
+def get_source_records(world_dir, parser_version):
+    """
+    manifest-style records (size, mtime and hash) for every world file,
+    keyed on the path relative to `world_dir`
+    """
+    sources = {}
+    for _, path in find_world_files(world_dir):
+        _, sources[os.path.relpath(path, world_dir)] = check_source(path, None, parser_version)
+    return sources
+
+
+def check_sources(world_dir, sources, parser_version):
+    """
+    whether the world files are the ones in `sources`. files whose size and
+    mtime match are trusted, anything else is compared by hash.
+    """
+    paths = [path for _, path in find_world_files(world_dir)]
+    if sorted(os.path.relpath(path, world_dir) for path in paths) != sorted(sources):
+        return False
+
+    for path in paths:
+        is_unchanged, _ = check_source(path, sources[os.path.relpath(path, world_dir)], parser_version)
+        if not is_unchanged:
+            return False
+    return True
+
+
+def save_snapshot(path, world, sources, parser_version):
+    """
+    the snapshot is two pickles in one file: a small header with the key it
+    was written for, then the world, so a stale snapshot is rejected without
+    unpickling the world
+    """
+    header = dict(version=SNAPSHOT_VERSION, parser_version=parser_version, sources=sources)
+
+    # write to the side and swap in, like the manifest
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(header, f, protocol=5)
+        pickle.dump(world, f, protocol=5)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path, world_dir, parser_version):
+    """
+    the world saved in the snapshot at `path`, or None when there is no
+    snapshot or it was written for other sources or parser code
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = pickle.load(f)
+            if not isinstance(header, dict) or header.get('version') != SNAPSHOT_VERSION:
+                return None
+            if header['parser_version'] != parser_version:
+                return None
+            if not check_sources(world_dir, header['sources'], parser_version):
+                return None
+            return pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def load_world(world_dir, cached=True, snapshot_path=None):
+    """
+    World.load, but with `cached` the result is written to a snapshot (by
+    default next to `world_dir`) and later calls load the snapshot instead
+    of parsing, for as long as no world file or parser module has changed
+    """
+    if not cached:
+        return World.load(world_dir)
+
+    snapshot_path = snapshot_path or get_default_snapshot_path(world_dir)
+    parser_version = get_parser_version(SNAPSHOT_MODULES)
+    world = load_snapshot(snapshot_path, world_dir, parser_version)
+    if world is None:
+        # hash the sources before parsing them, so a file edited during the
+        # parse leaves a snapshot that won't match it
+        sources = get_source_records(world_dir, parser_version)
+        world = World.load(world_dir)
+        save_snapshot(snapshot_path, world, sources, parser_version)
+    return world
@@ -2,6 +2,7 @@
 import re
 
 from constants import MOB_EQUIP
+from utils import EntryCursor
 
 COMMAND_RE = r'(\d+)'
 COMMAND_PATTERN = re.compile(COMMAND_RE)
@@ -13,22 +14,38 @@ def get_command_fields(command, n_fields=4):
     return fields
 
 
-def get_contents(commands, i, curr_obj):
-    # get the current container
-    contents = []
-
-    i += 1
-    while i < len(commands) and commands[i].startswith('P'):
-        _, new_object, max, container = get_command_fields(commands[i])
-
-        # only append object if the listed container is th
-        if container == curr_obj:
-            subcontents = get_contents(commands, i, new_object)
-            to_append = dict(id=new_object, max=max, contents=subcontents)
-            contents.append(to_append)
-
-        i += 1
-
+def nest_run(root, run):
+    """
+    builds the contents of object `root` from the run of P commands that
+    follows it. an object goes into every earlier object in the run (or the
+    root) whose vnum is its container. the run is walked backwards once,
+    keeping the objects put into each container vnum further down the run,
+    instead of rescanning the rest of the run for every command.
+    """
+    later = {}  # container vnum -> objects put into it, last one first
+    for command in reversed(run):
+        _, new_object, max, container = get_command_fields(command)
+        contents = later.get(new_object, [])[::-1]
+        later.setdefault(container, []).append(dict(id=new_object, max=max, contents=contents))
+    return later.get(root, [])[::-1]
+
+
+def get_contents(commands):
+    """
+    returns the nested contents of every E/G/O command, keyed on its
+    position in `commands`
+    """
+    contents = {}
+    run = []
+    for i in range(len(commands) - 1, -1, -1):
+        command = commands[i]
+        if command.startswith('P'):
+            run.append(command)
+            continue
+        if command.startswith(('E', 'G', 'O')) and run:
+            run.reverse()
+            contents[i] = nest_run(get_command_fields(command, 2)[1], run)
+        run = []
     return contents
 
 
@@ -38,6 +55,9 @@ def parse_commands(commands, d):
     remove_objects = []
     doors = []
 
+    # only commands before the 'S' line are read
+    nested = get_contents(commands[: commands.index('S')] if 'S' in commands else commands)
+
     for i, curr in enumerate(commands):
         if curr == 'S':
             break  # we're done
@@ -51,14 +71,14 @@ def parse_commands(commands, d):
         elif curr.startswith('E'):
             _, obj, max, location = get_command_fields(curr)
             note = MOB_EQUIP.get(location, None)
-            contents = get_contents(commands, i, obj)
+            contents = nested.get(i, [])
             new_obj = dict(location=location, max=max, id=obj, note=note, contents=contents)
             mobs[-1]['equipped'].append(new_obj)
 
         # put an object in a mob's inventory
         elif curr.startswith('G'):
             _, obj, max = get_command_fields(curr, 3)
-            contents = get_contents(commands, i, obj)
+            contents = nested.get(i, [])
             new_obj = dict(max=max, id=obj, contents=contents)
 
             # give the object to the most recently parsed mob
@@ -67,7 +87,7 @@ def parse_commands(commands, d):
         # load an object in a room
         elif curr.startswith('O'):
             _, obj, max, room = get_command_fields(curr)
-            contents = get_contents(commands, i, obj)
+            contents = nested.get(i, [])
             new_obj = dict(max=max, id=obj, room=room, contents=contents)
             objects.append(new_obj)
 
@@ -91,24 +111,32 @@ def parse_commands(commands, d):
     return d
 
 
+def read_zone_line(cursor):
+    """
+    the next line that isn't a comment
+    """
+    line = cursor.read_line()
+    while line.startswith('*'):
+        line = cursor.read_line()
+    return line.rstrip()
+
+
 def parse_zone(text):
     d = dict()
 
-    fields = [line.rstrip() for line in text.strip().split('\n')]
+    cursor = EntryCursor(text)
 
-    # remove comment lines
-    fields = [f for f in fields if not f.startswith('*')]
+    d['id'] = int(read_zone_line(cursor))
+    d['name'] = read_zone_line(cursor).rstrip('~')
 
-    d['id'] = int(fields[0])
-    d['name'] = fields[1].rstrip('~')
-
-    bottom, top, lifespan, reset_mode = map(int, fields[2].split())
+    bottom, top, lifespan, reset_mode = map(int, read_zone_line(cursor).split())
     d['bottom_room'] = bottom
     d['top_room'] = top
     d['lifespan'] = lifespan
     d['reset_mode'] = reset_mode
 
-    commands = fields[3:]
+    # remove comment lines
+    commands = [line.rstrip() for line in cursor.iter_lines() if not line.startswith('*')]
     d = parse_commands(commands, d)
 
     return d
@@ -0,0 +1,102 @@
+# coding: utf-8
+"""
+which zone owns a vnum, answered with a bisect over sorted intervals
+instead of a scan of every zone's bottom_room..top_room range:
+
+    zones = ZoneMap.from_zones(World.load('world').zones.values())
+    zones.zone_for_vnum(3001)
+    zones.overlaps
+
+ranges that overlap are allowed, and listed in `overlaps` as pairs of zone
+ids. inside an overlap the vnum belongs to the zone with the highest
+bottom_room, i.e. the innermost or latest starting one.
+"""
+import bisect
+import heapq
+
+
+class ZoneMap(object):
+    """
+    the number line cut into disjoint intervals at every zone boundary:
+    `starts` are the first vnums of the intervals, sorted, and `owners`
+    the matching zone ids (None for the gaps between zones)
+    """
+
+    def __init__(self, starts, owners, overlaps):
+        self.starts = starts
+        self.owners = owners
+        self.overlaps = overlaps
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        """
+        build from (bottom, top, zone id) tuples, both ends included
+        """
+        ranges = sorted(ranges)
+        boundaries = sorted(set(b for bottom, top, _ in ranges for b in (bottom, top + 1)))
+
+        starts, owners = [], []
+        active = []  # heap of (-bottom, zone id, top) for the ranges covering a boundary
+        i = 0
+        for start in boundaries:
+            while i < len(ranges) and ranges[i][0] <= start:
+                bottom, top, zone = ranges[i]
+                heapq.heappush(active, (-bottom, zone, top))
+                i += 1
+            while active and active[0][2] < start:
+                heapq.heappop(active)
+
+            # a range ending inside another can leave stale entries below
+            # the top of the heap, but those are never the innermost
+            owner = active[0][1] if active else None
+            if not owners or owners[-1] != owner:
+                starts.append(start)
+                owners.append(owner)
+
+        return cls(starts, owners, find_overlaps(ranges))
+
+    @classmethod
+    def from_zones(cls, zones):
+        """
+        build from zone records or parsed zone dicts
+        """
+        return cls.from_ranges(get_zone_range(zone) for zone in zones)
+
+    def zone_for_vnum(self, vnum):
+        """
+        the id of the zone owning the room, mob, object or shop `vnum`, or
+        None if it is outside every zone
+        """
+        i = bisect.bisect_right(self.starts, vnum) - 1
+        return self.owners[i] if i >= 0 else None
+
+    def map_vnums(self, vnums):
+        """
+        {vnum: zone id} for the `vnums` inside a zone
+        """
+        zone_by_vnum = {}
+        for vnum in vnums:
+            zone = self.zone_for_vnum(vnum)
+            if zone is not None:
+                zone_by_vnum[vnum] = zone
+        return zone_by_vnum
+
+
+def get_zone_range(zone):
+    if isinstance(zone, dict):
+        return zone['bottom_room'], zone['top_room'], zone['id']
+    return zone.bottom_room, zone.top_room, zone.id
+
+
+def find_overlaps(ranges):
+    """
+    (zone id, zone id) for every pair of ranges sharing a vnum, from
+    (bottom, top, zone id) tuples sorted by bottom
+    """
+    overlaps = []
+    open_ranges = []  # (top, zone id) of the ranges started so far
+    for bottom, top, zone in ranges:
+        open_ranges = [(other_top, other) for other_top, other in open_ranges if other_top >= bottom]
+        overlaps.extend((other, zone) for _, other in open_ranges)
+        open_ranges.append((top, zone))
+    return overlaps